@@ -0,0 +1,251 @@
+import argparse
+import fnmatch
+import gc
+import json
+import os
+import sys
+import time
+import tracemalloc
+import numpy as np
+import pandas as pd
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from config import settings
+import database
+from models import RetailData
+from services import calculations, metrics
+from services.data_preprocessing import preprocess_inventory_data
+from services.dataset import RetailDataset, dataset_cache
+from services.schema import apply_schema
+from services.stockouts import detect_stockout_episodes
+from benchmarks.synthetic import generate_retail_data, iter_documents
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+
+# Differences below these are noise rather than regressions, whatever the tolerance
+MIN_SECONDS_DELTA = 0.01
+MIN_PEAK_MB_DELTA = 1.0
+# Rows of the calibration workload (see calibrate)
+CALIBRATION_ROWS = 200000
+
+
+class BenchmarkContext:
+    """The generated rows of one scale, and what the cases derive from them."""
+
+    def __init__(self, df):
+        self.df = df
+        self.rows = len(df)
+        self.dataset = RetailDataset.from_frame(apply_schema(preprocess_inventory_data(df.copy())))
+        first = df.iloc[0]
+        self.store_id, self.product_id = first["StoreId"], first["ProductID"]
+        pair_rows = df[(df["StoreId"] == self.store_id) & (df["ProductID"] == self.product_id)]
+        self.pair_data = [RetailData(**record) for record in pair_rows.astype(object).where(pair_rows.notna(), None).to_dict("records")]
+        self.bulk_df = apply_schema(df[metrics.BULK_METRICS_FIELDS])
+
+
+# name -> (function of the context, tier). "compute" cases run on rows already in memory;
+# "db" cases include the fetch from the stand-in database and compute from raw rows
+# (use_rollup=False); "server" cases need a real mongod (aggregation operators and the rollup),
+# so they are skipped when running on mongomock.
+CASES = {
+    "calculations.calculate_turnover[monthly]": (lambda c: calculations.calculate_turnover(dataset=c.dataset), "compute"),
+    "calculations.calculate_turnover[daily]": (lambda c: calculations.calculate_turnover(period="daily", dataset=c.dataset), "compute"),
+    "calculations.calculate_stockout_rate": (lambda c: calculations.calculate_stockout_rate(dataset=c.dataset), "compute"),
+    "calculations.calculate_stockout_heatmap_data": (lambda c: calculations.calculate_stockout_heatmap_data(dataset=c.dataset), "compute"),
+    "calculations.calculate_product_metrics": (lambda c: calculations.calculate_product_metrics(c.dataset.select(fields=calculations.PRODUCT_METRICS_FIELDS)), "compute"),
+    "calculations.get_product_metrics": (lambda c: calculations.get_product_metrics(dataset=c.dataset), "compute"),
+    "calculations.calculate_days_of_supply": (lambda c: calculations.calculate_days_of_supply(dataset=c.dataset), "compute"),
+    "calculations.calculate_carrying_cost": (lambda c: calculations.calculate_carrying_cost(dataset=c.dataset), "compute"),
+    "calculations.detect_slow_obsolete_items": (lambda c: calculations.detect_slow_obsolete_items(dataset=c.dataset), "compute"),
+    "stockouts.detect_stockout_episodes": (lambda c: detect_stockout_episodes(c.dataset.df), "compute"),
+    "metrics.turnover_time_series": (lambda c: metrics.turnover_time_series(c.bulk_df, ["daily", "weekly", "monthly"], [7]), "compute"),
+    "metrics.turnover_records": (lambda c: metrics.turnover_records(metrics.turnover_time_series(c.bulk_df)["daily"]), "compute"),
+    "metrics.calculate_metrics": (lambda c: metrics.calculate_metrics(c.store_id, c.product_id, c.pair_data, ["weekly"], [7]), "compute"),
+    "metrics.calculate_bulk_metrics": (lambda c: list(metrics.calculate_bulk_metrics(c.bulk_df)), "compute"),
+    "db.calculations.calculate_turnover": (lambda c: calculations.calculate_turnover(use_rollup=False), "db"),
+    "db.calculations.calculate_stockout_rate": (lambda c: calculations.calculate_stockout_rate(use_rollup=False), "db"),
+    "db.calculations.get_product_metrics": (lambda c: calculations.get_product_metrics(use_rollup=False), "db"),
+    "db.calculations.detect_slow_obsolete_items": (lambda c: calculations.detect_slow_obsolete_items(use_rollup=False), "db"),
+    "db.metrics.load_bulk_metrics_data": (lambda c: metrics.load_bulk_metrics_data(filters={}), "db"),
+    "db.metrics.all_metrics_pair": (lambda c: metrics.calculate_metrics(c.store_id, c.product_id, database.get_validated_data(RetailData, "retail_data", {"StoreId": c.store_id, "ProductID": c.product_id})), "db"),
+    "server.calculations.calculate_stockout_heatmap_data": (lambda c: calculations.calculate_stockout_heatmap_data(use_rollup=False), "server"),
+    "server.rollup.calculate_turnover": (lambda c: calculations.calculate_turnover(), "server"),
+    "server.rollup.calculate_stockout_rate": (lambda c: calculations.calculate_stockout_rate(), "server"),
+    "server.rollup.get_product_metrics": (lambda c: calculations.get_product_metrics(), "server"),
+    "server.rollup.detect_slow_obsolete_items": (lambda c: calculations.detect_slow_obsolete_items(), "server"),
+}
+
+
+def connect(mongo_uri: str = None) -> bool:
+    """
+    Points the database module at a benchmark database: a local mongod when mongo_uri is given,
+    otherwise an in-memory mongomock client. Returns True for a real server.
+    """
+    if mongo_uri:
+        from pymongo import MongoClient
+        database.use_client(MongoClient(mongo_uri))
+        database.DATABASE_NAME = "inventory_benchmark"
+        return True
+    try:
+        import mongomock
+    except ImportError:
+        sys.exit("mongomock is required without --mongo-uri: pip install mongomock")
+    database.use_client(mongomock.MongoClient())
+    return False
+
+
+def load_database(df, server: bool):
+    """Replaces retail_data with the generated rows and, on a real server, builds the derived data."""
+    collection = database.get_db().retail_data
+    collection.delete_many({})
+    for batch in iter_documents(df):
+        collection.insert_many(batch, ordered=False)
+    database.bump_collection_version("retail_data")
+    if server:
+        from services.rollup import rebuild_rollup
+        from services.stockouts import refresh_stockout_episodes
+        database.create_indexes()
+        rebuild_rollup()
+        refresh_stockout_episodes()
+
+
+def calibrate(repeat: int = 5) -> float:
+    """
+    Times a fixed workload of pandas group-bys and sorts and a Python loop, keeping the fastest
+    of `repeat` runs. Case timings are divided by it, so a baseline stored on one machine can be
+    checked on another; measure runs it between the runs of each case, so both see the same load.
+    """
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame({"key": rng.integers(0, 1000, CALIBRATION_ROWS), "value": rng.random(CALIBRATION_ROWS)})
+    timings = []
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        df.groupby("key")["value"].agg(["sum", "mean", "last"])
+        df.sort_values(["key", "value"])
+        sum(len(str(value)) for value in range(CALIBRATION_ROWS // 4))
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def measure(func, context, repeat: int) -> dict:
+    """
+    Runs a case `repeat` times from a cold dataset cache and keeps the fastest run; peak memory
+    is taken from one more run under tracemalloc, which would distort the timings.
+    `relative` is the fastest run in units of the fastest calibration run (see calibrate).
+    """
+    timings = []
+    calibrations = []
+    for _ in range(repeat):
+        calibrations.append(calibrate(1))
+        dataset_cache.clear()
+        gc.collect()
+        start = time.perf_counter()
+        func(context)
+        timings.append(time.perf_counter() - start)
+
+    dataset_cache.clear()
+    gc.collect()
+    tracemalloc.start()
+    func(context)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    seconds = min(timings)
+    calibration = min(calibrations)
+    return {
+        "seconds": round(seconds, 6),
+        "relative": round(seconds / calibration, 4),
+        "rows_per_second": round(context.rows / seconds) if seconds > 0 else None,
+        "peak_mb": round(peak / 1024 / 1024, 3),
+        "calibration": round(calibration, 6),
+    }
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list:
+    """
+    Lists the results slower or more memory-hungry than the baseline by more than tolerance.
+    Timings are compared relative to the calibration workload, so the baseline's machine does not
+    matter; the baseline is scaled to this machine for the report and the minimum delta.
+    """
+    regressions = []
+    for key, result in results.items():
+        base = baseline.get(key)
+        if base is None:
+            continue
+        expected = base["relative"] * result["calibration"]
+        if result["relative"] > base["relative"] * (1 + tolerance) and result["seconds"] - expected > MIN_SECONDS_DELTA:
+            regressions.append(f"{key}: {result['seconds']:.4f}s vs baseline {expected:.4f}s on this machine ({result['relative']:.2f} vs {base['relative']:.2f} calibration units)")
+        if result["peak_mb"] > base["peak_mb"] * (1 + tolerance) and result["peak_mb"] - base["peak_mb"] > MIN_PEAK_MB_DELTA:
+            regressions.append(f"{key}: peak {result['peak_mb']:.1f} MB vs baseline {base['peak_mb']:.1f} MB")
+    return regressions
+
+
+def run(args) -> dict:
+    server = connect(args.mongo_uri)
+    if not server:
+        print("Without --mongo-uri the db cases compute from raw rows on mongomock; the rollup and aggregation paths are not benchmarked.")
+    # Measure the calculations themselves, not reads from an exported snapshot
+    settings.use_snapshot = False
+    results = {}
+    for rows in args.rows:
+        df = generate_retail_data(rows=rows, stores=args.stores, days=args.days, seed=args.seed)
+        context = BenchmarkContext(df)
+        cases = {name: case for name, case in CASES.items() if any(fnmatch.fnmatch(name, pattern) for pattern in args.only)}
+        db_cases = {name for name, (_, tier) in cases.items() if tier != "compute"}
+        use_db = db_cases and (server or rows <= args.max_db_rows)
+        if use_db:
+            load_database(df, server)
+
+        for name, (func, tier) in cases.items():
+            if tier == "server" and not server:
+                continue
+            if tier != "compute" and not use_db:
+                continue
+            result = measure(func, context, args.repeat)
+            key = f"{name}@{rows}"
+            results[key] = result
+            print(f"{key:60} {result['seconds']:>10.4f}s {result['relative']:>8.3f}x {result['rows_per_second'] or 0:>14,} rows/s {result['peak_mb']:>10.1f} MB")
+    return results
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmarks the calculations on generated retail data.")
+    parser.add_argument("--rows", type=int, nargs="+", default=[10000, 100000], help="Scales to run, in rows (10k to 10M).")
+    parser.add_argument("--stores", type=int, default=10)
+    parser.add_argument("--days", type=int, default=365)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=3, help="Timed runs per case; the fastest is kept.")
+    parser.add_argument("--only", nargs="+", default=["*"], help="Case name patterns, e.g. 'metrics.*'.")
+    parser.add_argument("--mongo-uri", help="Run the database cases against this mongod instead of mongomock.")
+    parser.add_argument("--max-db-rows", type=int, default=50000, help="Largest scale loaded into mongomock.")
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--tolerance", type=float, default=0.5, help="Allowed slowdown or memory growth over the baseline, as a fraction.")
+    parser.add_argument("--update-baseline", action="store_true", help="Store the results as the new baseline.")
+    args = parser.parse_args(argv)
+
+    results = run(args)
+
+    if args.update_baseline:
+        baseline = {}
+        if os.path.exists(args.baseline):
+            with open(args.baseline) as f:
+                baseline = json.load(f)
+        baseline.update(results)
+        with open(args.baseline, "w") as f:
+            json.dump(dict(sorted(baseline.items())), f, indent=4)
+        print(f"Stored {len(results)} results in {args.baseline}.")
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print(f"No baseline at {args.baseline}; run with --update-baseline to store one.")
+        return 0
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    regressions = compare(results, baseline, args.tolerance)
+    for regression in regressions:
+        print(f"REGRESSION {regression}")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
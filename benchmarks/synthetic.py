@@ -0,0 +1,84 @@
+import numpy as np
+import pandas as pd
+import math
+import os
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from typing import Iterator, List
+
+CATEGORIES = ["Groceries", "Toys", "Electronics", "Furniture", "Clothing"]
+REGIONS = ["North", "South", "East", "West"]
+WEATHER = ["Sunny", "Rainy", "Cloudy", "Snowy"]
+SEASONS = ["Winter", "Spring", "Summer", "Autumn"]
+
+
+def generate_retail_data(
+    rows: int = None,
+    stores: int = 10,
+    products: int = None,
+    days: int = 365,
+    start: str = "2022-01-01",
+    stockout_share: float = 0.05,
+    seed: int = 0,
+) -> pd.DataFrame:
+    """
+    Generates retail_data-shaped rows: one per product, store and day, ordered by product, store
+    and date, with every RetailData field. With `rows`, the number of products is chosen to
+    reach that many rows and the grid is cut to exactly `rows`. About stockout_share of the
+    rows have no inventory. Every column is built with vectorized NumPy operations, so tens of
+    millions of rows take seconds rather than minutes.
+    """
+    if products is None:
+        products = max(1, math.ceil(rows / (stores * days))) if rows else 100
+    total = products * stores * days
+    if rows is not None:
+        total = min(total, rows)
+    rng = np.random.default_rng(seed)
+
+    position = np.arange(total)
+    day = position % days
+    store = (position // days) % stores
+    product = position // (days * stores)
+
+    dates = pd.Timestamp(start) + pd.to_timedelta(day, unit="D")
+    product_price = rng.uniform(5, 100, products).round(2)
+    product_demand = rng.uniform(5, 50, products)
+    # Weekly and yearly seasonality on top of each product's base demand
+    season_factor = 1 + 0.2 * np.sin(2 * np.pi * day / 7) + 0.3 * np.sin(2 * np.pi * day / 365)
+    demand = product_demand[product] * season_factor
+    sales = rng.poisson(demand).astype(np.int64)
+    inventory = rng.integers(0, 500, total)
+    inventory[rng.random(total) < stockout_share] = 0
+    price = product_price[product]
+    discount = rng.choice([0, 5, 10, 15, 20], total)
+
+    month = dates.month.to_numpy()
+    return pd.DataFrame({
+        "Date": dates,
+        "StoreId": np.array([f"S{i:03d}" for i in range(stores)], dtype=object)[store],
+        "ProductID": np.array([f"P{i:05d}" for i in range(products)], dtype=object)[product],
+        "Category": np.array(CATEGORIES, dtype=object)[product % len(CATEGORIES)],
+        "Region": np.array(REGIONS, dtype=object)[store % len(REGIONS)],
+        "Inventory": inventory,
+        "Sales": sales,
+        "Orders": rng.poisson(demand * 1.1).astype(np.int64),
+        "Demand": (demand + rng.normal(0, 2, total)).clip(0).round(2),
+        "Price": price,
+        "Discount": discount,
+        "Weather": np.array(WEATHER, dtype=object)[rng.integers(0, len(WEATHER), total)],
+        "Promotion": rng.integers(0, 2, total),
+        "CompetitorPrice": (price * rng.uniform(0.9, 1.1, total)).round(2),
+        "Seasonality": np.array(SEASONS, dtype=object)[(month % 12) // 3],
+        "cost": (price * 0.8).round(2),
+        "abc_class": None,
+        "xyz_class": None,
+    })
+
+
+def iter_documents(df: pd.DataFrame, batch_size: int = 50000) -> Iterator[List[dict]]:
+    """Yields the rows as batches of MongoDB documents."""
+    for start in range(0, len(df), batch_size):
+        chunk = df.iloc[start:start + batch_size].astype(object)
+        chunk = chunk.where(chunk.notna(), None)
+        chunk["Date"] = np.array(df["Date"].iloc[start:start + batch_size].dt.to_pydatetime())
+        yield chunk.to_dict("records")
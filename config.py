@@ -3,6 +3,36 @@ from pydantic_settings import BaseSettings
 class Settings(BaseSettings):
     mongo_uri: str = "mongodb://localhost:27017/"
     debug: bool = True
+    # MongoDB connection pool; size it to the number of requests expected to overlap
+    mongo_max_pool_size: int = 100
+    mongo_min_pool_size: int = 0
+    # Threads running blocking database and pandas work for the async routes
+    blocking_workers: int = 16
+    # Upper bound for the in-process cache of preprocessed frames; 0 disables the cache
+    dataset_cache_max_mb: int = 512
+    # Rows parsed and inserted per batch by the streaming CSV upload endpoints
+    upload_chunk_rows: int = 50000
+    # Records per chunk for the NDJSON/CSV streaming responses
+    stream_batch_size: int = 1000
+    # Rank products for ABC/XYZ classes within each store instead of across all stores
+    classification_by_store: bool = False
+    # Worker processes computing reports concurrently in reporting/generate_reports.py
+    report_workers: int = 4
+    # Worker processes fitting demand forecast models, and products per worker task
+    forecast_workers: int = 4
+    forecast_shard_products: int = 1000
+    # Fit one forecast model per product and store instead of per product
+    forecast_by_store: bool = False
+    # Directory of the versioned forecast models (relative paths are relative to the project root)
+    # and the number of versions kept there
+    forecast_model_dir: str = "forecast_models"
+    forecast_keep_versions: int = 3
+    # Directory of the memory-mapped retail_data snapshots (see scripts/export_snapshot.py), and
+    # whether datasets are read from a snapshot taken at the current collection version
+    snapshot_dir: str = "snapshots"
+    use_snapshot: bool = True
+    # Record per-stage timings, row counters and latency histograms (served at /internal/telemetry)
+    telemetry_enabled: bool = True
 
     class Config:
         env_file = ".env"
@@ -1,35 +1,221 @@
-from pymongo import MongoClient
+from pymongo import MongoClient, ReturnDocument, UpdateOne
+from pymongo.errors import OperationFailure
 from dotenv import load_dotenv
 import os
-import sys
-from typing import List, Type, Any
-from models import RetailData
+from typing import Iterable, Iterator, List, Tuple, Type, Optional, Union, get_args, get_origin
+from datetime import datetime
+from functools import lru_cache
+import itertools
+import threading
+import uuid
+import pandas as pd
+from config import settings
+from telemetry import count, stage
 
 load_dotenv()
 MONGO_URI = os.getenv("MONGO_URI", "mongodb://localhost:27017/")
+DATABASE_NAME = "inventory_db"
 
-# It is recommended to manage the client's lifecycle with the application's lifespan.
-# For FastAPI, you can use a dependency injection system to manage the database connection.
-client = MongoClient(MONGO_URI)
-db = client["inventory_db"]
+# The client is opened and closed by the FastAPI lifespan (see main.py). Scripts and the
+# reporting jobs get one lazily on first use.
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client() -> MongoClient:
+    """
+    Returns the shared MongoClient, creating it with the configured connection pool on first use.
+    """
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = MongoClient(
+                    MONGO_URI,
+                    maxPoolSize=settings.mongo_max_pool_size,
+                    minPoolSize=settings.mongo_min_pool_size,
+                )
+    return _client
+
+
+def use_client(client):
+    """
+    Replaces the shared client, e.g. with an in-memory stand-in such as mongomock.MongoClient()
+    for benchmarks. The previous client is closed.
+    """
+    global _client
+    with _client_lock:
+        if _client is not None and _client is not client:
+            _client.close()
+        _client = client
+
+
+def get_db():
+    """Returns the application database."""
+    return get_client()[DATABASE_NAME]
+
+
+def close_client():
+    """Closes the shared MongoClient. A new one is created on the next get_client call."""
+    global _client
+    with _client_lock:
+        if _client is not None:
+            _client.close()
+            _client = None
+
+# Holds one {"_id": <collection name>, "version": <int>} document per collection.
+# The version is bumped on every write so in-process caches can detect stale data.
+VERSIONS_COLLECTION = "collection_versions"
+
+# Per (ProductID, StoreId, month) aggregates of retail_data, maintained at ingest (see services/rollup.py)
+ROLLUP_COLLECTION = "retail_rollup"
+
+# Stockout episodes per store and product, maintained at ingest (see services/stockouts.py)
+EPISODES_COLLECTION = "stockout_episodes"
+
+# Latest ABC/XYZ class per product (or product and store), maintained at ingest (see services/classification.py)
+CLASSES_COLLECTION = "product_classes"
+
+# Natural key of a retail_data document; merge ingestion upserts on it
+RETAIL_DATA_KEY = ["Date", "StoreId", "ProductID"]
+
+# "replace" clears the collection before inserting, "merge" upserts on RETAIL_DATA_KEY
+INGEST_MODES = ("replace", "merge")
+
+# Indexes per collection, derived from the query shapes in services/query_shapes.py.
+# create_indexes makes the database match this spec; check them with scripts/check_indexes.py.
+INDEX_SPECS = {
+    "retail_data": [
+        # Natural key, ordered so that it also serves ProductID and (ProductID, StoreId) lookups
+        {"name": "retail_data_key", "keys": [("ProductID", 1), ("StoreId", 1), ("Date", 1)], "unique": True},
+        {"name": "Category_1", "keys": [("Category", 1)]},
+        {"name": "abc_class_1", "keys": [("abc_class", 1)]},
+        # Store and region filters, optionally with a date range (see services/filters.py)
+        {"name": "StoreId_1_Date_1", "keys": [("StoreId", 1), ("Date", 1)]},
+        {"name": "Region_1_Date_1", "keys": [("Region", 1), ("Date", 1)]},
+        {"name": "Date_1", "keys": [("Date", 1)]},
+        # Stockout events only; a query must include both conditions to use it
+        {"name": "stockouts", "keys": [("ProductID", 1), ("Date", 1)],
+         "partialFilterExpression": {"Inventory": {"$lte": 0}, "Sales": {"$gt": 0}}},
+        # Rows without an Inventory value, which count as stockouts when they have sales
+        {"name": "Inventory_1", "keys": [("Inventory", 1)]},
+    ],
+    EPISODES_COLLECTION: [
+        {"name": "episode_key", "keys": [("ProductID", 1), ("StoreId", 1), ("start", 1)]},
+    ],
+    ROLLUP_COLLECTION: [
+        {"name": "rollup_key", "keys": [("ProductID", 1), ("StoreId", 1), ("month", 1)]},
+        {"name": "Category_1", "keys": [("Category", 1)]},
+    ],
+    # abc_class filters answered from the rollup look up the products of a class here
+    CLASSES_COLLECTION: [
+        {"name": "abc_class_1", "keys": [("abc_class", 1)]},
+    ],
+}
+
+# Indexes created by earlier versions that INDEX_SPECS replaces
+OBSOLETE_INDEXES = {
+    "retail_data": ["Store ID_1", "ProductID_1", "StoreId_1"], # "Store ID" is stored as StoreId; ProductID and StoreId are key prefixes
+    ROLLUP_COLLECTION: ["ProductID_1_StoreId_1_month_1", "abc_class_1"], # Rollup documents no longer hold abc_class
+}
+
+
+def _index_options(spec: dict) -> dict:
+    return {option: value for option, value in spec.items() if option != "keys"}
+
+
+def _index_matches(existing: dict, spec: dict) -> bool:
+    return (
+        [(field, int(direction)) for field, direction in existing["key"]] == spec["keys"]
+        and existing.get("unique", False) == spec.get("unique", False)
+        and existing.get("partialFilterExpression") == spec.get("partialFilterExpression")
+    )
 
 
 def create_indexes():
     """
     Create indexes for the collections.
+    Brings each collection in line with INDEX_SPECS: missing indexes are created, indexes
+    whose definition changed are rebuilt and OBSOLETE_INDEXES are dropped.
     """
-    db.retail_data.create_index([("ProductID", 1)])
-    db.retail_data.create_index([("Category", 1)])
-    db.retail_data.create_index([("abc_class", 1)])
-    db.retail_data.create_index([("Store ID", 1)])
-    db.retail_data.create_index([("Date", 1)])
+    for collection_name, specs in INDEX_SPECS.items():
+        _sync_indexes(get_db()[collection_name], specs, OBSOLETE_INDEXES.get(collection_name, []))
     print("Indexes created successfully.")
 
 
-def insert_data(data, collection_name: str):
-    """Insert data into a specified MongoDB collection."""
+def _sync_indexes(collection, specs: List[dict], obsolete: List[str] = ()):
+    """Brings the indexes of one collection in line with specs, dropping the obsolete ones."""
+    existing = collection.index_information()
+
+    for name in obsolete:
+        if name in existing:
+            collection.drop_index(name)
+            print(f"Dropped obsolete index {name} on {collection.name}.")
+
+    for spec in specs:
+        current = existing.get(spec["name"])
+        if current is not None:
+            if _index_matches(current, spec):
+                continue
+            if spec.get("unique") and _index_matches(current, {**spec, "unique": False}):
+                # Left over from a failed unique build below; rebuilding it would fail the same way
+                continue
+            collection.drop_index(spec["name"])
+        try:
+            collection.create_index(spec["keys"], **_index_options(spec))
+        except OperationFailure as e:
+            if not spec.get("unique"):
+                raise
+            # Existing duplicate keys prevent the unique index; merge ingestion still works without it
+            print(f"Could not create unique index {spec['name']} on {collection.name}: {e}")
+            collection.create_index(spec["keys"], **{**_index_options(spec), "unique": False})
+
+
+def explain_query(query: dict, collection_name: str = "retail_data") -> dict:
+    """
+    Returns the query planner's explanation of a find with the given filter.
+    """
+    return get_db()[collection_name].find(query).explain()
+
+
+def plan_stages(explanation: dict) -> List[Tuple[str, Optional[str]]]:
+    """
+    Lists the (stage, index name) pairs of the winning plan in an explain() result,
+    e.g. ("IXSCAN", "retail_data_key") or ("COLLSCAN", None).
+    """
+    stages = []
+
+    def walk(node):
+        if isinstance(node, dict):
+            if isinstance(node.get("stage"), str):
+                stages.append((node["stage"], node.get("indexName")))
+            for key, value in node.items():
+                # Rejected plans were not chosen and say nothing about the executed plan
+                if key != "rejectedPlans":
+                    walk(value)
+        elif isinstance(node, list):
+            for value in node:
+                walk(value)
+
+    walk(explanation.get("queryPlanner", explanation))
+    return stages
+
+
+def insert_data(data, collection_name: str, mode: str = "replace"):
+    """
+    Insert data into a specified MongoDB collection.
+    In "replace" mode the collection is cleared first; in "merge" mode the documents are
+    upserted on RETAIL_DATA_KEY and existing documents with other keys are kept.
+    """
+    if mode == "merge":
+        # upsert_batches bumps the version itself
+        try:
+            upsert_batches([data], collection_name)
+        except Exception as e:
+            print(f"Error inserting data into {collection_name}: {e}")
+        return
     try:
-        collection = db[collection_name]
+        collection = get_db()[collection_name]
         # Clear existing data in the collection
         collection.delete_many({})
         collection.insert_many(data, ordered=False)
@@ -37,36 +223,325 @@ def insert_data(data, collection_name: str):
     except Exception as e:
         # It is better to catch more specific exceptions.
         print(f"Error inserting data into {collection_name}: {e}")
+    finally:
+        # The collection may have changed even if the insert failed part way
+        bump_collection_version(collection_name)
 
 
-def get_validated_data(model: Type, collection_name: str = "retail_data", query: dict = None, skip: int = 0, limit: int = 0) -> List:
+def insert_batches(batches: Iterable[List[dict]], collection_name: str) -> Tuple[int, int]:
     """
-    Retrieves data from a specified MongoDB collection and validates it against a Pydantic model.
+    Replaces the contents of a specified MongoDB collection with documents from an iterable of batches.
+    Each batch is inserted before the next one is pulled, so only one batch is held in memory
+    and a slow database throttles the producer. The batches are written to a staging collection,
+    which gets the collection's INDEX_SPECS and is then renamed over it, so the collection keeps
+    its previous contents until every batch was written. When no batch arrives or pulling or
+    writing one fails, the collection is left as it was. Errors are raised to the caller.
+    Returns the number of rows and batches inserted.
+    """
+    db = get_db()
+    staging = db[f"{collection_name}_staging_{uuid.uuid4().hex[:12]}"]
+    num_rows = 0
+    num_batches = 0
+    received = False
+    try:
+        for batch in batches:
+            received = True
+            if not batch:
+                continue
+            staging.insert_many(batch, ordered=False)
+            num_rows += len(batch)
+            num_batches += 1
+        if not received:
+            staging.drop()
+            print(f"No batches to insert into {collection_name}; left it unchanged.")
+            return 0, 0
+        if num_rows == 0:
+            db.create_collection(staging.name)
+        _sync_indexes(staging, INDEX_SPECS.get(collection_name, []))
+        staging.rename(collection_name, dropTarget=True)
+    except BaseException:
+        staging.drop()
+        raise
+    bump_collection_version(collection_name)
+    print(f"Inserted {num_rows} rows in {num_batches} batches into {collection_name}.")
+    return num_rows, num_batches
+
+
+def upsert_batches(batches: Iterable[List[dict]], collection_name: str, key_fields: List[str] = None) -> Tuple[int, int]:
+    """
+    Merges documents from an iterable of batches into a specified MongoDB collection.
+    Each batch is written as one unordered bulk of upserts on key_fields (RETAIL_DATA_KEY by default):
+    documents with an existing key are updated, new keys are inserted and nothing else is touched,
+    so the cost is proportional to the incoming rows. Errors are raised to the caller.
+    Returns the number of rows and batches written.
+    """
+    if key_fields is None:
+        key_fields = RETAIL_DATA_KEY
+
+    collection = get_db()[collection_name]
+    num_rows = 0
+    num_batches = 0
+    written = False
+    try:
+        for batch in batches:
+            operations = [
+                UpdateOne({field: doc.get(field) for field in key_fields}, {"$set": doc}, upsert=True)
+                for doc in batch
+            ]
+            if not operations:
+                continue
+            written = True
+            collection.bulk_write(operations, ordered=False)
+            num_rows += len(operations)
+            num_batches += 1
+    finally:
+        if written:
+            bump_collection_version(collection_name)
+    print(f"Merged {num_rows} rows in {num_batches} batches into {collection_name}.")
+    return num_rows, num_batches
+
+
+def bulk_write(operations: list, collection_name: str) -> int:
+    """
+    Runs a list of pymongo write operations as one unordered bulk on a specified collection
+    and bumps its version. Errors are raised to the caller. Returns the number of modified documents.
+    """
+    if not operations:
+        return 0
+    try:
+        result = get_db()[collection_name].bulk_write(operations, ordered=False)
+    finally:
+        bump_collection_version(collection_name)
+    return result.modified_count + result.upserted_count
+
+
+def get_collection_version(collection_name: str) -> int:
+    """
+    Returns the current data version of a collection. Collections never written through
+    insert_data are at version 0.
+    """
+    document = get_db()[VERSIONS_COLLECTION].find_one({"_id": collection_name})
+    return document["version"] if document else 0
+
+
+def bump_collection_version(collection_name: str) -> int:
+    """
+    Increments the data version of a collection and returns the new version.
+    """
+    document = get_db()[VERSIONS_COLLECTION].find_one_and_update(
+        {"_id": collection_name},
+        {"$inc": {"version": 1}},
+        upsert=True,
+        return_document=ReturnDocument.AFTER,
+    )
+    return document["version"]
+
+
+def mark_derived_current(collection_name: str, source_collection: str = "retail_data"):
+    """
+    Records that a collection derived from source_collection (e.g. the rollup) now reflects the
+    source's current version.
+    """
+    get_db()[VERSIONS_COLLECTION].update_one(
+        {"_id": collection_name},
+        {"$set": {"source_version": get_collection_version(source_collection)}, "$inc": {"version": 1}},
+        upsert=True,
+    )
+
+
+def is_derived_current(collection_name: str, source_collection: str = "retail_data") -> bool:
+    """
+    Returns True if a derived collection was last built at the current version of source_collection.
+    """
+    document = get_db()[VERSIONS_COLLECTION].find_one({"_id": collection_name})
+    if not document or "source_version" not in document:
+        return False
+    return document["source_version"] == get_collection_version(source_collection)
+
+
+def iter_validated_data(model: Type, collection_name: str = "retail_data", query: dict = None, skip: int = 0, limit: int = 0, batch_size: int = 1000) -> Iterator[List]:
+    """
+    Streams data from a specified MongoDB collection in batches of up to batch_size documents
+    validated against a Pydantic model. Only one batch is held in memory at a time.
     A limit of 0 means no limit.
     """
     if query is None:
         query = {}
-    
-    collection = db[collection_name]
-    cursor = collection.find(query).skip(skip)
+
+    collection = get_db()[collection_name]
+    cursor = collection.find(query, batch_size=batch_size).skip(skip)
     if limit > 0:
         cursor = cursor.limit(limit)
-    raw_data = list(cursor)
-    
+
     validated_data = []
-    for item in raw_data:
-        if '_id' in item:
-            del item['_id']
-        try:
-            validated_data.append(model(**item))
-        except Exception as e:
-            print(f"Error validating data against model {model.__name__}: {e} for item: {item}")
-            # Optionally, handle invalid data, e.g., skip or log
-            continue
-            
+    while True:
+        # Fetch and validate whole batches so each stage is timed once per batch, not per row
+        with stage("fetch"):
+            items = list(itertools.islice(cursor, batch_size))
+        if not items:
+            break
+        count("rows_fetched", len(items))
+        with stage("validation"):
+            rejected = 0
+            for item in items:
+                if '_id' in item:
+                    del item['_id']
+                try:
+                    validated_data.append(model(**item))
+                except Exception as e:
+                    print(f"Error validating data against model {model.__name__}: {e} for item: {item}")
+                    rejected += 1
+        count("rows_rejected", rejected)
+        if len(validated_data) >= batch_size:
+            yield validated_data[:batch_size]
+            validated_data = validated_data[batch_size:]
+    if validated_data:
+        yield validated_data
+
+
+def get_validated_data(model: Type, collection_name: str = "retail_data", query: dict = None, skip: int = 0, limit: int = 0) -> List:
+    """
+    Retrieves data from a specified MongoDB collection and validates it against a Pydantic model.
+    A limit of 0 means no limit.
+    """
+    validated_data = []
+    for batch in iter_validated_data(model, collection_name, query, skip, limit):
+        validated_data.extend(batch)
     return validated_data
 
 
+@lru_cache(maxsize=None)
+def _column_types(model: Type) -> dict:
+    """
+    Maps each field of a Pydantic model to its scalar type and whether it is required.
+    Optional[X] annotations are unwrapped to X.
+    """
+    column_types = {}
+    for field_name, field in model.model_fields.items():
+        annotation = field.annotation
+        if get_origin(annotation) is Union:
+            annotation = next(arg for arg in get_args(annotation) if arg is not type(None))
+        column_types[field_name] = (annotation, field.is_required())
+    return column_types
+
+
+def _validate_columns(columns: dict, model: Type) -> pd.DataFrame:
+    """
+    Converts raw columns (lists or an untyped DataFrame) into typed pandas columns and validates
+    them column by column.
+    Rows with a missing required value, or with a present value the model rejects for the
+    field's type, are dropped: a non-string in a str field, a value that is not a whole number
+    in an int field, or one that does not parse in a float or datetime field.
+    Unlike per-row model validation, a NaN (or NaT) counts as a missing value in every field,
+    which is how an empty CSV cell is stored. Such rows are kept unless the field is required,
+    although the model only accepts NaN in float fields.
+    """
+    column_types = _column_types(model)
+    df = pd.DataFrame(columns)
+    invalid = pd.Series(False, index=df.index)
+
+    for col in df.columns:
+        if col not in column_types:
+            continue
+        field_type, required = column_types[col]
+        raw = df[col]
+        missing = raw.isna()
+
+        if field_type is datetime:
+            converted = pd.to_datetime(raw, errors='coerce')
+        elif field_type in (int, float):
+            converted = pd.to_numeric(raw, errors='coerce')
+            if field_type is int:
+                # Fractional and infinite values (x % 1 is NaN) are not integers
+                converted = converted.where(converted.isna() | (converted % 1 == 0))
+        elif field_type is str:
+            if pd.api.types.infer_dtype(raw, skipna=True) in ('string', 'empty'):
+                converted = raw
+            else:
+                converted = raw.where(missing | raw.map(lambda v: isinstance(v, str)), None)
+        else:
+            continue
+
+        invalid |= converted.isna() & ~missing
+        if required:
+            invalid |= missing
+        df[col] = converted
+
+    num_invalid = int(invalid.sum())
+    count("rows_rejected", num_invalid)
+    if num_invalid:
+        print(f"Dropped {num_invalid} rows failing validation against model {model.__name__}.")
+        df = df[~invalid]
+
+    return df
+
+
+def get_columnar_data(model: Type, collection_name: str = "retail_data", query: dict = None, fields: List[str] = None, batch_size: int = 50000, validate: bool = True) -> pd.DataFrame:
+    """
+    Retrieves data from a specified MongoDB collection as a typed pandas DataFrame.
+    Only the projected fields are fetched. Cursor batches are converted straight into
+    typed columns and validated per column against the Pydantic model, so no model
+    instance is built per document. Defaults to all fields of the model.
+    With validate=False the values are returned as fetched.
+    """
+    if query is None:
+        query = {}
+    if fields is None:
+        fields = list(model.model_fields)
+
+    projection = {field: 1 for field in fields}
+    projection["_id"] = 0
+
+    collection = get_db()[collection_name]
+    cursor = collection.find(query, projection, batch_size=batch_size)
+
+    frames = []
+    while True:
+        with stage("fetch"):
+            batch = list(itertools.islice(cursor, batch_size))
+        if not batch:
+            break
+        count("rows_fetched", len(batch))
+        with stage("frame_build"):
+            frame = pd.DataFrame({field: [doc.get(field) for doc in batch] for field in fields})
+        if validate:
+            with stage("validation"):
+                frame = _validate_columns(frame, model)
+        frames.append(frame)
+
+    with stage("frame_build"):
+        if not frames:
+            return pd.DataFrame(columns=fields)
+        if len(frames) == 1:
+            return frames[0].reset_index(drop=True)
+        return pd.concat(frames, ignore_index=True)
+
+
+def aggregate(pipeline: List[dict], collection_name: str = "retail_data") -> List[dict]:
+    """
+    Runs an aggregation pipeline on a specified MongoDB collection and returns the results.
+    Intended for pipelines that reduce the data server-side to a small result set.
+    """
+    collection = get_db()[collection_name]
+    with stage("fetch"):
+        results = list(collection.aggregate(pipeline, allowDiskUse=True))
+    count("rows_fetched", len(results))
+    return results
+
+
+def count_documents(query: dict = None, collection_name: str = "retail_data", limit: int = 0) -> int:
+    """
+    Counts the documents matching a query. A limit of 0 means no limit.
+    """
+    if query is None:
+        query = {}
+    collection = get_db()[collection_name]
+    with stage("fetch"):
+        if limit > 0:
+            return collection.count_documents(query, limit=limit)
+        return collection.count_documents(query)
+
+
 def get_data(collection_name: str = "retail_data", query=None, skip: int = 0, limit: int = 100):
     """
     Retrieve data from a specified MongoDB collection.
@@ -75,5 +550,5 @@ def get_data(collection_name: str = "retail_data", query=None, skip: int = 0, li
     """
     if query is None:
         query = {}
-    collection = db[collection_name]
+    collection = get_db()[collection_name]
     return list(collection.find(query).skip(skip).limit(limit))
\ No newline at end of file
@@ -0,0 +1,45 @@
+import asyncio
+import contextvars
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from config import settings
+
+# Thread pool for blocking pymongo I/O and pandas work issued from async routes.
+# It is started and shut down by the FastAPI lifespan (see main.py).
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def start_executor(max_workers: int = None) -> ThreadPoolExecutor:
+    """
+    Starts the shared thread pool if it is not running and returns it.
+    """
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=max_workers or settings.blocking_workers,
+                thread_name_prefix="blocking",
+            )
+    return _executor
+
+
+def shutdown_executor():
+    """Waits for running tasks and shuts the shared thread pool down."""
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=True)
+            _executor = None
+
+
+async def run_blocking(func, *args, **kwargs):
+    """
+    Runs a blocking function in the shared thread pool and awaits its result,
+    so the event loop keeps serving other requests in the meantime.
+    The caller's context variables (e.g. the request telemetry) are visible to the function.
+    """
+    loop = asyncio.get_running_loop()
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(start_executor(), functools.partial(context.run, func, *args, **kwargs))
@@ -1,18 +1,30 @@
 import sys
 import os
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
-from routers import metrics, data, inventory
-from database import create_indexes
+from routers import metrics, data, inventory, forecast, internal
+from database import create_indexes, get_client, close_client
+from executor import start_executor, shutdown_executor, run_blocking
+from telemetry import TelemetryMiddleware
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Open the MongoDB connection pool and the blocking-work thread pool for the app's lifetime
+    get_client()
+    start_executor()
+    await run_blocking(create_indexes)
+    yield
+    shutdown_executor()
+    close_client()
 
 app = FastAPI(
     title="Inventory Forecasting API",
     description="API for forecasting inventory levels and calculating metrics using the Retail Store Inventory Forecasting Dataset.",
-    version="0.1.0"
+    version="0.1.0",
+    lifespan=lifespan
 )
 
-@app.on_event("startup")
-async def startup_event():
-    create_indexes()
+app.add_middleware(TelemetryMiddleware)
 
 # Include routers for different tasks
 
@@ -20,6 +32,8 @@ async def startup_event():
 app.include_router(data.router, prefix="/data", tags=["data"])
 app.include_router(inventory.router, prefix="/inventory", tags=["inventory"])
 app.include_router(metrics.router, prefix="/metrics", tags=["metrics"])
+app.include_router(forecast.router, prefix="/forecast", tags=["forecast"])
+app.include_router(internal.router, prefix="/internal", include_in_schema=False)
 
 @app.get("/", tags=["root"])
 async def read_root():
@@ -1,6 +1,6 @@
 from pydantic import BaseModel, Field, Extra
-from typing import Optional
-from datetime import datetime
+from typing import List, Optional
+from datetime import date, datetime
 
 class RetailData(BaseModel):
     Date: datetime
@@ -20,6 +20,7 @@ class RetailData(BaseModel):
     Seasonality: Optional[str] = None
     cost: Optional[float] = None
     abc_class: Optional[str] = None
+    xyz_class: Optional[str] = None
 
     class Config:
         populate_by_name = True
@@ -42,6 +43,9 @@ class DataStatusResponse(BaseModel):
 class MetricRequest(BaseModel):
     store_id: str = Field(..., alias='Store ID')
     product_id: str = Field(..., alias='Product ID')
+    # Extra turnover series, e.g. ["weekly", "monthly"] and [7, 30] for rolling 7 and 30 day windows
+    granularities: Optional[List[str]] = None
+    rolling_windows: Optional[List[int]] = None
 
     class Config:
         extra = Extra.allow
@@ -51,4 +55,39 @@ class DataStatusResponse(BaseModel):
     record_count: int
 
     class Config:
-        extra = Extra.allow
\ No newline at end of file
+        extra = Extra.allow
+
+class BulkMetricRequest(BaseModel):
+    """
+    Store/product pairs for /metrics/all-metrics/bulk. When pairs is omitted, every pair
+    matching the optional filters is computed.
+    """
+    pairs: Optional[List[MetricRequest]] = None
+    store_id: Optional[str] = Field(None, alias='Store ID')
+    product_id: Optional[str] = Field(None, alias='Product ID')
+    category: Optional[str] = Field(None, alias='Category')
+    region: Optional[str] = Field(None, alias='Region')
+
+    class Config:
+        populate_by_name = True
+        extra = Extra.allow
+
+class ForecastTrainRequest(BaseModel):
+    """
+    Products to (re)train forecast models for; all products when omitted. by_store overrides
+    the FORECAST_BY_STORE setting.
+    """
+    product_ids: Optional[List[str]] = None
+    by_store: Optional[bool] = None
+
+class InventoryFilter(BaseModel):
+    """
+    Row filters accepted by every /inventory endpoint. Each given field narrows the rows read;
+    the date range includes both start_date and end_date.
+    """
+    store_id: Optional[str] = None
+    region: Optional[str] = None
+    category: Optional[str] = None
+    abc_class: Optional[str] = None
+    start_date: Optional[date] = None
+    end_date: Optional[date] = None
@@ -1,36 +1,82 @@
 import os
 import json
-from flask import Flask, render_template
-from datetime import datetime
+import gzip
+import hashlib
+import threading
+from flask import Flask, Response, render_template, request
+from datetime import datetime, timezone
 
 app = Flask(__name__)
 
 REPORTS_DIR = os.path.dirname(os.path.abspath(__file__))
+REPORT_FILES = {
+    "inventory_metrics": "inventory_metrics.json",
+    "slow_movers": "slow_movers.json",
+    "stockout_heatmap": "stockout_heatmap.json",
+}
 
-@app.route('/')
-def dashboard():
+# The reports only change when reporting/generate_reports.py replaces them, so the parsed
+# reports and the rendered page are kept until one of the files' mtime or size changes.
+_page_cache = {"key": None}
+_page_cache_lock = threading.Lock()
+
+def _report_stats() -> dict:
+    return {name: os.stat(os.path.join(REPORTS_DIR, filename)) for name, filename in REPORT_FILES.items()}
+
+def _render_dashboard(stats: dict) -> dict:
     """
-    Renders the reporting dashboard.
+    Loads the reports and renders the dashboard, returning the page with its ETag,
+    gzip-compressed body and last modification time.
     """
-    # Load the reports from the JSON files
-    with open(os.path.join(REPORTS_DIR, "inventory_metrics.json"), "r") as f:
-        inventory_metrics = json.load(f)
+    reports = {}
+    for name, filename in REPORT_FILES.items():
+        with open(os.path.join(REPORTS_DIR, filename), "r") as f:
+            reports[name] = json.load(f)
 
-    with open(os.path.join(REPORTS_DIR, "slow_movers.json"), "r") as f:
-        slow_movers = json.load(f)
+    # The page shows when the reports were generated, so it only changes with them
+    last_modified = datetime.fromtimestamp(max(stat.st_mtime for stat in stats.values()), tz=timezone.utc).replace(microsecond=0)
+    last_updated = last_modified.astimezone().strftime("%Y-%m-%d %H:%M:%S")
 
-    with open(os.path.join(REPORTS_DIR, "stockout_heatmap.json"), "r") as f:
-        stockout_heatmap = json.load(f)
+    body = render_template("dashboard.html", last_updated=last_updated, **reports).encode("utf-8")
+    return {
+        "body": body,
+        "gzip_body": gzip.compress(body),
+        "etag": hashlib.sha1(body).hexdigest(),
+        "last_modified": last_modified,
+    }
 
-    last_updated = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+def get_dashboard_page() -> dict:
+    """
+    Returns the rendered dashboard, re-rendering it only when a report file has changed.
+    """
+    stats = _report_stats()
+    key = tuple((stat.st_mtime_ns, stat.st_size) for stat in stats.values())
+    with _page_cache_lock:
+        if _page_cache["key"] != key:
+            _page_cache["page"] = _render_dashboard(stats)
+            _page_cache["key"] = key
+        return _page_cache["page"]
+
+@app.route('/')
+def dashboard():
+    """
+    Renders the reporting dashboard.
+    Supports conditional requests (ETag / Last-Modified) and gzip compression, so polling
+    clients get a 304 without a body until the reports are regenerated.
+    """
+    page = get_dashboard_page()
 
-    return render_template(
-        "dashboard.html",
-        inventory_metrics=inventory_metrics,
-        slow_movers=slow_movers,
-        stockout_heatmap=stockout_heatmap,
-        last_updated=last_updated,
-    )
+    if "gzip" in request.accept_encodings:
+        response = Response(page["gzip_body"], mimetype="text/html")
+        response.headers["Content-Encoding"] = "gzip"
+        response.set_etag(page["etag"] + "-gzip")
+    else:
+        response = Response(page["body"], mimetype="text/html")
+        response.set_etag(page["etag"])
+    response.headers["Vary"] = "Accept-Encoding"
+    response.headers["Cache-Control"] = "no-cache" # Cache, but revalidate on every poll
+    response.last_modified = page["last_modified"]
+    return response.make_conditional(request)
 
 if __name__ == "__main__":
     app.run(debug=True, port=5001)
@@ -1,45 +1,167 @@
 import os
 import sys
 import json
-import pandas as pd
+import tempfile
+import time
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from config import settings
 from services import calculations
+from services.dataset import RetailDataset
+from services.snapshot import export_snapshot, is_snapshot_current
 
 REPORTS_DIR = os.path.dirname(os.path.abspath(__file__))
 
-def generate_reports():
+def write_json_atomic(path: str, data):
     """
-    Generates all the reports and saves them to the reporting directory.
+    Writes data as JSON to a temporary file next to path and renames it over path,
+    so readers see either the previous report or the complete new one.
     """
-    print("Generating reports...")
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w") as f:
+            json.dump(data, f, indent=4)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+# Stages of the report pipeline. Each takes the results of its dependencies as arguments.
+
+def _load_dataset():
+    """
+    Loads the retail data shared by every report, or returns None when the calculations
+    can be answered from the up-to-date rollup collection instead.
+    The data is exported to a snapshot first unless one is current; workers then map the
+    snapshot files instead of receiving a pickled copy of the rows.
+    """
+    if calculations.rollup_available():
+        return None
+    if settings.use_snapshot and not is_snapshot_current():
+        export_snapshot()
+    dataset = RetailDataset(fields=calculations.INVENTORY_METRICS_FIELDS, use_cache=False)
+    dataset.df # Load once here rather than in every worker
+    return dataset
 
-    # Generate inventory metrics report
-    days_of_supply_data = calculations.calculate_days_of_supply()
-    avg_days_of_supply = pd.DataFrame(days_of_supply_data)['days_of_supply'].mean()
+def _turnover(dataset):
+    return calculations.calculate_turnover(dataset=dataset)
 
-    carrying_cost_data = calculations.calculate_carrying_cost()
-    avg_carrying_cost = pd.DataFrame(carrying_cost_data)['carrying_cost'].mean()
+def _stockout_rate(dataset):
+    return calculations.calculate_stockout_rate(dataset=dataset)
 
-    inventory_metrics = {
-        "turnover": calculations.calculate_turnover(),
-        "stockout_rate": calculations.calculate_stockout_rate(),
-        "days_of_supply": {"days_of_supply": avg_days_of_supply},
-        "carrying_cost": {"carrying_cost": avg_carrying_cost},
+def _product_metric_averages(dataset):
+    # Days of supply and carrying cost come from one pass of the per-product metrics engine
+    product_metrics = calculations.get_product_metrics(dataset=dataset)
+    if product_metrics.empty:
+        return {"days_of_supply": None, "carrying_cost": None}
+    return {
+        "days_of_supply": product_metrics['days_of_supply'].mean(),
+        "carrying_cost": product_metrics['carrying_cost'].mean(),
     }
-    with open(os.path.join(REPORTS_DIR, "inventory_metrics.json"), "w") as f:
-        json.dump(inventory_metrics, f, indent=4)
 
-    # Generate slow movers report
-    slow_movers = calculations.detect_slow_obsolete_items()
-    with open(os.path.join(REPORTS_DIR, "slow_movers.json"), "w") as f:
-        json.dump(slow_movers, f, indent=4)
+def _slow_movers(dataset):
+    return calculations.detect_slow_obsolete_items(dataset=dataset)
+
+def _stockout_heatmap(dataset):
+    return calculations.calculate_stockout_heatmap_data(dataset=dataset)
+
+def _write_inventory_metrics(turnover, stockout_rate, product_metric_averages):
+    write_json_atomic(os.path.join(REPORTS_DIR, "inventory_metrics.json"), {
+        "turnover": turnover,
+        "stockout_rate": stockout_rate,
+        "days_of_supply": {"days_of_supply": product_metric_averages["days_of_supply"]},
+        "carrying_cost": {"carrying_cost": product_metric_averages["carrying_cost"]},
+    })
+
+def _write_slow_movers(slow_movers):
+    write_json_atomic(os.path.join(REPORTS_DIR, "slow_movers.json"), slow_movers)
+
+def _write_stockout_heatmap(stockout_heatmap):
+    write_json_atomic(os.path.join(REPORTS_DIR, "stockout_heatmap.json"), stockout_heatmap)
+
+# name -> (function, dependencies, runs in the process pool)
+REPORT_TASKS = {
+    "load": (_load_dataset, (), False),
+    "turnover": (_turnover, ("load",), True),
+    "stockout_rate": (_stockout_rate, ("load",), True),
+    "product_metrics": (_product_metric_averages, ("load",), True),
+    "slow_movers": (_slow_movers, ("load",), True),
+    "stockout_heatmap": (_stockout_heatmap, ("load",), True),
+    "write_inventory_metrics": (_write_inventory_metrics, ("turnover", "stockout_rate", "product_metrics"), False),
+    "write_slow_movers": (_write_slow_movers, ("slow_movers",), False),
+    "write_stockout_heatmap": (_write_stockout_heatmap, ("stockout_heatmap",), False),
+}
+
+def _timed(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - start
+
+def run_task_graph(tasks: dict, executor) -> dict:
+    """
+    Runs a graph of tasks, each started as soon as all its dependencies have finished.
+    Pool tasks are submitted to the executor and run concurrently; the others run in this
+    process. Returns the elapsed seconds per task. Raises ValueError on unknown or cyclic
+    dependencies and re-raises the first task failure.
+    """
+    for name, (_, deps, _) in tasks.items():
+        unknown = [dep for dep in deps if dep not in tasks]
+        if unknown:
+            raise ValueError(f"Task {name} depends on unknown tasks: {', '.join(unknown)}")
+
+    results = {}
+    timings = {}
+    pending = dict(tasks)
+    running = {} # future -> task name
+
+    while pending or running:
+        started = False
+        for name, (func, deps, in_pool) in list(pending.items()):
+            if not all(dep in results for dep in deps):
+                continue
+            del pending[name]
+            started = True
+            args = [results[dep] for dep in deps]
+            if in_pool:
+                running[executor.submit(_timed, func, *args)] = name
+            else:
+                results[name], timings[name] = _timed(func, *args)
+                print(f"Stage {name} finished in {timings[name]:.2f}s")
+        if started:
+            continue # Local tasks may have unblocked others
+        if not running:
+            raise ValueError(f"Tasks with cyclic dependencies: {', '.join(pending)}")
+
+        done, _ = wait(running, return_when=FIRST_COMPLETED)
+        for future in done:
+            name = running.pop(future)
+            results[name], timings[name] = future.result()
+            print(f"Stage {name} finished in {timings[name]:.2f}s")
+
+    return timings
+
+def generate_reports(max_workers: int = None) -> dict:
+    """
+    Generates all the reports and saves them to the reporting directory.
+    The data is loaded once, the reports are computed concurrently in a process pool and
+    each output file is replaced atomically. Returns the elapsed seconds per stage.
+    """
+    print("Generating reports...")
+    start = time.perf_counter()
 
-    # Generate stockout heatmap report
-    stockout_heatmap = calculations.calculate_stockout_heatmap_data()
-    with open(os.path.join(REPORTS_DIR, "stockout_heatmap.json"), "w") as f:
-        json.dump(stockout_heatmap, f, indent=4)
+    # Spawned workers do not inherit the parent's MongoDB client, which is not fork-safe
+    with ProcessPoolExecutor(
+        max_workers=max_workers or settings.report_workers,
+        mp_context=multiprocessing.get_context("spawn"),
+    ) as executor:
+        timings = run_task_graph(REPORT_TASKS, executor)
 
-    print("Reports generated successfully.")
+    timings["total"] = time.perf_counter() - start
+    print(f"Reports generated successfully in {timings['total']:.2f}s.")
+    return timings
 
 if __name__ == "__main__":
     generate_reports()
@@ -0,0 +1,61 @@
+from fastapi import APIRouter, HTTPException, Query
+from fastapi.responses import StreamingResponse
+import os
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from config import settings
+from executor import run_blocking
+from telemetry import TimedRoute
+from models import ForecastTrainRequest
+from services.forecasting import forecast_status, load_models, predict, select_series, train_forecasts
+from services.streaming import STREAM_MEDIA_TYPES, iter_ndjson_dicts
+
+router = APIRouter(route_class=TimedRoute)
+
+# Upper bound for the forecast horizon in days
+MAX_HORIZON = 365
+
+@router.get("")
+async def get_forecasts(horizon: int = Query(14), product_id: str = Query(None), store_id: str = Query(None)):
+    """
+    Forecasts daily demand for every series (product, or product and store) with a trained model,
+    or for those matching product_id and store_id.
+    Returns 400 for a store_id when the models are not trained per store, and 404 when no series
+    matches product_id and store_id.
+    Results are streamed as newline-delimited JSON, one object per series with its keys, the
+    first forecast day ('start') and 'forecast', a list of `horizon` daily demand values.
+    """
+    if not 1 <= horizon <= MAX_HORIZON:
+        raise HTTPException(status_code=400, detail=f"horizon must be between 1 and {MAX_HORIZON}.")
+    models, _ = await run_blocking(load_models)
+    if models is None:
+        raise HTTPException(status_code=404, detail="No forecast models trained yet; POST /forecast/train first.")
+    try:
+        selected = select_series(models, product_id, store_id)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if selected.empty:
+        raise HTTPException(status_code=404, detail="No forecast model matches the given product_id and store_id.")
+    results = predict(selected, horizon)
+    return StreamingResponse(iter_ndjson_dicts(results, settings.stream_batch_size), media_type=STREAM_MEDIA_TYPES["ndjson"])
+
+@router.get("/models")
+async def get_forecast_models():
+    """
+    Returns the metadata of the current forecast models: version, number of series, when and
+    how they were trained, and whether retail_data changed since ('stale').
+    """
+    status = await run_blocking(forecast_status)
+    if status is None:
+        raise HTTPException(status_code=404, detail="No forecast models trained yet.")
+    return status
+
+@router.post("/train")
+async def train(request: ForecastTrainRequest = None):
+    """
+    Trains forecast models across a process pool and saves them as a new version.
+    With product_ids only those products are retrained and the other series are kept.
+    """
+    if request is None:
+        request = ForecastTrainRequest()
+    return await run_blocking(train_forecasts, request.product_ids, request.by_store)
@@ -0,0 +1,25 @@
+from fastapi import APIRouter, HTTPException, Query
+from fastapi.responses import PlainTextResponse
+import os
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import telemetry
+
+router = APIRouter()
+
+# Content type of the Prometheus text exposition format
+PROMETHEUS_MEDIA_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+@router.get("/telemetry")
+async def get_telemetry(output_format: str = Query("prometheus", alias="format")):
+    """
+    Returns the request telemetry recorded since the process started: latency histograms per
+    endpoint, per-stage time histograms (fetch, validation, frame_build, preprocess, compute,
+    serialization) and the rows_fetched, rows_rejected and bytes_out counters.
+    Served in the Prometheus text format for scraping, or as JSON with format=json.
+    """
+    if output_format == "json":
+        return telemetry.snapshot()
+    if output_format != "prometheus":
+        raise HTTPException(status_code=400, detail=f"Invalid format: {output_format}. Allowed formats are: prometheus, json")
+    return PlainTextResponse(telemetry.render_prometheus(), media_type=PROMETHEUS_MEDIA_TYPE)
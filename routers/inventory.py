@@ -1,16 +1,25 @@
 import os
 import sys
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-from fastapi import APIRouter, File, UploadFile, HTTPException, Query
+from fastapi import APIRouter, Depends, File, UploadFile, HTTPException, Query, Request
 from fastapi.responses import StreamingResponse
-from database import insert_data, db, get_validated_data # Added db import
+from database import get_validated_data, iter_validated_data, INGEST_MODES
+from config import settings
+from executor import run_blocking
+from telemetry import TimedRoute
 from services import calculations
+from services.dataset import RetailDataset
+from services.filters import filter_query
+from services.ingestion import ingest_csv
+from services.metrics import resolve_granularity
+from services.serialization import FastJSONResponse
+from services.streaming import STREAM_MEDIA_TYPES, resolve_stream_format, iter_ndjson, iter_csv
 import pandas as pd
 import io
-from models import RetailData
+from models import InventoryFilter, RetailData
 import json
 
-router = APIRouter()
+router = APIRouter(route_class=TimedRoute)
 
 # Load API descriptions
 try:
@@ -21,11 +30,44 @@ except FileNotFoundError:
 except json.JSONDecodeError:
     API_DESCRIPTIONS = {} # Handle case where JSON is invalid
 
+def inventory_filters(filters: InventoryFilter = Depends()) -> InventoryFilter:
+    """
+    The filter spec of an /inventory endpoint, from the store_id, region, category, abc_class,
+    start_date and end_date query parameters. Rejects a start_date after the end_date.
+    """
+    try:
+        filter_query(filters)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return filters
+
+def _stream_records(request: Request, output_format: str, query: dict, skip: int, limit: int, filename: str):
+    """
+    Returns a StreamingResponse that emits the matching records batch by batch as NDJSON or CSV,
+    or None when a regular JSON response was requested.
+    """
+    try:
+        stream_format = resolve_stream_format(output_format, request.headers.get("accept"))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if stream_format is None:
+        return None
+
+    batches = iter_validated_data(RetailData, "retail_data", query, skip=skip, limit=limit, batch_size=settings.stream_batch_size)
+    if stream_format == "csv":
+        response = StreamingResponse(iter_csv(batches, list(RetailData.model_fields)), media_type=STREAM_MEDIA_TYPES["csv"])
+        response.headers["Content-Disposition"] = f"attachment; filename={filename}.csv"
+        return response
+    return StreamingResponse(iter_ndjson(batches), media_type=STREAM_MEDIA_TYPES["ndjson"])
+
 @router.get("/all")
-async def get_all_inventory(skip: int = 0, limit: int = 0):
+async def get_all_inventory(request: Request, skip: int = 0, limit: int = 0, output_format: str = Query(None, alias="format"), filters: InventoryFilter = Depends(inventory_filters)):
     """
-    Retrieves all inventory records from the database.
+    Retrieves all inventory records from the database, or those matching the filters.
     A limit of 0 means no limit.
+    With format=ndjson or format=csv (or an Accept header of application/x-ndjson or text/csv)
+    the records are streamed from the database cursor in batches instead of returned as one
+    JSON list, so memory per request stays bounded.
 
     Returns:
         List[RetailData]: A list of inventory records, where each record is a RetailData object
@@ -33,14 +75,22 @@ async def get_all_inventory(skip: int = 0, limit: int = 0):
                          Inventory, Sales, Orders, Demand, Price, Discount, Weather, Promotion,
                          CompetitorPrice, Seasonality, cost, and abc_class.
     """
-    inventory_data = get_validated_data(RetailData, "retail_data", skip=skip, limit=limit)
+    query = filter_query(filters)
+    streaming_response = _stream_records(request, output_format, query, skip, limit, "inventory")
+    if streaming_response is not None:
+        return streaming_response
+
+    inventory_data = await run_blocking(get_validated_data, RetailData, "retail_data", query=query, skip=skip, limit=limit)
     return inventory_data
 
 @router.get("/stockouts/all")
-async def get_all_stockouts(skip: int = 0, limit: int = 0):
+async def get_all_stockouts(request: Request, skip: int = 0, limit: int = 0, output_format: str = Query(None, alias="format"), filters: InventoryFilter = Depends(inventory_filters)):
     """
-    Retrieves all stockout records from the database.
+    Retrieves all stockout records from the database, or those matching the filters.
     A limit of 0 means no limit.
+    With format=ndjson or format=csv (or an Accept header of application/x-ndjson or text/csv)
+    the records are streamed from the database cursor in batches instead of returned as one
+    JSON list, so memory per request stays bounded.
 
     Returns:
         List[RetailData]: A list of stockout records, where each record is a RetailData object
@@ -49,7 +99,12 @@ async def get_all_stockouts(skip: int = 0, limit: int = 0):
                          Inventory, Sales, Orders, Demand, Price, Discount, Weather, Promotion,
                          CompetitorPrice, Seasonality, cost, and abc_class.
     """
-    stockouts_data = get_validated_data(RetailData, "retail_data", query={"Inventory": 0, "Sales": {"$gt": 0}}, skip=skip, limit=limit)
+    query = {**calculations.STOCKOUT_RECORDS_QUERY, **filter_query(filters)}
+    streaming_response = _stream_records(request, output_format, query, skip, limit, "stockouts")
+    if streaming_response is not None:
+        return streaming_response
+
+    stockouts_data = await run_blocking(get_validated_data, RetailData, "retail_data", query=query, skip=skip, limit=limit)
     return stockouts_data
 
 COLUMN_RENAME_MAP = {
@@ -65,49 +120,51 @@ COLUMN_RENAME_MAP = {
 }
 
 @router.post("/upload/inventory")
-async def upload_inventory(file: UploadFile = File(...)):
+async def upload_inventory(file: UploadFile = File(...), mode: str = Query("replace")):
     """
     Uploads inventory data from a CSV file to the database.
-    Note: This endpoint will delete all existing data in the collection before inserting the new data.
+    Note: In the default "replace" mode this endpoint will delete all existing data in the collection
+    before inserting the new data. In "merge" mode rows are upserted on (Date, StoreId, ProductID)
+    and all other existing data is kept, so a daily feed only costs its own rows.
+    The file is parsed and inserted in batches, so memory use does not grow with the file size.
     """
     if not file.filename.endswith('.csv'):
         raise HTTPException(status_code=400, detail="Invalid file format. Please upload a CSV file.")
+    if mode not in INGEST_MODES:
+        raise HTTPException(status_code=400, detail=f"Invalid mode: {mode}. Allowed modes are: {', '.join(INGEST_MODES)}")
+
+    # Basic validation: check for expected columns after renaming
+    expected_columns = ['Date', 'StoreId', 'ProductID', 'Category', 'Region', 'Inventory', 'Sales', 'Price']
 
     try:
-        contents = await file.read()
-        df = pd.read_csv(io.BytesIO(contents))
-        
-        # Apply column renaming
-        df.rename(columns={k: v for k, v in COLUMN_RENAME_MAP.items() if k in df.columns}, inplace=True)
-
-        # Basic validation: check for expected columns after renaming
-        expected_columns = ['Date', 'StoreId', 'ProductID', 'Category', 'Region', 'Inventory', 'Sales', 'Price']
-        if not all(col in df.columns for col in expected_columns):
-            raise HTTPException(status_code=400, detail=f"CSV is missing one or more expected columns after renaming. Required: {expected_columns}")
-
-        data = df.to_dict('records')
-        insert_data(data, "retail_data")
-        return {"message": f"Successfully uploaded and inserted {len(data)} records from {file.filename} into retail_data"}
+        stats = await run_blocking(ingest_csv, file.file, "retail_data", rename_map=COLUMN_RENAME_MAP, required_columns=expected_columns, mode=mode)
+        return {"message": f"Successfully uploaded and inserted {stats['rows']} records from {file.filename} into retail_data", **stats}
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to process file: {e}")
 
 @router.get("/metrics")
 async def get_inventory_metrics(
     product_id: str = Query(None),
-    category: str = Query(None),
-    abc_class: str = Query(None),
     period: str = Query('monthly'),
-    carrying_cost_rate: float = Query(0.2)
+    carrying_cost_rate: float = Query(0.2),
+    compact: bool = Query(False),
+    filters: InventoryFilter = Depends(inventory_filters)
 ):
     """
     Computes and returns a dictionary of inventory metrics for a given product.
 
     Args:
         product_id (str, optional): The ID of the product.
-        category (str, optional): The category of the product.
-        abc_class (str, optional): The ABC classification of the product.
-        period (str, optional): The period for turnover calculation (e.g., 'monthly').
+        filters (InventoryFilter): store_id, region, category, abc_class, start_date and
+            end_date; every metric is computed from the matching rows only.
+        period (str, optional): The period for turnover calculation: 'daily', 'weekly', 'monthly', 'quarterly' or 'yearly'.
         carrying_cost_rate (float, optional): The carrying cost rate.
+        compact (bool, optional): State each metric description once under 'descriptions'
+            instead of in every result, leave out the full 'description' document (available
+            from /inventory/descriptions), and return the per-item 'days_of_supply' and
+            'carrying_cost' of all products as columns: {'item_id': [...], '<metric>': [...]}.
 
     Returns:
         dict: A dictionary containing the following metrics:
@@ -116,11 +173,25 @@ async def get_inventory_metrics(
             - 'days_of_supply': Dictionary with 'days_of_supply' for the specified product.
             - 'carrying_cost': Dictionary with 'carrying_cost' for the specified product.
             - 'description': A detailed explanation of the output structure and analysis insights.
+            - 'descriptions': With compact, the description of each metric, keyed by metric.
     """
-    turnover = calculations.calculate_turnover(product_id, category, abc_class, period)
-    stockout_rate = calculations.calculate_stockout_rate(product_id)
-    days_of_supply = calculations.calculate_days_of_supply(product_id)
-    carrying_cost = calculations.calculate_carrying_cost(product_id, carrying_cost_rate)
+    try:
+        resolve_granularity(period)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    # Answer from the rollup collection when it is up to date and can apply the filters;
+    # otherwise load and preprocess the matching raw rows once and share them across the four
+    # calculations
+    query = filter_query(filters, ProductID=product_id or None)
+    dataset = None
+    if not await run_blocking(calculations.rollup_available, period, query):
+        dataset = RetailDataset(query or None, fields=calculations.INVENTORY_METRICS_FIELDS)
+
+    turnover = await run_blocking(calculations.calculate_turnover, product_id, None, None, period, dataset=dataset, compact=compact, filters=filters)
+    stockout_rate = await run_blocking(calculations.calculate_stockout_rate, product_id, dataset=dataset, compact=compact, filters=filters)
+    days_of_supply = await run_blocking(calculations.calculate_days_of_supply, product_id, dataset=dataset, compact=compact, filters=filters)
+    carrying_cost = await run_blocking(calculations.calculate_carrying_cost, product_id, carrying_cost_rate, dataset=dataset, compact=compact, filters=filters)
 
     response_data = {
         "turnover": turnover,
@@ -129,16 +200,20 @@ async def get_inventory_metrics(
         "carrying_cost": carrying_cost
     }
 
-    if "inventory_metrics_output" in API_DESCRIPTIONS:
+    if compact:
+        response_data["descriptions"] = calculations.metric_descriptions(list(response_data))
+    elif "inventory_metrics_output" in API_DESCRIPTIONS:
         response_data["description"] = API_DESCRIPTIONS["inventory_metrics_output"]
 
-    return response_data
+    return FastJSONResponse(response_data)
 
 @router.get("/slow_movers")
 async def get_slow_movers(
     slow_turnover_threshold: float = Query(2.0),
     dos_threshold: int = Query(180),
-    inactivity_days: int = Query(180)
+    inactivity_days: int = Query(180),
+    compact: bool = Query(False),
+    filters: InventoryFilter = Depends(inventory_filters)
 ):
     """
     Returns a list of slow-moving and obsolete items based on defined thresholds.
@@ -147,45 +222,64 @@ async def get_slow_movers(
         slow_turnover_threshold (float, optional): Threshold for slow turnover.
         dos_threshold (int, optional): Days of supply threshold.
         inactivity_days (int, optional): Number of days of inactivity to consider an item obsolete.
+        filters (InventoryFilter): store_id, region, category, abc_class, start_date and
+            end_date; only the matching rows are classified.
+        compact (bool, optional): Return the short description of each list under 'descriptions'
+            instead of the full 'description' document (available from /inventory/descriptions).
 
     Returns:
         dict: A dictionary containing two lists:
             - 'slow_movers': List of ProductIDs identified as slow-moving.
             - 'obsolete_items': List of ProductIDs identified as obsolete.
             - 'description': A detailed explanation of the output structure and analysis insights.
+            - 'descriptions': With compact, the description of each list, keyed by list.
     """
-    response_data = calculations.detect_slow_obsolete_items(
-        slow_turnover_threshold, dos_threshold, inactivity_days
+    response_data = await run_blocking(
+        calculations.detect_slow_obsolete_items, slow_turnover_threshold, dos_threshold, inactivity_days, filters=filters
     )
 
-    if "slow_obsolete_items_output" in API_DESCRIPTIONS:
+    if compact:
+        response_data["descriptions"] = calculations.metric_descriptions(["slow_movers", "obsolete_items"])
+    elif "slow_obsolete_items_output" in API_DESCRIPTIONS:
         response_data["description"] = API_DESCRIPTIONS["slow_obsolete_items_output"]
 
-    return response_data
+    return FastJSONResponse(response_data)
 
 @router.get("/stockouts")
-async def get_stockouts(product_id: str = Query(None)):
+async def get_stockouts(product_id: str = Query(None), include_episodes: bool = Query(False), compact: bool = Query(False), filters: InventoryFilter = Depends(inventory_filters)):
     """
     Returns stockout history and rates for a given product.
 
     Args:
         product_id (str, optional): The ID of the product.
+        filters (InventoryFilter): store_id, region, category, abc_class, start_date and
+            end_date; only the matching rows are counted, and episodes are cut at the dates.
+        include_episodes (bool, optional): Also return the individual stockout episodes.
+        compact (bool, optional): Leave out the 'description' of the result.
 
     Returns:
         dict: A dictionary containing:
             - 'stockout_rate': The calculated stockout rate.
             - 'stockout_frequency': The number of stockout events.
-            - 'average_duration': The average duration of stockouts.
+            - 'average_duration': The average duration of stockout episodes in days.
+            - 'max_duration': The longest stockout episode in days.
+            - 'episode_count': The number of stockout episodes (runs of consecutive out-of-stock days).
+            - 'lost_sales': Estimated units of demand lost during the episodes.
+            - 'episodes': With include_episodes, one entry per episode with StoreId, ProductID,
+              start, end, duration, rows, sales and lost_sales.
     """
-    return calculations.calculate_stockout_rate(product_id)
+    result = await run_blocking(calculations.calculate_stockout_rate, product_id, include_episodes=include_episodes, compact=compact, filters=filters)
+    return FastJSONResponse(result)
 
 @router.get("/stockouts/heatmap")
-async def get_stockouts_heatmap(product_id: str = Query(None)):
+async def get_stockouts_heatmap(product_id: str = Query(None), filters: InventoryFilter = Depends(inventory_filters)):
     """
     Returns data suitable for generating a stockout heatmap.
 
     Args:
         product_id (str, optional): The ID of the product.
+        filters (InventoryFilter): store_id, region, category, abc_class, start_date and
+            end_date; only the matching rows are counted.
 
     Returns:
         List[dict]: A list of dictionaries, where each dictionary represents a stockout event
@@ -193,13 +287,15 @@ async def get_stockouts_heatmap(product_id: str = Query(None)):
                     - 'ProductID': The unique identifier for the product.
                     - 'month': The month of the stockout (e.g., 'YYYY-MM').
                     - 'stockout_count': The number of stockouts for that product in that month.
+                    - 'episode_count': The number of stockout episodes starting in that month.
+                    - 'stockout_days': The out-of-stock days of those episodes.
     """
-    return calculations.calculate_stockout_heatmap_data(product_id)
+    return FastJSONResponse(await run_blocking(calculations.calculate_stockout_heatmap_data, product_id, filters=filters))
 
 @router.get("/slow_movers/report")
-async def get_slow_movers_report():
+async def get_slow_movers_report(filters: InventoryFilter = Depends(inventory_filters)):
     """
-    Generates a CSV report of slow-moving and obsolete items.
+    Generates a CSV report of slow-moving and obsolete items, of the rows matching the filters.
 
     The output CSV will contain the following columns:
     - 'ProductID': The unique identifier for the product.
@@ -208,7 +304,7 @@ async def get_slow_movers_report():
     For a detailed JSON description of the slow-moving and obsolete items analysis,
     refer to the /inventory/slow_movers endpoint.
     """
-    data = calculations.detect_slow_obsolete_items()
+    data = await run_blocking(calculations.detect_slow_obsolete_items, filters=filters)
     if "error" in data:
         # If there's an error indicating no data, return an empty CSV
         if data["error"] == "No inventory data found.":
@@ -235,3 +331,11 @@ async def get_slow_movers_report():
     response = StreamingResponse(iter([stream.getvalue()]), media_type="text/csv")
     response.headers["Content-Disposition"] = "attachment; filename=slow_movers_report.csv"
     return response
+
+@router.get("/descriptions")
+async def get_descriptions():
+    """
+    Returns the full descriptions of the /inventory/metrics and /inventory/slow_movers outputs,
+    keyed by output, for clients of the compact responses that leave them out.
+    """
+    return API_DESCRIPTIONS
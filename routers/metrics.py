@@ -1,21 +1,59 @@
-from fastapi import APIRouter
+from fastapi import APIRouter, HTTPException
+from fastapi.responses import StreamingResponse
 import os
 import sys
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-from services.metrics import calculate_metrics
-from models import MetricRequest, RetailData
+from services.metrics import calculate_metrics, calculate_bulk_metrics, load_bulk_metrics_data
+from models import MetricRequest, BulkMetricRequest, RetailData
 from database import get_validated_data
+from config import settings
+from executor import run_blocking
+from telemetry import TimedRoute
+from services.serialization import FastJSONResponse
+from services.streaming import STREAM_MEDIA_TYPES, iter_ndjson_dicts
 
-router = APIRouter()
+router = APIRouter(route_class=TimedRoute)
 
 @router.post("/all-metrics")
 async def get_all_metrics(request: MetricRequest):
     query = {"StoreId": request.store_id, "ProductID": request.product_id}
-    retail_data = get_validated_data(RetailData, "retail_data", query) # Fetch data directly
+    retail_data = await run_blocking(get_validated_data, RetailData, "retail_data", query) # Fetch data directly
 
-    metrics = calculate_metrics(request.store_id, request.product_id, retail_data)
-    return {
+    try:
+        metrics = await run_blocking(
+            calculate_metrics, request.store_id, request.product_id, retail_data,
+            request.granularities, request.rolling_windows,
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return FastJSONResponse({
         "store_id": request.store_id,
         "product_id": request.product_id,
         **metrics
-    }
\ No newline at end of file
+    })
+
+@router.post("/all-metrics/bulk")
+async def get_bulk_metrics(request: BulkMetricRequest):
+    """
+    Computes the /metrics/all-metrics output for many store/product pairs in one call.
+    The rows of all pairs are fetched in a single query and the metrics computed in one grouped pass.
+    Results are streamed as newline-delimited JSON, one object per pair, in the order of `pairs`
+    (or sorted by store and product when `pairs` is omitted and the filters select the pairs).
+    """
+    if request.pairs is not None:
+        pairs = [(pair.store_id, pair.product_id) for pair in request.pairs]
+        df = await run_blocking(load_bulk_metrics_data, pairs)
+    else:
+        pairs = None
+        filters = {
+            field: value for field, value in (
+                ("StoreId", request.store_id),
+                ("ProductID", request.product_id),
+                ("Category", request.category),
+                ("Region", request.region),
+            ) if value is not None
+        }
+        df = await run_blocking(load_bulk_metrics_data, None, filters)
+
+    results = await run_blocking(calculate_bulk_metrics, df, pairs)
+    return StreamingResponse(iter_ndjson_dicts(results, settings.stream_batch_size), media_type=STREAM_MEDIA_TYPES["ndjson"])
@@ -0,0 +1,14 @@
+import sys
+import os
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.classification import update_classes
+from services.rollup import rebuild_rollup
+from services.stockouts import refresh_stockout_episodes
+
+if __name__ == "__main__":
+    # Needed once for data loaded before the rollup, classes and stockout episodes existed; ingestion keeps them current afterwards
+    rebuild_rollup()
+    update_classes()
+    refresh_stockout_episodes()
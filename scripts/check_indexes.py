@@ -0,0 +1,35 @@
+import sys
+import os
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import create_indexes
+from services.query_shapes import check_query_shapes
+
+def check_indexes() -> bool:
+    """
+    Prints the query plan of every query shape and flags collection scans.
+    Returns False if a hot query shape is not index-backed or a shape does not use the index it expects.
+    """
+    ok = True
+    for result in check_query_shapes():
+        if (result["collection_scan"] and result["hot"]) or result["unexpected_plan"]:
+            status = "FAIL"
+            ok = False
+        elif result["collection_scan"]:
+            status = "SCAN"
+        else:
+            status = "OK"
+        print(f"{status:5} {result['collection']}.{result['name']}: {' > '.join(result['stages'])} "
+              f"[{', '.join(result['indexes']) or 'no index'}] ({result['used_by']})")
+        if result["unexpected_plan"]:
+            print(f"      expected index {result['expected_index']}")
+    return ok
+
+if __name__ == "__main__":
+    # Pass --create to bring the indexes in line with INDEX_SPECS first
+    if "--create" in sys.argv[1:]:
+        create_indexes()
+    if not check_indexes():
+        print("Hot query shapes are not index-backed or use unexpected indexes; see INDEX_SPECS in database.py.")
+        sys.exit(1)
@@ -0,0 +1,13 @@
+import sys
+import os
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.snapshot import export_snapshot, is_snapshot_current
+
+if __name__ == "__main__":
+    # Skips the export when the current snapshot matches the collection version; pass --force to export anyway
+    if "--force" in sys.argv[1:] or not is_snapshot_current():
+        export_snapshot()
+    else:
+        print("Snapshot of retail_data is current.")
@@ -2,7 +2,8 @@ import sys
 import os
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 import pandas as pd
-from database import insert_data
+from database import INGEST_MODES
+from services.ingestion import ingest_records
 from models import RetailData
 from pydantic import BaseModel
 
@@ -18,24 +19,6 @@ COLUMN_RENAME_MAP = {
     'Product ID': 'ProductID'
 }
 
-def calculate_abc_class(df):
-    df['sales_value'] = df['Sales'] * df['Price']
-    total_sales_value = df['sales_value'].sum()
-    df = df.sort_values(by='sales_value', ascending=False)
-    df['cumulative_sales'] = df['sales_value'].cumsum()
-    df['cumulative_percentage'] = (df['cumulative_sales'] / total_sales_value) * 100
-
-    def assign_abc_class(percentage):
-        if percentage <= 80:
-            return 'A'
-        elif percentage <= 95:
-            return 'B'
-        else:
-            return 'C'
-
-    df['ABC Class'] = df['cumulative_percentage'].apply(assign_abc_class)
-    return df
-
 def convert_nan_to_none(df: pd.DataFrame, model: BaseModel) -> pd.DataFrame:
     for field_name, field in model.model_fields.items():
         if not field.is_required() and field_name in df.columns: # Check if it's an Optional field
@@ -49,11 +32,13 @@ def convert_nan_to_none(df: pd.DataFrame, model: BaseModel) -> pd.DataFrame:
     return df
 
 if __name__ == "__main__":
-    if len(sys.argv) != 2:
-        print("Usage: python load_csv_to_db.py <csv_file_path>")
+    if len(sys.argv) not in (2, 3) or (len(sys.argv) == 3 and sys.argv[2] not in INGEST_MODES):
+        print(f"Usage: python load_csv_to_db.py <csv_file_path> [{'|'.join(INGEST_MODES)}]")
         sys.exit(1)
 
     csv_file_path = sys.argv[1]
+    # "replace" (default) reloads the collection, "merge" upserts on (Date, StoreId, ProductID)
+    mode = sys.argv[2] if len(sys.argv) == 3 else "replace"
 
     if not os.path.exists(csv_file_path):
         print(f"Error: CSV file not found at {csv_file_path}")
@@ -68,17 +53,16 @@ if __name__ == "__main__":
         # Apply column renaming
         df.rename(columns={k: v for k, v in COLUMN_RENAME_MAP.items() if k in df.columns}, inplace=True)
 
-        # Add 'cost' and calculate abc_class
+        # Add 'cost'; abc_class and xyz_class are assigned per product after ingestion
         df['cost'] = df['Price'] * 0.8 # Assuming cost is 80% of price
-        df = calculate_abc_class(df)
-        df.rename(columns={"ABC Class": "abc_class"}, inplace=True)
 
         # Convert NaN values to None for optional fields before insertion
         df = convert_nan_to_none(df, RetailData)
 
         # Insert data into a single collection
-        print("Clearing existing data in 'retail_data' collection...")
-        insert_data(df.to_dict('records'), "retail_data")
+        if mode == "replace":
+            print("Clearing existing data in 'retail_data' collection...")
+        ingest_records(df.to_dict('records'), "retail_data", mode=mode)
 
         print(f"Data from {csv_file_path} loaded into 'retail_data' collection successfully!")
 
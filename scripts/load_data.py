@@ -5,7 +5,8 @@ import pandas as pd
 # Add project root to the Python path
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from database import insert_data
+from database import INGEST_MODES
+from services.ingestion import ingest_records
 from models import RetailData
 from pydantic import BaseModel
 
@@ -33,6 +34,12 @@ def convert_nan_to_none(df: pd.DataFrame, model: BaseModel) -> pd.DataFrame:
                 df[field_name] = df[field_name].where(pd.notna(df[field_name]), None)
     return df
 
+# "replace" (default) reloads the collection, "merge" upserts on (Date, StoreId, ProductID)
+mode = sys.argv[1] if len(sys.argv) > 1 else "replace"
+if mode not in INGEST_MODES:
+    print(f"Usage: python load_data.py [{'|'.join(INGEST_MODES)}]")
+    sys.exit(1)
+
 # Load retail_store_inventory.csv data and insert into MongoDB
 try:
     df_retail = pd.read_csv('data/retail_store_inventory.csv')
@@ -46,8 +53,9 @@ try:
     df_retail = convert_nan_to_none(df_retail, RetailData)
 
     # Insert into 'retail_data' collection
-    print("Clearing existing data in 'retail_data' collection...")
-    insert_data(df_retail.to_dict('records'), "retail_data")
+    if mode == "replace":
+        print("Clearing existing data in 'retail_data' collection...")
+    ingest_records(df_retail.to_dict('records'), "retail_data", mode=mode)
     print("Retail inventory data loaded into 'retail_data' collection successfully!")
 
 except Exception as e:
@@ -3,11 +3,11 @@ import os
 
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from database import db # Import the db object directly
+from database import get_db
 
 def retrieve_and_display_data():
     print("\n--- Retrieving ALL Retail Data ---")
-    retail_collection = db["retail_data"]
+    retail_collection = get_db()["retail_data"]
     retail_data = list(retail_collection.find({}))
     if retail_data:
         print(f"Total retail_data documents: {len(retail_data)}")
@@ -0,0 +1,10 @@
+import sys
+import os
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.forecasting import train_forecasts
+
+if __name__ == "__main__":
+    # Pass --by-store to fit one model per product and store; merge ingestion keeps the models current
+    train_forecasts(by_store=True if "--by-store" in sys.argv[1:] else None)
@@ -2,12 +2,18 @@ import pandas as pd
 import os
 import sys
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-from database import get_validated_data
-from models import RetailData
+from database import aggregate, count_documents
+from models import InventoryFilter
 from datetime import datetime, timedelta
-from services.data_preprocessing import preprocess_inventory_data, preprocess_sales_data, preprocess_stockouts_data
+from services.dataset import RetailDataset
+from services.filters import filter_query
+from services.rollup import ROLLUP_FILTER_FIELDS, is_rollup_current, load_rollup, product_aggregates
+from services.metrics import TURNOVER_GRANULARITIES, resolve_granularity, turnover_time_series
+from services.stockouts import (
+    EPISODE_FIELDS, EPISODE_FILTER_FIELDS, detect_stockout_episodes, episode_heatmap, episode_records, is_episodes_current,
+    load_stockout_episodes, summarize_episodes,
+)
 import json
-from pydantic import BaseModel
 
 # Load API descriptions
 try:
@@ -18,33 +24,78 @@ except FileNotFoundError:
 except json.JSONDecodeError:
     API_DESCRIPTIONS = {} # Handle case where JSON is invalid
 
-def _add_description_to_output(output, metric_key: str):
-    if not API_DESCRIPTIONS:
-        return output
+# Field projections for the analytics paths; only these columns are fetched from MongoDB.
+TURNOVER_FIELDS = ["Date", "ProductID", "Inventory", "Sales", "Price", "cost"]
+STOCKOUT_FIELDS = ["Inventory", "Sales"]
+HEATMAP_FIELDS = ["Date", "ProductID", "Inventory", "Sales"]
+PRODUCT_METRICS_FIELDS = ["Date", "StoreId", "ProductID", "Inventory", "Sales", "cost"]
+SLOW_MOVER_FIELDS = ["Date", "StoreId", "ProductID", "Inventory", "Sales", "Price", "cost"]
+# Projection for a RetailDataset shared by the /inventory/metrics calculations
+INVENTORY_METRICS_FIELDS = list(dict.fromkeys(
+    TURNOVER_FIELDS + STOCKOUT_FIELDS + EPISODE_FIELDS + PRODUCT_METRICS_FIELDS + ["Category", "abc_class"]
+))
+
+# Turnover granularities that can be answered from monthly rollup documents
+ROLLUP_PERIODS = ("monthly", "quarterly", "yearly")
+
+def rollup_available(period: str = None, query: dict = None) -> bool:
+    """
+    Returns True if metrics can be answered from the rollup collection: it reflects the current
+    retail_data version, the query only filters on ROLLUP_FILTER_FIELDS and, for turnover, the
+    period is monthly or coarser.
+    """
+    if query and not set(query) <= ROLLUP_FILTER_FIELDS:
+        return False
+    if period is not None:
+        try:
+            if resolve_granularity(period) not in ROLLUP_PERIODS:
+                return False
+        except ValueError:
+            return False
+    return is_rollup_current()
+
+def _use_rollup(use_rollup: bool, dataset: RetailDataset, period: str = None, query: dict = None) -> bool:
+    return use_rollup and dataset is None and rollup_available(period, query)
+
+def _load_frame(query: dict, fields: list, dataset: RetailDataset = None) -> pd.DataFrame:
+    """
+    Returns a copy of the preprocessed rows matching `query`, restricted to `fields`.
+    Rows come from the shared dataset when one is given, otherwise from a dataset of their own,
+    which is served from the dataset cache when the collection has not changed.
+    """
+    if dataset is None:
+        dataset = RetailDataset(query, fields)
+    return dataset.select(query, fields)
 
-    metric_output_key = ""
+def _metric_description(metric_key: str):
+    """Returns the description of a metric's section in API_DESCRIPTIONS, or None if there is none."""
     if metric_key in ["turnover", "stockout_rate", "days_of_supply", "carrying_cost"]:
         metric_output_key = "inventory_metrics_output"
     elif metric_key in ["slow_movers", "obsolete_items"]:
         metric_output_key = "slow_obsolete_items_output"
     else:
-        return output # No description found
+        return None
 
-    if metric_output_key not in API_DESCRIPTIONS:
-        return output
-
-    sections = API_DESCRIPTIONS[metric_output_key].get("sections", [])
-    
-    target_section = None
-    for section in sections:
+    for section in API_DESCRIPTIONS.get(metric_output_key, {}).get("sections", []):
         if section.get("key") == metric_key:
-            target_section = section
-            break
-    
-    if not target_section:
+            return section.get("description", "")
+    return None
+
+def metric_descriptions(metric_keys: list) -> dict:
+    """
+    Returns the descriptions of the given metrics, keyed by metric, for compact responses that
+    state each description once instead of repeating it in every result.
+    """
+    descriptions = {key: _metric_description(key) for key in metric_keys}
+    return {key: description for key, description in descriptions.items() if description is not None}
+
+def _add_description_to_output(output, metric_key: str, compact: bool = False):
+    if compact:
         return output
 
-    description_to_add = target_section.get("description", "")
+    description_to_add = _metric_description(metric_key)
+    if description_to_add is None:
+        return output
 
     if isinstance(output, dict):
         if "error" in output: # Don't add description to error messages
@@ -56,22 +107,76 @@ def _add_description_to_output(output, metric_key: str):
                 item["description"] = description_to_add
     return output
 
-def calculate_turnover(item_id: str = None, category: str = None, abc_class: str = None, period: str = 'monthly'):
-    query = {}
-    if item_id:
-        query["ProductID"] = item_id
-    if category:
-        query["Category"] = category
-    if abc_class:
-        query["abc_class"] = abc_class
+def _turnover_output(cogs_over_time: pd.Series, avg_inventory_value: float, item_id: str = None, compact: bool = False):
+    """
+    Turns COGS per period into the turnover response: the first period for a single item,
+    otherwise the average turnover ratio over all periods.
+    """
+    turnover_df = (cogs_over_time / avg_inventory_value).reset_index()
+    turnover_df.rename(columns={'COGS': 'turnover_ratio'}, inplace=True)
+    turnover_df.replace([float('inf'), -float('inf')], None, inplace=True)
+
+    results = turnover_df.to_dict('records')
 
-    retail_data = get_validated_data(RetailData, "retail_data", query)
+    if not results:
+        return {"turnover_ratio": 0, "message": "No data for the given period."}
 
-    if not retail_data:
+    if item_id and results:
+        return _add_description_to_output(results[0], "turnover", compact)
+    elif not item_id and results:
+        # Calculate the average turnover ratio for all items
+        avg_turnover = pd.DataFrame(results)['turnover_ratio'].mean()
+        return _add_description_to_output({"turnover_ratio": avg_turnover}, "turnover", compact)
+    else:
+        return {"turnover_ratio": 0, "message": "No data for the given item ID."}
+
+def _turnover_from_rollup(query: dict, period: str, item_id: str = None, compact: bool = False):
+    """
+    Calculates turnover from rollup documents. Monthly COGS sums are summed up to the requested
+    period; months without data count as zero, like resampling raw rows does.
+    """
+    rollup = load_rollup(query)
+
+    if rollup.empty:
         return {"error": "Insufficient data for calculation."}
 
-    df = pd.DataFrame([item.dict() for item in retail_data]).copy()
-    df = preprocess_inventory_data(df) # This preprocesses the entire dataframe
+    inventory_value_count = rollup['inventory_value_count'].sum()
+    avg_inventory_value = rollup['inventory_value_sum'].sum() / inventory_value_count if inventory_value_count else float('nan')
+
+    if pd.isna(avg_inventory_value) or avg_inventory_value == 0:
+        return {"error": "Average inventory value is zero or undefined, cannot calculate turnover."}
+
+    monthly_cogs = rollup.groupby('month')['cogs_sum'].sum()
+    # Label each month with its last day, so resampling fills missing months with 0
+    monthly_cogs.index = pd.DatetimeIndex(pd.to_datetime(monthly_cogs.index, format='%Y-%m') + pd.offsets.MonthEnd(0), name='Date')
+
+    rule = TURNOVER_GRANULARITIES[resolve_granularity(period)]
+    cogs_over_time = monthly_cogs.resample(rule).sum().rename('COGS')
+    return _turnover_output(cogs_over_time, avg_inventory_value, item_id, compact)
+
+def calculate_turnover(item_id: str = None, category: str = None, abc_class: str = None, period: str = 'monthly', dataset: RetailDataset = None, use_rollup: bool = True, compact: bool = False, filters: InventoryFilter = None):
+    """
+    Calculates the inventory turnover ratio per period.
+    Turnover = COGS / Avg Inventory Value
+    `period` is a granularity of services.metrics.turnover_time_series ('daily', 'weekly',
+    'monthly', 'quarterly' or 'yearly'); an unknown period raises ValueError.
+    Monthly, quarterly and yearly periods are answered from the rollup collection when it is
+    up to date and no dataset is given; set use_rollup=False to always use raw rows.
+    With compact the result carries no description (see metric_descriptions).
+    Only rows matching `filters` (see services/filters.py) are read; category and abc_class
+    take precedence over the filters' own.
+    """
+    resolve_granularity(period)
+
+    query = filter_query(filters, ProductID=item_id or None, Category=category or None, abc_class=abc_class or None)
+
+    if _use_rollup(use_rollup, dataset, period, query):
+        return _turnover_from_rollup(query, period, item_id, compact)
+
+    df = _load_frame(query, TURNOVER_FIELDS, dataset)
+
+    if df.empty:
+        return {"error": "Insufficient data for calculation."}
 
     # Ensure necessary columns exist after preprocessing
     if 'Inventory' not in df.columns or 'Sales' not in df.columns or 'Price' not in df.columns:
@@ -92,51 +197,111 @@ def calculate_turnover(item_id: str = None, category: str = None, abc_class: str
     if pd.isna(avg_inventory_value) or avg_inventory_value == 0:
         return {"error": "Average inventory value is zero or undefined, cannot calculate turnover."}
 
-    # Resample COGS by period
-    df['Date'] = pd.to_datetime(df['Date'])
-    df.set_index('Date', inplace=True)
-    cogs_over_time = df['COGS'].resample(period[0].upper()).sum()
+    # Sum COGS per period
+    granularity = resolve_granularity(period)
+    series = turnover_time_series(df, [granularity], numerator='COGS', denominator='InventoryValue')[granularity]
+    cogs_over_time = series['numerator'].rename('COGS')
 
-    turnover_df = (cogs_over_time / avg_inventory_value).reset_index()
-    turnover_df.rename(columns={'COGS': 'turnover_ratio'}, inplace=True)
-    turnover_df.replace([float('inf'), -float('inf')], None, inplace=True)
+    return _turnover_output(cogs_over_time, avg_inventory_value, item_id, compact)
 
-    results = turnover_df.to_dict('records')
+# Stockout records as listed by /inventory/stockouts/all. Without a ProductID condition the
+# partial "stockouts" index (ProductID, Date) cannot be used, so this is served by Inventory_1.
+STOCKOUT_RECORDS_QUERY = {"Inventory": 0, "Sales": {"$gt": 0}}
 
-    if not results:
-        return {"turnover_ratio": 0, "message": "No data for the given period."}
-
-    if item_id and results:
-        return _add_description_to_output(results[0], "turnover")
-    elif not item_id and results:
-        # Calculate the average turnover ratio for all items
-        avg_turnover = pd.DataFrame(results)['turnover_ratio'].mean()
-        return _add_description_to_output({"turnover_ratio": avg_turnover}, "turnover")
-    else:
-        return {"turnover_ratio": 0, "message": "No data for the given item ID."}
+def _stockout_match(query: dict) -> dict:
+    """
+    Builds the $match stage for stockout events: Inventory is 0 (or missing, which
+    preprocessing treats as 0) and there are Sales > 0.
+    The first branch repeats the partial "stockouts" index filter so the planner can use it.
+    """
+    stockout_filter = {"$or": [
+        {"Inventory": {"$lte": 0}, "Sales": {"$gt": 0}},
+        {"Inventory": None, "Sales": {"$gt": 0}},
+    ]}
+    if not query:
+        return stockout_filter
+    return {"$and": [query, stockout_filter]}
+
+def _stockout_counts_pipeline(query: dict) -> list:
+    """
+    Counts sales records and stockout events server-side in a single $group.
+    """
+    sales_match = {"Sales": {"$gt": 0}}
+    return [
+        {"$match": {"$and": [query, sales_match]} if query else sales_match},
+        {"$group": {
+            "_id": None,
+            "num_sales": {"$sum": 1},
+            "num_stockouts": {"$sum": {"$cond": [{"$lte": [{"$ifNull": ["$Inventory", 0]}, 0]}, 1, 0]}},
+        }},
+    ]
+
+def _stockout_heatmap_pipeline(query: dict) -> list:
+    """
+    Groups stockout events by ProductID and month ('YYYY-MM') server-side.
+    """
+    return [
+        {"$match": _stockout_match(query)},
+        {"$group": {
+            "_id": {
+                "ProductID": "$ProductID",
+                "month": {"$dateToString": {"format": "%Y-%m", "date": {"$toDate": "$Date"}}},
+            },
+            "stockout_count": {"$sum": 1},
+        }},
+        {"$sort": {"_id.ProductID": 1, "_id.month": 1}},
+        {"$project": {"_id": 0, "ProductID": "$_id.ProductID", "month": "$_id.month", "stockout_count": 1}},
+    ]
+
+def _stockout_episodes(query: dict, dataset: RetailDataset = None, use_stored: bool = True) -> pd.DataFrame:
+    """
+    Returns the stockout episodes of the rows matching `query`, read from the episodes collection
+    when it is up to date and the query only filters on EPISODE_FILTER_FIELDS, otherwise
+    detected from the rows. Episodes detected from a date range are cut at its ends.
+    """
+    if use_stored and dataset is None and set(query) <= EPISODE_FILTER_FIELDS and is_episodes_current():
+        return load_stockout_episodes(query)
+    return detect_stockout_episodes(_load_frame(query, EPISODE_FIELDS, dataset))
 
-def calculate_stockout_rate(item_id: str = None):
+def calculate_stockout_rate(item_id: str = None, use_aggregation: bool = True, dataset: RetailDataset = None, use_rollup: bool = True, include_episodes: bool = False, compact: bool = False, filters: InventoryFilter = None):
     """
     Calculates the stockout rate, frequency, and duration.
     Stockout Rate = (Number of Stockouts / Number of Sales) * 100
+    The counts are read from the rollup collection when it is up to date, otherwise computed by
+    a MongoDB aggregation pipeline; set use_rollup=False and use_aggregation=False to compute them
+    in pandas instead (kept for the parity tests in test_calculations.py). When a dataset is
+    given the counts are always computed in pandas from its rows.
+    Durations and lost sales come from stockout episodes (see services/stockouts.py); with
+    include_episodes the episodes themselves are returned too.
+    With compact the result carries no description (see metric_descriptions).
+    Only rows matching `filters` (see services/filters.py) are counted.
     """
-    query = {}
-    if item_id:
-        query["ProductID"] = item_id
-
-    retail_data = get_validated_data(RetailData, "retail_data", query)
-
-    if not retail_data:
-        return {"error": "Insufficient data for calculation."}
+    query = filter_query(filters, ProductID=item_id or None)
+
+    if _use_rollup(use_rollup, dataset, query=query):
+        rollup = load_rollup(query)
+        if rollup.empty:
+            return {"error": "Insufficient data for calculation."}
+        num_stockouts = int(rollup['stockout_rows'].sum())
+        num_sales = int(rollup['sales_rows'].sum())
+    elif use_aggregation and dataset is None:
+        counts = aggregate(_stockout_counts_pipeline(query), "retail_data")
+        num_stockouts = counts[0]["num_stockouts"] if counts else 0
+        num_sales = counts[0]["num_sales"] if counts else 0
+        # Only records with sales reach the $group, so check separately that any data exists
+        if num_sales == 0 and not count_documents(query, "retail_data", limit=1):
+            return {"error": "Insufficient data for calculation."}
+    else:
+        df = _load_frame(query, STOCKOUT_FIELDS, dataset)
 
-    df = pd.DataFrame([item.dict() for item in retail_data]).copy()
-    df = preprocess_inventory_data(df) # Preprocess the entire dataframe
+        if df.empty:
+            return {"error": "Insufficient data for calculation."}
 
-    # Identify stockout events: Inventory is 0 and there are Sales > 0
-    stockout_events = df[(df['Inventory'] <= 0) & (df['Sales'] > 0)]
+        # Identify stockout events: Inventory is 0 and there are Sales > 0
+        stockout_events = df[(df['Inventory'] <= 0) & (df['Sales'] > 0)]
 
-    num_stockouts = len(stockout_events)
-    num_sales = len(df[df['Sales'] > 0]) # Total sales records where units were sold
+        num_stockouts = len(stockout_events)
+        num_sales = len(df[df['Sales'] > 0]) # Total sales records where units were sold
 
     if num_sales == 0:
         return {"stockout_rate": 0, "message": "No sales, so stockout rate is 0."}
@@ -144,224 +309,266 @@ def calculate_stockout_rate(item_id: str = None):
     stockout_rate = (num_stockouts / num_sales) * 100
 
     stockout_frequency = num_stockouts
-    avg_duration = 0
-    # If there's a 'duration' column in the original inventory data that indicates stockout duration
-    if 'duration' in stockout_events.columns:
-        avg_duration = stockout_events['duration'].mean()
 
+    episodes = _stockout_episodes(query, dataset, use_rollup)
+    summary = summarize_episodes(episodes)
     result = {
         "stockout_rate": stockout_rate,
         "stockout_frequency": stockout_frequency,
-        "average_duration": avg_duration
+        "average_duration": summary["average_duration"],
+        "max_duration": summary["max_duration"],
+        "episode_count": summary["episode_count"],
+        "lost_sales": summary["lost_sales"],
     }
-    return _add_description_to_output(result, "stockout_rate")
+    if include_episodes:
+        result["episodes"] = episode_records(episodes)
+    return _add_description_to_output(result, "stockout_rate", compact)
 
-def calculate_stockout_heatmap_data(item_id: str = None):
-    """
-    Generates data for a stockout heatmap.
-    """
-    query = {}
-    if item_id:
-        query["ProductID"] = item_id
+def _stockout_event_counts(query: dict, use_aggregation: bool, dataset: RetailDataset, use_rollup: bool) -> pd.DataFrame:
+    """Counts stockout events per ProductID and month."""
+    columns = ['ProductID', 'month', 'stockout_count']
+    if _use_rollup(use_rollup, dataset, query=query):
+        rollup = load_rollup(query)
+        stockouts = rollup[rollup['stockout_rows'] > 0]
+        if stockouts.empty:
+            return pd.DataFrame(columns=columns)
+        return stockouts.groupby(['ProductID', 'month'])['stockout_rows'].sum().reset_index(name='stockout_count')
 
-    retail_data = get_validated_data(RetailData, "retail_data", query)
+    if use_aggregation and dataset is None:
+        return pd.DataFrame(aggregate(_stockout_heatmap_pipeline(query), "retail_data"), columns=columns)
 
-    if not retail_data:
-        return []
+    df = _load_frame(query, HEATMAP_FIELDS, dataset)
 
-    df = pd.DataFrame([item.dict() for item in retail_data]).copy()
-    df = preprocess_inventory_data(df) # Preprocess the entire dataframe
+    if df.empty:
+        return pd.DataFrame(columns=columns)
 
     # Identify stockout events
     stockout_events = df[(df['Inventory'] <= 0) & (df['Sales'] > 0)]
 
     if stockout_events.empty:
-        return []
+        return pd.DataFrame(columns=columns)
 
     df = stockout_events.copy()
     
     df['month'] = df['Date'].dt.to_period('M').astype(str)
     
-    heatmap_data = df.groupby(['ProductID', 'month']).size().reset_index(name='stockout_count')
-    
-    return heatmap_data.to_dict('records')
+    return df.groupby(['ProductID', 'month'], observed=True).size().reset_index(name='stockout_count')
 
-def calculate_days_of_supply(item_id: str = None):
+def calculate_stockout_heatmap_data(item_id: str = None, use_aggregation: bool = True, dataset: RetailDataset = None, use_rollup: bool = True, filters: InventoryFilter = None):
     """
-    Calculates the days of supply for an item or all items.
-    Days of Supply = Current Inventory / Avg Daily Demand
+    Generates data for a stockout heatmap.
+    Stockout counts per ProductID and month are read from the rollup collection when it is up to
+    date, otherwise grouped in a MongoDB aggregation pipeline; set use_rollup=False and
+    use_aggregation=False to group them in pandas instead (kept for the parity tests in
+    test_calculations.py).
+    When a dataset is given the events are always grouped in pandas from its rows.
+    Each cell also holds the stockout episodes starting in that month and their stockout days.
+    Only rows matching `filters` (see services/filters.py) are counted.
     """
-    query = {}
-    if item_id:
-        query["ProductID"] = item_id
+    query = filter_query(filters, ProductID=item_id or None)
 
-    retail_data = get_validated_data(RetailData, "retail_data", query)
+    counts = _stockout_event_counts(query, use_aggregation, dataset, use_rollup)
+    episodes = episode_heatmap(_stockout_episodes(query, dataset, use_rollup))
+    if counts.empty and episodes.empty:
+        return []
 
-    if not retail_data:
-        return {"error": "Insufficient data."}
+    heatmap_data = counts.merge(episodes, on=['ProductID', 'month'], how='outer').fillna(0)
+    heatmap_data = heatmap_data.sort_values(['ProductID', 'month'], kind='stable')
+    for column in ['stockout_count', 'episode_count', 'stockout_days']:
+        heatmap_data[column] = heatmap_data[column].astype(int)
+    return heatmap_data.to_dict('records')
+
+def calculate_product_metrics(df: pd.DataFrame, carrying_cost_rate: float = 0.20) -> pd.DataFrame:
+    """
+    Computes per-product inventory metrics in a single sort and groupby pass.
+    Expects preprocessed rows with 'ProductID', 'Date', 'Inventory', 'Sales' and optionally 'StoreId',
+    'cost' (a missing cost counts as 1) and 'Price'. Returns one row per product, indexed by
+    ProductID in order of first appearance, with last_inventory, first_date, last_date, days_span,
+    total_sales, sales_rows, avg_daily_demand, days_of_supply, mean_inventory_value and
+    carrying_cost, plus total_cogs when 'Price' is present.
+    last_inventory, the current inventory, is the sum of each store's latest inventory.
+    """
+    order = pd.unique(df['ProductID'])
+    cost = df['cost'] if 'cost' in df.columns else 1
+    frame = pd.DataFrame({
+        'ProductID': df['ProductID'],
+        'StoreId': df['StoreId'] if 'StoreId' in df.columns else '',
+        'Date': df['Date'],
+        'Inventory': df['Inventory'],
+        'Sales': df['Sales'],
+        'HasSales': df['Sales'] > 0,
+        'InventoryValue': cost * df['Inventory'],
+    })
+    aggregations = dict(
+        first_date=('Date', 'min'),
+        last_date=('Date', 'max'),
+        total_sales=('Sales', 'sum'),
+        sales_rows=('HasSales', 'sum'),
+        mean_inventory_value=('InventoryValue', 'mean'),
+    )
+    if 'Price' in df.columns:
+        frame['COGS'] = df['Sales'] * df['Price']
+        aggregations['total_cogs'] = ('COGS', 'sum')
+
+    frame = frame.sort_values(by='Date', kind='stable')
+    metrics = frame.groupby('ProductID', sort=False, observed=True).agg(**aggregations)
+    # A store has one row per product and day, so its last row by Date is its latest inventory
+    latest = frame.groupby(['ProductID', 'StoreId'], sort=False, observed=True)['Inventory'].last()
+    metrics.insert(0, 'last_inventory', latest.groupby(level='ProductID', sort=False, observed=True).sum())
+    return _derive_product_metrics(metrics.reindex(order), carrying_cost_rate)
+
+def _derive_product_metrics(metrics: pd.DataFrame, carrying_cost_rate: float) -> pd.DataFrame:
+    """
+    Adds days_span, avg_daily_demand, days_of_supply and carrying_cost to per-product aggregates
+    with last_inventory, first_date, last_date, total_sales and mean_inventory_value columns.
+    """
+    days_span = (metrics['last_date'] - metrics['first_date']).dt.days
+    metrics['days_span'] = days_span.where(days_span != 0, 1)
+    metrics['avg_daily_demand'] = metrics['total_sales'] / metrics['days_span']
+    metrics['days_of_supply'] = (metrics['last_inventory'] / metrics['avg_daily_demand']).where(metrics['avg_daily_demand'] != 0)
+    metrics['carrying_cost'] = metrics['mean_inventory_value'] * carrying_cost_rate
+    return metrics
+
+def _product_metrics_from_rollup(query: dict, carrying_cost_rate: float = 0.20) -> pd.DataFrame:
+    """
+    Computes the calculate_product_metrics columns from rollup documents, one row per product
+    sorted by ProductID. Returns an empty DataFrame when there is no data.
+    """
+    rollup = load_rollup(query)
+    if rollup.empty:
+        return pd.DataFrame()
+    return _derive_product_metrics(product_aggregates(rollup), carrying_cost_rate)
 
-    df = pd.DataFrame([item.dict() for item in retail_data]).copy()
-    df = preprocess_inventory_data(df) # Preprocess the entire dataframe
+def get_product_metrics(item_id: str = None, carrying_cost_rate: float = 0.20, dataset: RetailDataset = None, use_rollup: bool = True, filters: InventoryFilter = None) -> pd.DataFrame:
+    """
+    Returns per-product metrics as computed by calculate_product_metrics, from the rollup
+    collection when it is up to date and no dataset is given, otherwise from raw rows.
+    Only rows matching `filters` (see services/filters.py) are read.
+    Returns an empty DataFrame when there is no data.
+    """
+    query = filter_query(filters, ProductID=item_id or None)
 
-    if 'Inventory' not in df.columns or 'ProductID' not in df.columns:
-        return {"error": "Inventory data missing 'Inventory' or 'ProductID'."}
+    if _use_rollup(use_rollup, dataset, query=query):
+        return _product_metrics_from_rollup(query, carrying_cost_rate)
 
-    if 'Sales' not in df.columns or 'Date' not in df.columns or 'ProductID' not in df.columns:
-        return {"error": "Sales data missing 'Sales', 'Date', or 'ProductID'."}
-    
-    if item_id:
-        df = df[df['ProductID'] == item_id]
+    df = _load_frame(query, PRODUCT_METRICS_FIELDS, dataset)
 
     if df.empty:
-        return {"days_of_supply": 0, "message": "No data for the given item ID."}
+        return pd.DataFrame()
 
-    results = []
-    for item in df['ProductID'].unique():
-        # Use the last known inventory level as current inventory
-        current_inventory = df[df['ProductID'] == item].sort_values(by='Date', ascending=False).iloc[0]['Inventory']
-        
-        item_sales = df[df['ProductID'] == item]
-        if not item_sales.empty:
-            total_days = (item_sales['Date'].max() - item_sales['Date'].min()).days
-            if total_days == 0:
-                total_days = 1
-            avg_daily_demand = item_sales['Sales'].sum() / total_days
-        else:
-            avg_daily_demand = 0
-
-        if avg_daily_demand == 0:
-            days_of_supply = None
-        else:
-            days_of_supply = current_inventory / avg_daily_demand
-        
-        results.append({"item_id": item, "days_of_supply": days_of_supply})
+    return calculate_product_metrics(df, carrying_cost_rate)
+
+def _product_metric_results(metrics: pd.DataFrame, metric_key: str) -> list:
+    """
+    Converts one column of calculate_product_metrics into a list of {"item_id", metric_key} dicts.
+    Undefined values (e.g. days of supply with zero demand) become None.
+    """
+    values = metrics[metric_key].astype(object).where(metrics[metric_key].notna(), None)
+    return [{"item_id": item, metric_key: value} for item, value in values.items()]
+
+def _product_metric_columns(metrics: pd.DataFrame, metric_key: str) -> dict:
+    """Like _product_metric_results, but as {"item_id": [...], metric_key: [...]}."""
+    values = metrics[metric_key].astype(object).where(metrics[metric_key].notna(), None)
+    return {"item_id": metrics.index.tolist(), metric_key: values.tolist()}
+
+def calculate_days_of_supply(item_id: str = None, dataset: RetailDataset = None, use_rollup: bool = True, compact: bool = False, filters: InventoryFilter = None):
+    """
+    Calculates the days of supply for an item or all items.
+    Days of Supply = Current Inventory / Avg Daily Demand
+    Answered from the rollup collection when it is up to date and no dataset is given.
+    Only rows matching `filters` (see services/filters.py) are read.
+    With compact the results carry no description (see metric_descriptions) and the results
+    for all items are returned as columns: {"item_id": [...], metric: [...]}.
+    """
+    metrics = get_product_metrics(item_id, dataset=dataset, use_rollup=use_rollup, filters=filters)
+
+    if metrics.empty:
+        return {"error": "Insufficient data."}
+
+    if compact and not item_id:
+        return _product_metric_columns(metrics, "days_of_supply")
+
+    results = _product_metric_results(metrics, "days_of_supply")
 
     if item_id and results:
-        return _add_description_to_output(results[0], "days_of_supply")
+        return _add_description_to_output(results[0], "days_of_supply", compact)
     elif not item_id:
-        return _add_description_to_output(results, "days_of_supply")
+        return _add_description_to_output(results, "days_of_supply", compact)
     else:
         return {"days_of_supply": 0, "message": "No data for the given item ID."}
 
-def calculate_carrying_cost(item_id: str = None, carrying_cost_rate: float = 0.20):
+def calculate_carrying_cost(item_id: str = None, carrying_cost_rate: float = 0.20, dataset: RetailDataset = None, use_rollup: bool = True, compact: bool = False, filters: InventoryFilter = None):
     """
     Calculates the carrying cost of inventory for an item or all items.
     Carrying Cost = Avg Inventory Value * Carrying Cost Rate
+    Answered from the rollup collection when it is up to date and no dataset is given.
+    Only rows matching `filters` (see services/filters.py) are read.
+    With compact the results carry no description (see metric_descriptions) and the results
+    for all items are returned as columns: {"item_id": [...], metric: [...]}.
     """
-    query = {}
-    if item_id:
-        query["ProductID"] = item_id
-
-    retail_data = get_validated_data(RetailData, "retail_data", query)
+    metrics = get_product_metrics(item_id, carrying_cost_rate, dataset=dataset, use_rollup=use_rollup, filters=filters)
 
-    if not retail_data:
+    if metrics.empty:
         return {"error": "No inventory data found."}
 
-    df = pd.DataFrame([item.dict() for item in retail_data]).copy()
-    df = preprocess_inventory_data(df) # Preprocess the entire dataframe
+    if compact and not item_id:
+        return _product_metric_columns(metrics, "carrying_cost")
 
-    if 'Inventory' not in df.columns or 'ProductID' not in df.columns:
-        return {"error": "Inventory data missing required 'Inventory' or 'ProductID' columns."}
-
-    if item_id:
-        df = df[df['ProductID'] == item_id]
-
-    if df.empty:
-        return {"carrying_cost": 0, "message": "No data for the given item ID."}
-
-    results = []
-    for item in df['ProductID'].unique():
-        item_inventory = df[df['ProductID'] == item]
-        # Use the 'cost' field if available, otherwise default to 1
-        inventory_value = item_inventory.get('cost', 1) * item_inventory['Inventory']
-        avg_inventory_value = inventory_value.mean()
-        if pd.isna(avg_inventory_value):
-            avg_inventory_value = None
-        
-        if avg_inventory_value is None:
-            carrying_cost = None
-        else:
-            carrying_cost = avg_inventory_value * carrying_cost_rate
-        results.append({"item_id": item, "carrying_cost": carrying_cost})
+    results = _product_metric_results(metrics, "carrying_cost")
 
     if item_id and results:
-        return _add_description_to_output(results[0], "carrying_cost")
+        return _add_description_to_output(results[0], "carrying_cost", compact)
     elif not item_id:
-        return _add_description_to_output(results, "carrying_cost")
+        return _add_description_to_output(results, "carrying_cost", compact)
     else:
         return {"carrying_cost": 0, "message": "No data for the given item ID."}
 
+def _classify_slow_obsolete(products: pd.DataFrame, slow_turnover_threshold: float, dos_threshold: int, inactivity_days: int) -> dict:
+    """
+    Classifies products as slow-moving or obsolete. `products` is indexed by ProductID with
+    total_cogs, mean_inventory_value, days_of_supply, last_date and sales_rows columns.
+    """
+    # Undefined turnover (no inventory value) never counts as slow; undefined days of supply count as 0
+    turnover_ratio = (products['total_cogs'] / products['mean_inventory_value'])
+    turnover_ratio = turnover_ratio.replace([float('inf'), -float('inf')], float('nan')).fillna(float('inf'))
+    days_of_supply = products['days_of_supply'].replace([float('inf'), -float('inf')], float('nan')).fillna(0)
+
+    # Detect slow movers
+    slow_movers = products.index[
+        (turnover_ratio < slow_turnover_threshold) |
+        (days_of_supply > dos_threshold)
+    ].tolist()
+
+    # Detect obsolete items; items with no sales data are also obsolete
+    obsolete_threshold_date = datetime.now() - timedelta(days=inactivity_days)
+    obsolete_items = products.index[
+        (products['last_date'] < obsolete_threshold_date) |
+        (products['sales_rows'] == 0)
+    ].tolist()
+
+    return {"slow_movers": list(set(slow_movers)), "obsolete_items": list(set(obsolete_items))}
+
 def detect_slow_obsolete_items(
     slow_turnover_threshold: float = 2.0,
     dos_threshold: int = 180,
-    inactivity_days: int = 180
+    inactivity_days: int = 180,
+    dataset: RetailDataset = None,
+    use_rollup: bool = True,
+    filters: InventoryFilter = None
 ) -> dict:
     """
     Detects slow-moving and obsolete items based on given thresholds.
+    Answered from the rollup collection when it is up to date and no dataset is given.
+    Only rows matching `filters` (see services/filters.py) are read.
     """
-    retail_data = get_validated_data(RetailData, "retail_data")
-    if not retail_data:
-        return {"error": "No inventory data found."}
-
-    df = pd.DataFrame([item.dict() for item in retail_data]).copy()
-    df = preprocess_inventory_data(df)
-    df['Date'] = pd.to_datetime(df['Date'])
-
-    # Calculate turnover ratio for each item
-    df['COGS'] = df['Sales'] * df['Price']
-    if 'cost' not in df.columns:
-        df['cost'] = df['Price'] * 0.8
-    df['InventoryValue'] = df['Inventory'] * df['cost']
-    
-    avg_inventory_value = df.groupby('ProductID')['InventoryValue'].mean()
-    total_cogs = df.groupby('ProductID')['COGS'].sum()
-    
-    turnover_ratio = (total_cogs / avg_inventory_value).reset_index(name='turnover_ratio')
-    turnover_ratio.replace([float('inf'), -float('inf')], None, inplace=True)
-    turnover_ratio.fillna(float('inf'), inplace=True)
-
-
-    # Calculate days of supply for each item
-    current_inventory = df.loc[df.groupby('ProductID')['Date'].idxmax()][['ProductID', 'Inventory']]
-    current_inventory.rename(columns={'Inventory': 'current_inventory'}, inplace=True)
-    
-    sales_data = df.groupby('ProductID').agg(
-        total_sales=('Sales', 'sum'),
-        min_date=('Date', 'min'),
-        max_date=('Date', 'max')
-    ).reset_index()
-
-    sales_data['duration_days'] = (sales_data['max_date'] - sales_data['min_date']).dt.days
-    sales_data['duration_days'] = sales_data['duration_days'].apply(lambda x: 1 if x == 0 else x)
-    sales_data['avg_daily_demand'] = sales_data['total_sales'] / sales_data['duration_days']
-
-    dos_df = pd.merge(current_inventory, sales_data, on='ProductID')
-    dos_df['days_of_supply'] = dos_df['current_inventory'] / dos_df['avg_daily_demand']
-    dos_df['days_of_supply'].replace([float('inf'), -float('inf')], None, inplace=True)
-    dos_df.fillna(0, inplace=True)
-
-
-    # Merge metrics
-    metrics_df = pd.merge(turnover_ratio, dos_df[['ProductID', 'days_of_supply']], on='ProductID', how='left')
-    metrics_df.rename(columns={'ProductID': 'item_id'}, inplace=True)
-
-    # Detect slow movers
-    slow_movers = metrics_df[
-        (metrics_df['turnover_ratio'] < slow_turnover_threshold) |
-        (metrics_df['days_of_supply'] > dos_threshold)
-    ]['item_id'].tolist()
-
-    # Detect obsolete items
-    last_sale_dates = df.groupby('ProductID')['Date'].max().reset_index()
-    obsolete_threshold_date = datetime.now() - timedelta(days=inactivity_days)
-    obsolete_items = last_sale_dates[
-        last_sale_dates['Date'] < obsolete_threshold_date
-    ]['ProductID'].tolist()
+    query = filter_query(filters)
+    if _use_rollup(use_rollup, dataset, query=query):
+        products = _product_metrics_from_rollup(query)
+    else:
+        df = _load_frame(query, SLOW_MOVER_FIELDS, dataset)
+        products = pd.DataFrame() if df.empty else calculate_product_metrics(df)
 
-    # Items with no sales data are also obsolete
-    items_with_sales = df[df['Sales'] > 0]['ProductID'].unique()
-    all_items = df['ProductID'].unique()
-    items_without_sales = list(set(all_items) - set(items_with_sales))
-    obsolete_items.extend(items_without_sales)
+    if products.empty:
+        return {"error": "No inventory data found."}
 
-    return {"slow_movers": list(set(slow_movers)), "obsolete_items": list(set(obsolete_items))}
+    return _classify_slow_obsolete(products, slow_turnover_threshold, dos_threshold, inactivity_days)
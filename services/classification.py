@@ -0,0 +1,185 @@
+import numpy as np
+import pandas as pd
+import os
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from datetime import datetime
+from typing import Iterable, List
+from pymongo import DeleteMany, ReplaceOne, UpdateMany
+from config import settings
+from database import aggregate, bulk_write, get_db, is_derived_current, mark_derived_current, CLASSES_COLLECTION, EPISODES_COLLECTION, ROLLUP_COLLECTION
+from services.rollup import is_rollup_current, rebuild_rollup
+
+# Cumulative share of sales value (in percent) up to which products are A and B; the rest are C
+ABC_THRESHOLDS = (80, 95)
+# Coefficient of variation of monthly demand up to which products are X and Y; the rest are Z
+XYZ_THRESHOLDS = (0.5, 1.0)
+
+
+def _monthly_pipeline(keys: List[str]) -> list:
+    """Sums sales value and demand of the rollup documents per key and month."""
+    return [
+        {"$group": {
+            "_id": {**{key: f"${key}" for key in keys}, "month": "$month"},
+            "sales_value": {"$sum": "$cogs_sum"},
+            "demand": {"$sum": "$sales_sum"},
+        }},
+    ]
+
+
+def load_monthly_demand(by_store: bool = False) -> pd.DataFrame:
+    """
+    Returns sales value and demand per product (and store) and month, read from the rollup
+    collection, indexed by the classification keys and month.
+    """
+    keys = ["ProductID", "StoreId"] if by_store else ["ProductID"]
+    documents = aggregate(_monthly_pipeline(keys), ROLLUP_COLLECTION)
+    if not documents:
+        return pd.DataFrame(columns=["sales_value", "demand"], index=pd.MultiIndex.from_tuples([], names=keys + ["month"]))
+    df = pd.DataFrame([{**doc["_id"], "sales_value": doc["sales_value"], "demand": doc["demand"]} for doc in documents])
+    return df.set_index(keys + ["month"]).sort_index()
+
+
+def abc_classes(sales_value: pd.Series, group_level: str = None) -> pd.Series:
+    """
+    Assigns ABC classes by cumulative share of sales value, ranking from the highest value down.
+    With group_level, products are ranked within each value of that index level (e.g. per store).
+    """
+    ordered = sales_value.fillna(0).sort_values(ascending=False, kind="stable")
+    if group_level:
+        grouped = ordered.groupby(level=group_level)
+        cumulative_percentage = grouped.cumsum() / grouped.transform("sum") * 100
+    else:
+        cumulative_percentage = ordered.cumsum() / ordered.sum() * 100
+    classes = np.select(
+        [cumulative_percentage <= ABC_THRESHOLDS[0], cumulative_percentage <= ABC_THRESHOLDS[1]],
+        ["A", "B"],
+        "C",
+    )
+    return pd.Series(classes, index=ordered.index).reindex(sales_value.index)
+
+
+def xyz_classes(demand: pd.Series) -> pd.DataFrame:
+    """
+    Assigns XYZ classes by the coefficient of variation of monthly demand. `demand` is indexed
+    by the classification keys and month; months without rows count as zero demand from each
+    product's first month on. Returns demand_cv and xyz_class per key.
+    """
+    keys = list(demand.index.names[:-1])
+    months = demand.index.get_level_values("month")
+    all_months = pd.period_range(min(months), max(months), freq="M").strftime("%Y-%m")
+
+    matrix = demand.unstack("month").reindex(columns=all_months)
+    # Months before a product's first row are not part of its history
+    active = matrix.notna().cummax(axis=1)
+    matrix = matrix.fillna(0).where(active)
+
+    mean = matrix.mean(axis=1)
+    demand_cv = (matrix.std(axis=1, ddof=0) / mean).where(mean > 0, np.inf)
+    classes = np.select(
+        [demand_cv <= XYZ_THRESHOLDS[0], demand_cv <= XYZ_THRESHOLDS[1]],
+        ["X", "Y"],
+        "Z",
+    )
+    result = pd.DataFrame({"demand_cv": demand_cv, "xyz_class": classes}, index=matrix.index)
+    result.index.names = keys
+    return result
+
+
+def classify(monthly: pd.DataFrame, by_store: bool = False) -> pd.DataFrame:
+    """
+    Computes ABC and XYZ classes from monthly sales value and demand (see load_monthly_demand).
+    Returns one row per product (and store) with sales_value, abc_class, demand_cv and xyz_class.
+    """
+    keys = list(monthly.index.names[:-1])
+    sales_value = monthly["sales_value"].groupby(level=keys).sum()
+    classes = pd.DataFrame({
+        "sales_value": sales_value,
+        "abc_class": abc_classes(sales_value, "StoreId" if by_store else None),
+    })
+    return classes.join(xyz_classes(monthly["demand"]))
+
+
+def load_class_lookup() -> dict:
+    """
+    Returns the stored (abc_class, xyz_class) per (ProductID, StoreId), with a StoreId of None
+    when products are not classified per store, so ingested rows can be written with their classes.
+    """
+    documents = get_db()[CLASSES_COLLECTION].find({}, {"abc_class": 1, "xyz_class": 1})
+    return {(doc["_id"]["ProductID"], doc["_id"].get("StoreId")): (doc.get("abc_class"), doc.get("xyz_class")) for doc in documents}
+
+
+def _load_previous_classes() -> dict:
+    documents = get_db()[CLASSES_COLLECTION].find({}, {"abc_class": 1, "xyz_class": 1})
+    return {tuple(sorted(doc["_id"].items())): (doc.get("abc_class"), doc.get("xyz_class")) for doc in documents}
+
+
+def write_classes(classes: pd.DataFrame, product_ids: Iterable[str] = None) -> set:
+    """
+    Writes classes to the retail_data rows of every product whose class changed since the last
+    run, and of every product in product_ids. Only rows whose class differs are modified.
+    The rollup and stockout episodes hold no classes, so they stay current if they were.
+    Returns the ProductIDs written to.
+    """
+    keys = list(classes.index.names)
+    records = classes.reset_index().to_dict("records")
+    previous = _load_previous_classes()
+    product_ids = set(product_ids or [])
+
+    operations = []
+    written = set()
+    for record in records:
+        key = {field: record[field] for field in keys}
+        new_class = (record["abc_class"], record["xyz_class"])
+        if previous.get(tuple(sorted(key.items()))) == new_class and record["ProductID"] not in product_ids:
+            continue
+        written.add(record["ProductID"])
+        operations.append(UpdateMany(
+            {**key, "$or": [{"abc_class": {"$ne": new_class[0]}}, {"xyz_class": {"$ne": new_class[1]}}]},
+            {"$set": {"abc_class": new_class[0], "xyz_class": new_class[1]}},
+        ))
+    current = [name for name in (ROLLUP_COLLECTION, EPISODES_COLLECTION) if operations and is_derived_current(name)]
+    bulk_write(operations, "retail_data")
+    for name in current:
+        mark_derived_current(name)
+
+    # Keep the class documents in step, dropping keys that no longer have data
+    ids = [{field: record[field] for field in keys} for record in records]
+    class_documents = [
+        ReplaceOne({"_id": _id}, {
+            "_id": _id,
+            **_id,
+            "sales_value": record["sales_value"],
+            "abc_class": record["abc_class"],
+            "demand_cv": record["demand_cv"] if np.isfinite(record["demand_cv"]) else None,
+            "xyz_class": record["xyz_class"],
+            "updated_at": datetime.now(),
+        }, upsert=True)
+        for _id, record in zip(ids, records)
+    ]
+    class_documents.append(DeleteMany({"_id": {"$nin": ids}}))
+    get_db()[CLASSES_COLLECTION].bulk_write(class_documents, ordered=True)
+
+    print(f"Classified {len(records)} {'product/store pairs' if 'StoreId' in keys else 'products'}; updated rows of {len(written)} products.")
+    return written
+
+
+def update_classes(product_ids: Iterable[str] = None, by_store: bool = None) -> pd.DataFrame:
+    """
+    Recomputes ABC/XYZ classes from the rollup collection and writes changed classes back to
+    retail_data in bulk (see write_classes). abc_class filters answered from the rollup read the
+    classes from product_classes, so the rollup is not rebuilt afterwards.
+    Returns the classes, or an empty DataFrame when there is no data.
+    """
+    if by_store is None:
+        by_store = settings.classification_by_store
+    if not is_rollup_current():
+        rebuild_rollup()
+
+    monthly = load_monthly_demand(by_store)
+    if monthly.empty:
+        return pd.DataFrame()
+
+    classes = classify(monthly, by_store)
+    write_classes(classes, product_ids)
+    return classes
@@ -1,30 +1,21 @@
 import pandas as pd
-from sklearn.preprocessing import LabelEncoder, StandardScaler
+from services.features import FeaturePipeline
+from telemetry import timed
 
-def preprocess_for_forecasting(df: pd.DataFrame) -> pd.DataFrame:
+def preprocess_for_forecasting(df: pd.DataFrame, pipeline: FeaturePipeline = None) -> pd.DataFrame:
     """
     Preprocesses the DataFrame for forecasting, including categorical encoding, and numerical scaling.
+    Pass a fitted FeaturePipeline to reuse the statistics learned on training data; otherwise one
+    is fitted on df. The input DataFrame is not modified.
     """
     if df.empty:
         return df
 
-    # 1. Categorical Feature Encoding
-    categorical_cols = ['Category', 'Region', 'Weather', 'Seasonality', 'Promotion']
-    for col in categorical_cols:
-        if col in df.columns:
-            le = LabelEncoder()
-            df[col] = le.fit_transform(df[col].astype(str)) # Convert to string to handle NaNs if any
-
-    # 2. Numerical Feature Scaling
-    numerical_cols = df.select_dtypes(include=['number']).columns.tolist()
-    numerical_cols = [col for col in numerical_cols if col not in categorical_cols]
-
-    if numerical_cols:
-        scaler = StandardScaler()
-        df[numerical_cols] = scaler.fit_transform(df[numerical_cols])
-
-    return df
+    if pipeline is None:
+        pipeline = FeaturePipeline().fit(df)
+    return pipeline.transform(df)
 
+@timed("preprocess")
 def preprocess_inventory_data(df: pd.DataFrame) -> pd.DataFrame:
     """
     Preprocesses inventory data DataFrame.
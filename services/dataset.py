@@ -0,0 +1,191 @@
+import pandas as pd
+import os
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import json
+import threading
+from collections import OrderedDict
+from typing import Callable, List
+from config import settings
+from database import get_columnar_data, get_collection_version
+from models import RetailData
+from services.data_preprocessing import preprocess_inventory_data
+from services.filters import matches
+from services.schema import apply_schema
+from services.snapshot import load_snapshot, snapshot_info
+from telemetry import stage
+
+
+class DatasetCache:
+    """
+    A process-wide LRU cache of preprocessed frames, keyed by collection, query filter and projection.
+    Each entry is tagged with the collection version it was loaded at. Once a newer version is
+    observed, every entry of that collection loaded at an older version is dropped. The total
+    size of the cached frames is bounded by max_bytes; a max_bytes of 0 disables caching.
+    Cached frames are shared and must not be modified by callers.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict() # key -> (version, frame, nbytes)
+        self._versions = {} # collection name -> latest version observed
+        self._size = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(collection_name: str, query: dict, fields: List[str]) -> tuple:
+        return (collection_name, json.dumps(query, sort_keys=True, default=str), tuple(fields))
+
+    def get_or_load(self, collection_name: str, query: dict, fields: List[str], loader: Callable[[], pd.DataFrame]) -> pd.DataFrame:
+        """
+        Returns the cached frame for (collection_name, query, fields) if it was loaded at the
+        collection's current version, otherwise calls loader() and caches its result.
+        """
+        if self.max_bytes <= 0:
+            return loader()
+
+        version = get_collection_version(collection_name)
+        key = self._key(collection_name, query, fields)
+        with self._lock:
+            self._drop_stale(collection_name, version)
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == version:
+                self._entries.move_to_end(key)
+                return entry[1]
+
+        df = loader()
+        self._put(key, version, df)
+        return df
+
+    def _drop_stale(self, collection_name: str, version: int):
+        if version <= self._versions.get(collection_name, -1):
+            return
+        self._versions[collection_name] = version
+        stale = [key for key, entry in self._entries.items() if key[0] == collection_name and entry[0] < version]
+        for key in stale:
+            self._remove(key)
+
+    def _put(self, key: tuple, version: int, df: pd.DataFrame):
+        nbytes = int(df.memory_usage(index=True, deep=True).sum())
+        if nbytes > self.max_bytes:
+            return # Never evict everything for a frame that cannot fit anyway
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (version, df, nbytes)
+            self._size += nbytes
+            while self._size > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+
+    def _remove(self, key: tuple):
+        _, _, nbytes = self._entries.pop(key)
+        self._size -= nbytes
+
+    def clear(self):
+        """Drops every cached frame."""
+        with self._lock:
+            self._entries.clear()
+            self._versions.clear()
+            self._size = 0
+
+
+dataset_cache = DatasetCache(settings.dataset_cache_max_mb * 1024 * 1024)
+
+
+class RetailDataset:
+    """
+    A request-scoped snapshot of the retail_data collection.
+    The rows matching `query` are fetched and preprocessed once, on first use, and then shared
+    by every calculation the dataset is passed to. `fields` is the column projection; it must
+    cover the columns the calculations read and filter on. Unless use_cache is False, the rows
+    are served from the process-wide dataset_cache while the collection version is unchanged.
+    When a snapshot exported at the current collection version covers the query and fields
+    (see services/snapshot.py), the rows are mapped from it instead of fetched from MongoDB.
+    Columns are in the compact dtypes of services/schema.py: categorical strings, int32 counts
+    where they fit and datetime64 dates.
+    """
+
+    def __init__(self, query: dict = None, fields: List[str] = None, collection_name: str = "retail_data", use_cache: bool = True):
+        self.query = dict(query) if query else {}
+        self.fields = list(fields) if fields is not None else list(RetailData.model_fields)
+        self.collection_name = collection_name
+        self.use_cache = use_cache
+        self._df = None
+        self._snapshot = None # metadata of the snapshot the rows were mapped from
+
+    @classmethod
+    def from_frame(cls, df: pd.DataFrame, fields: List[str] = None) -> "RetailDataset":
+        """
+        Wraps rows that are already loaded and preprocessed, e.g. generated data in benchmarks.
+        """
+        dataset = cls(fields=fields if fields is not None else list(df.columns), use_cache=False)
+        dataset._df = df[dataset.fields]
+        return dataset
+
+    def _load_snapshot(self) -> pd.DataFrame:
+        if self._snapshot is None:
+            meta = snapshot_info(self.collection_name)
+            if meta is None or meta["version"] != get_collection_version(self.collection_name):
+                return None
+        else:
+            meta = self._snapshot
+        try:
+            with stage("fetch"):
+                df = load_snapshot(self.query, self.fields, self.collection_name, meta)
+        except FileNotFoundError:
+            return None # Replaced by newer exports since
+        if df is not None:
+            self._snapshot = meta
+        return df
+
+    def _load(self) -> pd.DataFrame:
+        if settings.use_snapshot:
+            df = self._load_snapshot()
+            if df is not None:
+                return apply_schema(df)
+        df = get_columnar_data(RetailData, self.collection_name, self.query, fields=self.fields)
+        return apply_schema(preprocess_inventory_data(df))
+
+    def __getstate__(self) -> dict:
+        # Rows mapped from a snapshot are not pickled: a worker process maps the same snapshot
+        # files, sharing their pages, instead of receiving a copy of the rows
+        state = self.__dict__.copy()
+        if self._snapshot is not None:
+            state["_df"] = None
+        return state
+
+    @property
+    def df(self) -> pd.DataFrame:
+        """The preprocessed rows of the dataset, loaded on first access."""
+        if self._df is None:
+            if self.use_cache:
+                self._df = dataset_cache.get_or_load(self.collection_name, self.query, self.fields, self._load)
+            else:
+                self._df = self._load()
+        return self._df
+
+    def select(self, query: dict = None, fields: List[str] = None) -> pd.DataFrame:
+        """
+        Returns a copy of the rows matching a query of equality conditions and ranges
+        (see services/filters.py), restricted to `fields`.
+        Callers may modify the returned frame without affecting the shared snapshot.
+        """
+        if query is None:
+            query = {}
+        if fields is None:
+            fields = self.fields
+
+        # Conditions the dataset was loaded with already hold for every row
+        conditions = {col: value for col, value in query.items() if self.query.get(col, object()) != value}
+
+        missing = [col for col in list(conditions) + list(fields) if col not in self.fields]
+        if missing:
+            raise ValueError(f"Dataset does not include the fields: {', '.join(missing)}")
+
+        df = self.df
+        if conditions and not df.empty:
+            mask = pd.Series(True, index=df.index)
+            for col, value in conditions.items():
+                mask &= matches(df[col], value)
+            return df.loc[mask, fields].copy()
+        return df[fields].copy()
@@ -0,0 +1,162 @@
+import numpy as np
+import pandas as pd
+import json
+import os
+import tempfile
+from typing import Iterable, Iterator, List
+
+# Standalone on purpose: the forecast models of services/forecasting.py smooth each series' daily
+# demand and take no features. FeaturePipeline is for feature-based models, through
+# preprocess_for_forecasting.
+
+# Columns encoded as integer category codes by default; other numeric columns are standardized
+CATEGORICAL_FEATURES = ['Category', 'Region', 'Weather', 'Seasonality', 'Promotion']
+
+
+class FeaturePipeline:
+    """
+    Feature encoding for forecasting that is fitted once and then applied to any number of frames.
+    fit() learns the categories of each categorical column and the mean and standard deviation of
+    each numeric column; transform() only applies them, so inference reuses the training
+    statistics. Categorical values become pandas category codes (-1 for missing values and
+    categories not seen during fitting); numeric values become (x - mean) / std.
+    Statistics can be accumulated over chunks with partial_fit, and the pipeline round-trips
+    through to_dict/from_dict and save/load as JSON.
+    """
+
+    def __init__(self, categorical_columns: List[str] = None, numeric_columns: List[str] = None):
+        self.categorical_columns = list(CATEGORICAL_FEATURES if categorical_columns is None else categorical_columns)
+        # None infers the numeric columns from the first frame fitted
+        self.numeric_columns = None if numeric_columns is None else list(numeric_columns)
+        self.categories = {}
+        # Running count, mean and sum of squared deviations per numeric column
+        self.count = pd.Series(dtype=float)
+        self.mean = pd.Series(dtype=float)
+        self.m2 = pd.Series(dtype=float)
+
+    @property
+    def fitted(self) -> bool:
+        return bool(self.categories) or not self.count.empty
+
+    @property
+    def scale(self) -> pd.Series:
+        """Population standard deviation per numeric column; 1 where it is 0 or undefined."""
+        std = np.sqrt(self.m2 / self.count.where(self.count > 0))
+        return std.where(std > 0, 1.0)
+
+    def fit(self, df: pd.DataFrame) -> "FeaturePipeline":
+        """Learns the statistics of df, discarding earlier ones. Returns the pipeline."""
+        self.categories = {}
+        self.count = pd.Series(dtype=float)
+        self.mean = pd.Series(dtype=float)
+        self.m2 = pd.Series(dtype=float)
+        return self.partial_fit(df)
+
+    def partial_fit(self, df: pd.DataFrame) -> "FeaturePipeline":
+        """
+        Adds the rows of df to the statistics learned so far, e.g. chunk by chunk over data that
+        does not fit in memory. Returns the pipeline.
+        """
+        for column in self.categorical_columns:
+            if column in df.columns:
+                seen = self._as_strings(df[column]).dropna().unique()
+                self.categories[column] = sorted(set(self.categories.get(column, [])).union(seen))
+
+        if self.numeric_columns is None:
+            self.numeric_columns = [
+                column for column in df.select_dtypes(include=['number']).columns
+                if column not in self.categorical_columns
+            ]
+        columns = [column for column in self.numeric_columns if column in df.columns]
+        if not columns:
+            return self
+
+        values = df[columns].astype(float)
+        count = values.count().astype(float)
+        mean = values.mean()
+        m2 = ((values - mean) ** 2).sum()
+
+        # Combine with the previous chunks (Chan et al.'s parallel variance update)
+        previous_count = self.count.reindex(columns).fillna(0.0)
+        previous_mean = self.mean.reindex(columns).fillna(0.0)
+        previous_m2 = self.m2.reindex(columns).fillna(0.0)
+        total = previous_count + count
+        delta = (mean - previous_mean).fillna(0.0)
+        weight = (count / total.where(total > 0)).fillna(0.0)
+        combined_mean = previous_mean + delta * weight
+        combined_m2 = previous_m2 + m2 + delta ** 2 * previous_count * weight
+
+        self.count = total.combine_first(self.count)
+        self.mean = combined_mean.where(total > 0, np.nan).combine_first(self.mean)
+        self.m2 = combined_m2.combine_first(self.m2)
+        return self
+
+    @staticmethod
+    def _as_strings(values: pd.Series) -> pd.Series:
+        # Categories are matched as strings so that e.g. Promotion 1 and "1" share a code
+        if isinstance(values.dtype, pd.CategoricalDtype) or values.dtype == object:
+            return values.astype(object).where(values.isna(), values.astype(str))
+        return values.astype(str).where(values.notna())
+
+    def transform(self, df: pd.DataFrame) -> pd.DataFrame:
+        """
+        Returns a new frame with the categorical columns replaced by their codes and the numeric
+        columns standardized; other columns are passed through. df is not modified.
+        """
+        if not self.fitted:
+            raise ValueError("FeaturePipeline must be fitted before transform.")
+        result = df.copy(deep=False)
+        for column, categories in self.categories.items():
+            if column in result.columns:
+                codes = pd.Categorical(self._as_strings(result[column]), categories=categories).codes
+                result[column] = codes.astype(np.int32)
+
+        columns = [column for column in self.count.index if column in result.columns]
+        if columns:
+            scaled = (result[columns].astype(float) - self.mean[columns]) / self.scale[columns]
+            for column in columns:
+                result[column] = scaled[column]
+        return result
+
+    def fit_transform(self, df: pd.DataFrame) -> pd.DataFrame:
+        return self.fit(df).transform(df)
+
+    def transform_chunks(self, chunks: Iterable[pd.DataFrame]) -> Iterator[pd.DataFrame]:
+        """Transforms frames one at a time, e.g. the batches of a cursor or a CSV reader."""
+        for chunk in chunks:
+            yield self.transform(chunk)
+
+    def to_dict(self) -> dict:
+        return {
+            "categorical_columns": self.categorical_columns,
+            "numeric_columns": self.numeric_columns,
+            "categories": self.categories,
+            "count": self.count.to_dict(),
+            "mean": self.mean.to_dict(),
+            "m2": self.m2.to_dict(),
+        }
+
+    @classmethod
+    def from_dict(cls, state: dict) -> "FeaturePipeline":
+        pipeline = cls(state["categorical_columns"], state["numeric_columns"])
+        pipeline.categories = {column: list(categories) for column, categories in state["categories"].items()}
+        pipeline.count = pd.Series(state["count"], dtype=float)
+        pipeline.mean = pd.Series(state["mean"], dtype=float)
+        pipeline.m2 = pd.Series(state["m2"], dtype=float)
+        return pipeline
+
+    def save(self, path: str):
+        """Writes the pipeline as JSON, replacing path atomically."""
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), prefix=".", suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump(self.to_dict(), f)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+
+    @classmethod
+    def load(cls, path: str) -> "FeaturePipeline":
+        with open(path) as f:
+            return cls.from_dict(json.load(f))
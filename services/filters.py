@@ -0,0 +1,66 @@
+import numpy as np
+import os
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from datetime import datetime, time, timedelta
+from models import InventoryFilter
+
+# retail_data field matched by each equality filter of InventoryFilter
+FILTER_FIELDS = {
+    "store_id": "StoreId",
+    "region": "Region",
+    "category": "Category",
+    "abc_class": "abc_class",
+}
+# Range operators a query may use on Date, besides equality on string fields
+RANGE_OPERATORS = {
+    "$gte": np.greater_equal,
+    "$gt": np.greater,
+    "$lte": np.less_equal,
+    "$lt": np.less,
+}
+
+
+def filter_query(filters: InventoryFilter = None, **equalities) -> dict:
+    """
+    Builds the retail_data query for a filter spec, e.g. {"StoreId": "S003", "Date": {"$gte":
+    ..., "$lt": ...}}. Further equality conditions are given by field, e.g. ProductID=item_id,
+    and take precedence over the filters; None values are left out. Raises ValueError when
+    start_date is after end_date.
+    """
+    query = {}
+    if filters is None:
+        filters = InventoryFilter()
+    for name, field in FILTER_FIELDS.items():
+        value = getattr(filters, name)
+        if value is not None:
+            query[field] = value
+
+    if filters.start_date and filters.end_date and filters.start_date > filters.end_date:
+        raise ValueError("start_date must not be after end_date.")
+    date_range = {}
+    if filters.start_date:
+        date_range["$gte"] = datetime.combine(filters.start_date, time.min)
+    if filters.end_date:
+        # Up to the end of end_date
+        date_range["$lt"] = datetime.combine(filters.end_date + timedelta(days=1), time.min)
+    if date_range:
+        query["Date"] = date_range
+    query.update((field, value) for field, value in equalities.items() if value is not None)
+    return query
+
+
+def is_range(condition) -> bool:
+    """Returns True for a condition of range operators, e.g. {"$gte": start, "$lt": end}."""
+    return isinstance(condition, dict) and bool(condition) and all(operator in RANGE_OPERATORS for operator in condition)
+
+
+def matches(values, condition):
+    """Evaluates an equality or range condition on a Series or array, returning a boolean mask."""
+    if not is_range(condition):
+        return values == condition
+    mask = None
+    for operator, bound in condition.items():
+        match = RANGE_OPERATORS[operator](values, bound)
+        mask = match if mask is None else mask & match
+    return mask
@@ -0,0 +1,432 @@
+import numpy as np
+import pandas as pd
+import json
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from typing import Iterable, Iterator, List, Optional, Tuple
+from config import settings
+from database import get_collection_version, get_columnar_data, get_db
+from models import RetailData
+from services.data_preprocessing import preprocess_sales_data
+
+# Each series (a product, or a product in a store) gets an exponential smoothing model with
+# additive day-of-week seasonality. Its state is a handful of numbers, so models of all series
+# are stored together as columns of one frame, fitted for many series at once with NumPy, and
+# updated incrementally by continuing the smoothing over new days.
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEMAND_FIELDS = ["Date", "StoreId", "ProductID", "Sales"]
+# Smoothing factors tried per series; the one with the lowest one-step-ahead error is kept
+ALPHAS = np.array([0.05, 0.1, 0.2, 0.3, 0.5])
+DOW_SUM_COLUMNS = [f"dow_sum_{day}" for day in range(7)]
+DOW_COUNT_COLUMNS = [f"dow_count_{day}" for day in range(7)]
+MODEL_COLUMNS = ["alpha", "level", "last_date", "n_obs", "sse", "n_err"] + DOW_SUM_COLUMNS + DOW_COUNT_COLUMNS
+
+_models_cache = {"version": None, "models": None, "meta": None}
+_models_cache_lock = threading.Lock()
+
+
+def series_keys(by_store: bool) -> List[str]:
+    return ["ProductID", "StoreId"] if by_store else ["ProductID"]
+
+
+def load_daily_demand(product_ids: List[str], by_store: bool = False, after: datetime = None) -> pd.Series:
+    """
+    Returns units sold per series and day for the given products, indexed by the series keys
+    and Date. With `after`, only days after that date are read.
+    """
+    query = {"ProductID": {"$in": list(product_ids)}}
+    if after is not None:
+        query["Date"] = {"$gt": pd.Timestamp(after).to_pydatetime()}
+    df = preprocess_sales_data(get_columnar_data(RetailData, "retail_data", query, fields=DEMAND_FIELDS))
+    keys = series_keys(by_store)
+    df = df.dropna(subset=keys)
+    if df.empty:
+        return pd.Series(dtype=float, index=pd.MultiIndex.from_tuples([], names=keys + ["Date"]), name="Sales")
+    df["Date"] = df["Date"].dt.normalize()
+    return df.groupby(keys + ["Date"])["Sales"].sum()
+
+
+def _empty_models(keys: List[str]) -> pd.DataFrame:
+    # Indexed like fitted models: by ProductID alone, or by (ProductID, StoreId), so that
+    # concatenating them keeps the index names save_models reads
+    index = pd.Index([], name=keys[0]) if len(keys) == 1 else pd.MultiIndex.from_tuples([], names=keys)
+    models = pd.DataFrame(columns=MODEL_COLUMNS, index=index)
+    return models.astype({column: float for column in MODEL_COLUMNS if column != "last_date"}).astype({"last_date": "datetime64[ns]"})
+
+
+def _daily_matrix(demand: pd.Series) -> Tuple[pd.Index, pd.DatetimeIndex, np.ndarray]:
+    """Lays demand out as a (series x day) matrix over a gap-free calendar; missing days are NaN."""
+    frame = demand.unstack("Date")
+    calendar = pd.date_range(frame.columns.min(), frame.columns.max(), freq="D")
+    return frame.index, calendar, frame.reindex(columns=calendar).to_numpy(dtype=float)
+
+
+def _dow_totals(y: np.ndarray, dow: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    observed = ~np.isnan(y)
+    dow_sum = np.stack([np.nansum(y[:, dow == day], axis=1) for day in range(7)], axis=1)
+    dow_count = np.stack([observed[:, dow == day].sum(axis=1) for day in range(7)], axis=1)
+    return dow_sum, dow_count.astype(float)
+
+
+def _seasonal(dow_sum: np.ndarray, dow_count: np.ndarray) -> np.ndarray:
+    """Day-of-week means minus the overall mean; 0 for days without observations."""
+    overall = dow_sum.sum(axis=1) / np.maximum(dow_count.sum(axis=1), 1)
+    means = np.divide(dow_sum, dow_count, out=np.zeros_like(dow_sum), where=dow_count > 0)
+    return np.where(dow_count > 0, means - overall[:, None], 0.0)
+
+
+def _smooth(z: np.ndarray, alpha: np.ndarray, level: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Runs simple exponential smoothing over the columns of z for all series (and smoothing
+    factors) at once. `level` is (series x factors), NaN where a series has no level yet; NaN
+    observations leave the level unchanged. Returns the final levels and the sum and count
+    of squared one-step-ahead errors.
+    """
+    sse = np.zeros(level.shape)
+    n_err = np.zeros(level.shape)
+    for t in range(z.shape[1]):
+        observation = z[:, t:t + 1]
+        observed = ~np.isnan(observation)
+        error = observation - level
+        update = observed & ~np.isnan(level)
+        sse += np.where(update, error * error, 0.0)
+        n_err += update
+        level = np.where(update, level + alpha * error, np.where(observed, observation, level))
+    return level, sse, n_err
+
+
+def fit_models(demand: pd.Series) -> pd.DataFrame:
+    """
+    Fits a model per series of daily demand (see load_daily_demand), trying every factor in
+    ALPHAS. Returns the models indexed by the series keys.
+    """
+    keys = list(demand.index.names[:-1])
+    if demand.empty:
+        return _empty_models(keys)
+
+    index, calendar, y = _daily_matrix(demand)
+    dow = calendar.dayofweek.to_numpy()
+    dow_sum, dow_count = _dow_totals(y, dow)
+    z = y - _seasonal(dow_sum, dow_count)[:, dow]
+
+    level, sse, n_err = _smooth(z, ALPHAS[None, :], np.full((len(y), len(ALPHAS)), np.nan))
+    best = np.argmin(np.where(n_err > 0, sse / np.maximum(n_err, 1), np.inf), axis=1)
+    rows = np.arange(len(y))
+    observed = ~np.isnan(y)
+    last_day = y.shape[1] - 1 - np.argmax(observed[:, ::-1], axis=1)
+
+    models = pd.DataFrame({
+        "alpha": ALPHAS[best],
+        "level": level[rows, best],
+        "last_date": calendar[last_day],
+        "n_obs": observed.sum(axis=1).astype(float),
+        "sse": sse[rows, best],
+        "n_err": n_err[rows, best],
+    }, index=index)
+    models[DOW_SUM_COLUMNS] = dow_sum
+    models[DOW_COUNT_COLUMNS] = dow_count
+    return models
+
+
+def update_models(models: pd.DataFrame, demand: pd.Series) -> pd.DataFrame:
+    """
+    Continues the models of the series in `demand` over its days, which must come after each
+    series' last_date, keeping each series' smoothing factor. Returns the updated models.
+    """
+    if demand.empty:
+        return models.iloc[:0]
+    index, calendar, y = _daily_matrix(demand)
+    models = models.loc[index].copy()
+    dow = calendar.dayofweek.to_numpy()
+    dow_sum, dow_count = _dow_totals(y, dow)
+    dow_sum += models[DOW_SUM_COLUMNS].to_numpy(dtype=float)
+    dow_count += models[DOW_COUNT_COLUMNS].to_numpy(dtype=float)
+    z = y - _seasonal(dow_sum, dow_count)[:, dow]
+
+    alpha = models["alpha"].to_numpy(dtype=float)[:, None]
+    level, sse, n_err = _smooth(z, alpha, models["level"].to_numpy(dtype=float)[:, None])
+    observed = ~np.isnan(y)
+    last_day = y.shape[1] - 1 - np.argmax(observed[:, ::-1], axis=1)
+
+    models["level"] = level[:, 0]
+    models["sse"] += sse[:, 0]
+    models["n_err"] += n_err[:, 0]
+    models["n_obs"] += observed.sum(axis=1)
+    models["last_date"] = np.maximum(models["last_date"].to_numpy(), calendar[last_day].to_numpy())
+    models[DOW_SUM_COLUMNS] = dow_sum
+    models[DOW_COUNT_COLUMNS] = dow_count
+    return models
+
+
+def forecast(models: pd.DataFrame, horizon: int) -> np.ndarray:
+    """
+    Returns a (series x horizon) array of daily demand forecasts for the days following each
+    series' last_date.
+    """
+    last_date = models["last_date"].to_numpy().astype("datetime64[D]").astype(np.int64)
+    # Day 0 of the epoch (1970-01-01) is a Thursday, weekday 3
+    first_dow = (last_date + 1 + 3) % 7
+    dows = (first_dow[:, None] + np.arange(horizon)) % 7
+    seasonal = _seasonal(models[DOW_SUM_COLUMNS].to_numpy(dtype=float), models[DOW_COUNT_COLUMNS].to_numpy(dtype=float))
+    values = models["level"].to_numpy(dtype=float)[:, None] + seasonal[np.arange(len(models))[:, None], dows]
+    return np.clip(np.nan_to_num(values), 0, None)
+
+
+def _model_dir() -> str:
+    if os.path.isabs(settings.forecast_model_dir):
+        return settings.forecast_model_dir
+    return os.path.join(PROJECT_ROOT, settings.forecast_model_dir)
+
+
+def _version_dir(version: int) -> str:
+    return os.path.join(_model_dir(), f"v{version:06d}")
+
+
+def _saved_versions() -> List[int]:
+    if not os.path.isdir(_model_dir()):
+        return []
+    return sorted(int(name[1:]) for name in os.listdir(_model_dir()) if name.startswith("v") and name[1:].isdigit())
+
+
+def _current_version() -> Optional[int]:
+    try:
+        with open(os.path.join(_model_dir(), "current.json")) as f:
+            return json.load(f)["version"]
+    except FileNotFoundError:
+        return None
+
+
+def save_models(models: pd.DataFrame, meta: dict) -> dict:
+    """
+    Saves models as a new version directory and makes it the current version. The directory is
+    written under a temporary name and renamed into place, and the pointer to the current
+    version is replaced atomically, so readers never see a partial version. Versions beyond the
+    newest forecast_keep_versions are deleted. Returns the metadata saved with the version.
+    """
+    directory = _model_dir()
+    os.makedirs(directory, exist_ok=True)
+    version = max(_saved_versions(), default=0) + 1
+    meta = {**meta, "version": version, "num_series": int(len(models)), "created_at": datetime.now().isoformat()}
+
+    frame = models.reset_index()
+    arrays = {column: frame[column].to_numpy(dtype=float) for column in MODEL_COLUMNS if column != "last_date"}
+    arrays["last_date"] = frame["last_date"].to_numpy(dtype="datetime64[D]")
+    for key in models.index.names:
+        arrays[key] = frame[key].astype(str).to_numpy(dtype=str)
+
+    tmp_dir = tempfile.mkdtemp(dir=directory, prefix=".tmp-")
+    try:
+        np.savez(os.path.join(tmp_dir, "models.npz"), **arrays)
+        with open(os.path.join(tmp_dir, "meta.json"), "w") as f:
+            json.dump(meta, f, indent=4)
+        os.replace(tmp_dir, _version_dir(version))
+    except BaseException:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        raise
+
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".", suffix=".tmp")
+    with os.fdopen(fd, "w") as f:
+        json.dump({"version": version}, f)
+    os.replace(tmp_path, os.path.join(directory, "current.json"))
+
+    for old_version in _saved_versions()[:-settings.forecast_keep_versions]:
+        shutil.rmtree(_version_dir(old_version), ignore_errors=True)
+    return meta
+
+
+def load_models(version: int = None) -> Tuple[Optional[pd.DataFrame], Optional[dict]]:
+    """
+    Returns the models and metadata of a saved version (the current one by default), or
+    (None, None) when none was saved. The current version is kept in memory until it changes.
+    """
+    if version is None:
+        version = _current_version()
+        if version is None:
+            return None, None
+    with _models_cache_lock:
+        if _models_cache["version"] == version:
+            return _models_cache["models"], _models_cache["meta"]
+
+    with open(os.path.join(_version_dir(version), "meta.json")) as f:
+        meta = json.load(f)
+    keys = series_keys(meta["by_store"])
+    with np.load(os.path.join(_version_dir(version), "models.npz")) as arrays:
+        models = pd.DataFrame({column: arrays[column] for column in keys + MODEL_COLUMNS})
+    models["last_date"] = models["last_date"].astype("datetime64[ns]")
+    models = models.set_index(keys)
+
+    with _models_cache_lock:
+        _models_cache.update(version=version, models=models, meta=meta)
+    return models, meta
+
+
+def _fit_products(product_ids: List[str], by_store: bool) -> pd.DataFrame:
+    """Loads and fits the series of a shard of products; runs in a worker process."""
+    return fit_models(load_daily_demand(product_ids, by_store))
+
+
+def _fit_in_shards(product_ids: Iterable[str], by_store: bool, max_workers: int = None) -> pd.DataFrame:
+    """
+    Fits the series of the given products, forecast_shard_products products per task. The tasks
+    run in a process pool, each worker loading its own shard's rows; with one worker or one
+    shard they run in this process.
+    """
+    product_ids = sorted(product_ids)
+    shard_size = settings.forecast_shard_products
+    shards = [product_ids[i:i + shard_size] for i in range(0, len(product_ids), shard_size)]
+    max_workers = max_workers or settings.forecast_workers
+    if max_workers <= 1 or len(shards) <= 1:
+        frames = [_fit_products(shard, by_store) for shard in shards]
+    else:
+        # Spawned workers do not inherit the parent's MongoDB client, which is not fork-safe
+        with ProcessPoolExecutor(
+            max_workers=min(max_workers, len(shards)),
+            mp_context=multiprocessing.get_context("spawn"),
+        ) as executor:
+            frames = list(executor.map(_fit_products, shards, [by_store] * len(shards)))
+    frames = [frame for frame in frames if not frame.empty]
+    return pd.concat(frames) if frames else _empty_models(series_keys(by_store))
+
+
+def train_forecasts(product_ids: Iterable[str] = None, by_store: bool = None, max_workers: int = None) -> dict:
+    """
+    Fits the forecast models of the given products (all products when None) and saves them as a
+    new version. With product_ids, the other series of the current version are carried over
+    when it was trained with the same by_store.
+    Returns the metadata of the new version.
+    """
+    if by_store is None:
+        by_store = settings.forecast_by_store
+    start = time.perf_counter()
+    source_version = get_collection_version("retail_data")
+
+    models = None
+    if product_ids is None:
+        product_ids = [product_id for product_id in get_db().retail_data.distinct("ProductID") if product_id is not None]
+    else:
+        product_ids = set(product_ids)
+        models, meta = load_models()
+        if models is not None and meta["by_store"] != by_store:
+            models = None
+
+    fitted = _fit_in_shards(product_ids, by_store, max_workers)
+    if models is not None:
+        kept = models[~models.index.get_level_values("ProductID").isin(product_ids)]
+        fitted = pd.concat([frame for frame in (kept, fitted) if not frame.empty] or [fitted]).sort_index()
+
+    meta = save_models(fitted, {
+        "by_store": by_store,
+        "source_version": source_version,
+        "fitted_series": int(len(fitted)) if models is None else int(len(fitted) - len(kept)),
+        "updated_series": 0,
+        "seconds": round(time.perf_counter() - start, 3),
+    })
+    print(f"Trained forecast models version {meta['version']} for {meta['num_series']} series in {meta['seconds']}s.")
+    return meta
+
+
+def update_forecasts(product_ids: Iterable[str], since: datetime = None, max_workers: int = None) -> Optional[dict]:
+    """
+    Brings the current models of the given products up to date after new rows arrived, and
+    saves them as a new version. Series whose new rows all come after their last_date are
+    updated incrementally from those days only; series with rows at or before their last_date
+    (`since` is the earliest date written) and products without a model are refitted.
+    Does nothing and returns None when no models were trained yet.
+    """
+    models, meta = load_models()
+    if models is None:
+        return None
+    start = time.perf_counter()
+    source_version = get_collection_version("retail_data")
+    by_store = meta["by_store"]
+    keys = series_keys(by_store)
+    product_ids = set(product_ids)
+
+    current = models[models.index.get_level_values("ProductID").isin(product_ids)]
+    refit = product_ids - set(current.index.get_level_values("ProductID"))
+    if since is not None:
+        rewritten = current[current["last_date"] >= pd.Timestamp(since).normalize()]
+        refit |= set(rewritten.index.get_level_values("ProductID"))
+    incremental = current[~current.index.get_level_values("ProductID").isin(refit)]
+
+    updated = incremental.iloc[:0]
+    if not incremental.empty:
+        demand = load_daily_demand(sorted(set(incremental.index.get_level_values("ProductID"))), by_store, incremental["last_date"].min())
+        series = demand.index.droplevel("Date")
+        # A product that gained a series (a new store) is refitted as a whole
+        new_series = ~series.isin(incremental.index)
+        if new_series.any():
+            new_products = set(demand.index.get_level_values("ProductID")[new_series])
+            refit |= new_products
+            incremental = incremental[~incremental.index.get_level_values("ProductID").isin(new_products)]
+            keep = ~demand.index.get_level_values("ProductID").isin(new_products)
+            demand, series = demand[keep], series[keep]
+        # Keep each series' days after its own last_date
+        last_dates = incremental["last_date"].reindex(series)
+        demand = demand[demand.index.get_level_values("Date") > last_dates.to_numpy()]
+        updated = update_models(incremental, demand)
+    fitted = _fit_in_shards(refit, by_store, max_workers) if refit else _empty_models(keys)
+
+    remaining = models.drop(index=models.index[models.index.get_level_values("ProductID").isin(refit)])
+    remaining = remaining.drop(index=updated.index)
+    frames = [frame for frame in (remaining, updated, fitted) if not frame.empty]
+    meta = save_models(pd.concat(frames).sort_index() if frames else _empty_models(keys), {
+        "by_store": by_store,
+        "source_version": source_version,
+        "fitted_series": int(len(fitted)),
+        "updated_series": int(len(updated)),
+        "seconds": round(time.perf_counter() - start, 3),
+    })
+    print(f"Updated forecast models to version {meta['version']}: {meta['updated_series']} series updated, {meta['fitted_series']} refitted.")
+    return meta
+
+
+def forecast_status() -> Optional[dict]:
+    """
+    Returns the metadata of the current models with `stale` set when retail_data changed since
+    they were trained or updated, or None when no models were trained yet.
+    """
+    _, meta = load_models()
+    if meta is None:
+        return None
+    return {**meta, "stale": meta["source_version"] != get_collection_version("retail_data")}
+
+
+def select_series(models: pd.DataFrame, product_id: str = None, store_id: str = None) -> pd.DataFrame:
+    """
+    Returns the models of the series matching product_id and store_id. Raises ValueError for a
+    store_id when the models are not trained per store, as their forecasts are chain-wide.
+    """
+    selected = models
+    if store_id is not None and "StoreId" not in selected.index.names:
+        raise ValueError("The forecast models are not trained per store; train them with by_store to filter on store_id.")
+    if product_id is not None:
+        selected = selected[selected.index.get_level_values("ProductID") == product_id]
+    if store_id is not None:
+        selected = selected[selected.index.get_level_values("StoreId") == store_id]
+    return selected
+
+
+def predict(models: pd.DataFrame, horizon: int = 14, product_id: str = None, store_id: str = None) -> Iterator[dict]:
+    """
+    Forecasts daily demand for `horizon` days after each series' last date, for all series or
+    those matching product_id and store_id (see select_series). The forecasts of all selected
+    series are computed in one vectorized pass; yields one dict per series.
+    """
+    selected = select_series(models, product_id, store_id)
+
+    values = forecast(selected, horizon).round(3)
+    starts = (selected["last_date"] + pd.Timedelta(days=1)).dt.strftime("%Y-%m-%d").to_numpy()
+    keys = list(selected.index.names)
+    for key, start, row in zip(selected.index, starts, values):
+        key = key if isinstance(key, tuple) else (key,)
+        yield {**dict(zip(keys, key)), "start": start, "forecast": row.tolist()}
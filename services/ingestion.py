@@ -0,0 +1,172 @@
+import pandas as pd
+import os
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import time
+from datetime import datetime
+from typing import BinaryIO, Iterable, Iterator, List, Tuple
+from config import settings
+from database import insert_batches, upsert_batches, INGEST_MODES, RETAIL_DATA_KEY
+from services.rollup import is_rollup_current, rebuild_rollup, refresh_rollup
+from services.classification import load_class_lookup, update_classes
+from services.stockouts import is_episodes_current, refresh_stockout_episodes
+from services.forecasting import update_forecasts
+
+
+class _IngestTracker:
+    """
+    Passes batches through while recording the products and the date range they touch, so derived
+    collections can be refreshed for just that data afterwards. Rows of classified products are
+    given their stored ABC/XYZ classes (see load_class_lookup), so classes only need to be
+    written back for products whose class changes.
+    """
+
+    def __init__(self, classes: dict = None):
+        self.product_ids = set()
+        self.start = None
+        self.end = None
+        self.classes = classes or {}
+
+    def track(self, batches: Iterable[List[dict]]) -> Iterator[List[dict]]:
+        for batch in batches:
+            for doc in batch:
+                self.product_ids.add(doc.get("ProductID"))
+                if self.classes:
+                    key = doc.get("ProductID"), doc.get("StoreId")
+                    classes = self.classes.get(key) or self.classes.get((key[0], None))
+                    if classes:
+                        doc["abc_class"], doc["xyz_class"] = classes
+                date = doc.get("Date")
+                if isinstance(date, datetime) and date == date: # NaT != NaT
+                    if self.start is None or date < self.start:
+                        self.start = date
+                    if self.end is None or date > self.end:
+                        self.end = date
+            yield batch
+
+
+def write_batches(batches: Iterable[List[dict]], collection_name: str, mode: str = "replace") -> Tuple[int, int]:
+    """
+    Writes batches of records to a collection in the given ingestion mode and brings the
+    data derived from retail_data up to date. Rows are written with their products' stored ABC/XYZ
+    classes. After a merge into an up-to-date rollup only the touched products and months are
+    recomputed; otherwise the rollup is rebuilt, once. Classes are then recomputed from it and
+    written back to the rows of products whose class changed.
+    Finally the stockout episodes of the ingested products (of all products after a replace) are
+    recomputed and, after a merge, trained forecast models of those products are brought up to date.
+    Returns the number of rows and batches written.
+    """
+    if mode not in INGEST_MODES:
+        raise ValueError(f"Invalid ingestion mode: {mode}. Allowed modes are: {', '.join(INGEST_MODES)}")
+
+    if collection_name != "retail_data":
+        if mode == "merge":
+            return upsert_batches(batches, collection_name)
+        return insert_batches(batches, collection_name)
+
+    rollup_was_current = is_rollup_current()
+    episodes_were_current = is_episodes_current()
+    tracker = _IngestTracker(load_class_lookup())
+    if mode == "merge":
+        num_rows, num_batches = upsert_batches(tracker.track(batches), collection_name)
+    else:
+        num_rows, num_batches = insert_batches(tracker.track(batches), collection_name)
+
+    try:
+        if mode == "merge" and rollup_was_current and tracker.start is not None:
+            refresh_rollup(tracker.product_ids - {None}, tracker.start, tracker.end)
+        else:
+            rebuild_rollup()
+    except Exception as e:
+        # The data itself is written; metrics fall back to raw rows until the rollup is rebuilt
+        print(f"Error updating rollup after ingesting into {collection_name}: {e}")
+
+    try:
+        update_classes()
+    except Exception as e:
+        print(f"Error classifying products after ingesting into {collection_name}: {e}")
+
+    try:
+        if mode == "merge" and episodes_were_current:
+            refresh_stockout_episodes(tracker.product_ids - {None})
+        else:
+            refresh_stockout_episodes()
+    except Exception as e:
+        # Stockout durations are detected from raw rows until the episodes are stored again
+        print(f"Error updating stockout episodes after ingesting into {collection_name}: {e}")
+
+    if mode == "merge":
+        try:
+            update_forecasts(tracker.product_ids - {None}, tracker.start)
+        except Exception as e:
+            # Forecasts keep serving the previous models, reported as stale
+            print(f"Error updating forecast models after ingesting into {collection_name}: {e}")
+
+    return num_rows, num_batches
+
+
+def ingest_records(records: List[dict], collection_name: str, mode: str = "replace", batch_size: int = None) -> Tuple[int, int]:
+    """
+    Writes an in-memory list of records to a collection in batches, like the upload endpoints do.
+    Used by the loader scripts. Returns the number of rows and batches written.
+    """
+    if batch_size is None:
+        batch_size = settings.upload_chunk_rows
+    batches = (records[i:i + batch_size] for i in range(0, len(records), batch_size))
+    return write_batches(batches, collection_name, mode)
+
+
+def iter_csv_batches(source: BinaryIO, chunk_rows: int = None, rename_map: dict = None, required_columns: List[str] = None, key_fields: List[str] = None) -> Iterator[List[dict]]:
+    """
+    Parses a CSV file object in chunks and yields each chunk as a list of records.
+    Columns are renamed with rename_map when given. If required_columns are missing after renaming,
+    a ValueError is raised before the first chunk is yielded. 'Date' is parsed to datetime so it is
+    stored as a BSON date. Rows missing any of key_fields are dropped.
+    """
+    if chunk_rows is None:
+        chunk_rows = settings.upload_chunk_rows
+
+    for i, chunk in enumerate(pd.read_csv(source, chunksize=chunk_rows)):
+        if rename_map:
+            chunk = chunk.rename(columns={k: v for k, v in rename_map.items() if k in chunk.columns})
+        if i == 0 and required_columns:
+            missing = [col for col in required_columns if col not in chunk.columns]
+            if missing:
+                raise ValueError(f"CSV is missing one or more expected columns after renaming. Required: {required_columns}")
+        if 'Date' in chunk.columns:
+            chunk['Date'] = pd.to_datetime(chunk['Date'], errors='coerce')
+        if key_fields:
+            chunk = chunk.dropna(subset=key_fields)
+        if 'Date' in chunk.columns:
+            # NaT cannot be encoded as BSON
+            chunk['Date'] = chunk['Date'].astype(object).where(chunk['Date'].notna(), None)
+        yield chunk.to_dict('records')
+
+
+def ingest_csv(source: BinaryIO, collection_name: str, chunk_rows: int = None, rename_map: dict = None, required_columns: List[str] = None, mode: str = "replace") -> dict:
+    """
+    Streams a CSV file object into a collection in batches.
+    In "replace" mode the contents of the collection are replaced once every chunk was parsed
+    and written (see insert_batches); in "merge" mode the rows are upserted on RETAIL_DATA_KEY,
+    so a daily feed costs O(new rows). Peak memory is bounded by the chunk size rather than the
+    file size.
+    Returns the number of rows and batches written and the throughput.
+    """
+    if mode not in INGEST_MODES:
+        raise ValueError(f"Invalid ingestion mode: {mode}. Allowed modes are: {', '.join(INGEST_MODES)}")
+
+    start = time.perf_counter()
+    if mode == "merge":
+        required_columns = list(dict.fromkeys((required_columns or []) + RETAIL_DATA_KEY))
+        batches = iter_csv_batches(source, chunk_rows, rename_map, required_columns, key_fields=RETAIL_DATA_KEY)
+    else:
+        batches = iter_csv_batches(source, chunk_rows, rename_map, required_columns)
+    num_rows, num_batches = write_batches(batches, collection_name, mode)
+    elapsed = time.perf_counter() - start
+    return {
+        "mode": mode,
+        "rows": num_rows,
+        "batches": num_batches,
+        "seconds": round(elapsed, 3),
+        "rows_per_second": round(num_rows / elapsed, 1) if elapsed > 0 else None,
+    }
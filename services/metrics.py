@@ -1,33 +1,114 @@
+import numpy as np
 import pandas as pd
-from database import get_validated_data
+from typing import Iterator, List, Tuple
+from database import get_validated_data, get_columnar_data
 from models import RetailData
+from services.schema import apply_schema
 
-def calculate_metrics(store_id: str, product_id: str, db_data: list):
+# Metrics reported for a store/product pair without data
+EMPTY_METRICS = {
+    "turnover": 0,
+    "days_of_supply": 0,
+    "stockout_count": 0,
+    "stockout_rate": 0,
+    "carrying_cost": 0,
+    "is_slow_moving": False,
+    "is_obsolete": False,
+}
+# Carrying cost rate used by calculate_metrics and calculate_bulk_metrics
+METRICS_CARRYING_COST_RATE = 0.25
+# Columns read by calculate_bulk_metrics
+BULK_METRICS_FIELDS = ["Date", "StoreId", "ProductID", "Inventory", "Sales"]
+PAIR_KEYS = ["StoreId", "ProductID"]
+
+# Calendar granularities of turnover_time_series, mapped to pandas resample rules labelled
+# with the last day of each period
+TURNOVER_GRANULARITIES = {"daily": "D", "weekly": "W-SUN", "monthly": "ME", "quarterly": "QE-DEC", "yearly": "YE-DEC"}
+_GRANULARITY_ALIASES = {"a": "yearly", "annual": "yearly", "annually": "yearly"}
+
+def resolve_granularity(period: str) -> str:
+    """
+    Maps a period name to a key of TURNOVER_GRANULARITIES. Names are matched case-insensitively by
+    their first letter, so 'monthly', 'month' and 'M' are all monthly. Raises ValueError otherwise.
+    """
+    key = (period or "").strip().lower()
+    if key in _GRANULARITY_ALIASES:
+        return _GRANULARITY_ALIASES[key]
+    for name in TURNOVER_GRANULARITIES:
+        if key and name[0] == key[0]:
+            return name
+    raise ValueError(f"Invalid period: {period}. Allowed periods are: {', '.join(TURNOVER_GRANULARITIES)}")
+
+def _turnover_frame(totals: pd.DataFrame) -> pd.DataFrame:
+    totals = totals.copy()
+    totals['denominator'] = (totals['denominator_sum'] / totals['denominator_count']).where(totals['denominator_count'] > 0)
+    totals['turnover_ratio'] = (totals['numerator'] / totals['denominator']).where(totals['denominator'] > 0)
+    return totals[['numerator', 'denominator', 'rows', 'turnover_ratio']]
+
+def turnover_time_series(
+    df: pd.DataFrame,
+    granularities: List[str] = ("daily",),
+    rolling_windows: List[int] = (),
+    numerator: str = "Sales",
+    denominator: str = "Inventory",
+) -> dict:
+    """
+    Computes turnover time series at several granularities from one pass over the rows.
+    Rows are resampled to daily totals once; calendar granularities are resampled and rolling
+    N-day windows are summed from the daily totals. Each series is a DataFrame indexed by 'Date' (the last day of each
+    period, or the day a rolling window ends) with the summed numerator, the mean denominator,
+    the number of rows and turnover_ratio = numerator / denominator (NaN where the denominator is
+    not positive). Periods without rows are included with a numerator of 0, as resample does.
+    Returns a dict keyed by granularity name, and by 'rolling_<N>d' for each rolling window.
+    """
+    granularities = [resolve_granularity(granularity) for granularity in granularities]
+    if any(window < 1 for window in rolling_windows):
+        raise ValueError("Rolling windows must be at least 1 day.")
+    keys = list(dict.fromkeys(granularities)) + [f"rolling_{window}d" for window in rolling_windows]
+    if df.empty:
+        empty = pd.DataFrame(columns=['numerator', 'denominator', 'rows', 'turnover_ratio'], index=pd.DatetimeIndex([], name='Date'))
+        return {key: empty.copy() for key in keys}
+
+    # Resampling a DatetimeIndex stays vectorized; Period keys would be hashed one by one
+    daily = pd.DataFrame({
+        'numerator': df[numerator].to_numpy(),
+        'denominator_sum': df[denominator].to_numpy(),
+        'denominator_count': df[denominator].notna().to_numpy(dtype=int),
+        'rows': 1,
+    }, index=pd.DatetimeIndex(pd.to_datetime(df['Date']), name='Date')).resample('D').sum()
+
+    series = {}
+    for granularity in dict.fromkeys(granularities):
+        rule = TURNOVER_GRANULARITIES[granularity]
+        series[granularity] = _turnover_frame(daily if rule == 'D' else daily.resample(rule).sum())
+
+    for window in rolling_windows:
+        series[f"rolling_{window}d"] = _turnover_frame(daily.rolling(window, min_periods=1).sum())
+
+    return series
+
+def turnover_records(series: pd.DataFrame, with_rows_only: bool = False) -> list:
+    """
+    Converts a turnover_time_series frame into [{'date': ISO date, 'turnover_ratio': float or None}].
+    With with_rows_only, periods without rows are left out.
+    """
+    if with_rows_only:
+        series = series[series['rows'] > 0]
+    ratios = series['turnover_ratio'].astype(object).where(series['turnover_ratio'].notna(), None)
+    return [{'date': date.isoformat(), 'turnover_ratio': ratio} for date, ratio in zip(series.index, ratios)]
+
+def calculate_metrics(store_id: str, product_id: str, db_data: list, granularities: List[str] = None, rolling_windows: List[int] = None):
     """
     Calculate inventory metrics (turnover, days of supply, stockouts, carrying cost, slow/obsolete).
+    'turnover' is the daily turnover series. Extra granularities ('weekly', 'monthly', ...) and
+    rolling N-day windows are returned under 'turnover_series' when requested.
     """
     if not db_data:
-        return {
-            "turnover": 0,
-            "days_of_supply": 0,
-            "stockout_count": 0,
-            "stockout_rate": 0,
-            "carrying_cost": 0,
-            "is_slow_moving": False,
-            "is_obsolete": False,
-        }
+        return dict(EMPTY_METRICS)
     df = pd.DataFrame([item.dict() for item in db_data]).copy()
     df = df[(df['StoreId'] == store_id) & (df['ProductID'] == product_id)]
     if df.empty:
-        return {
-            "turnover": 0,
-            "days_of_supply": 0,
-            "stockout_count": 0,
-            "stockout_rate": 0,
-            "carrying_cost": 0,
-            "is_slow_moving": False,
-            "is_obsolete": False
-        }
+        return dict(EMPTY_METRICS)
 
     # Ensure 'Date' column is datetime and sort
     if 'Date' in df.columns:
@@ -50,20 +131,14 @@ def calculate_metrics(store_id: str, product_id: str, db_data: list):
     current_inventory = df['Inventory'].iloc[-1] if not df.empty else 0 # Use last known inventory for current
 
     # 1. Inventory Turnover Rates (Time Series)
-    turnover_data = []
-    if 'Date' in df.columns and not df.empty:
-        for date in df['Date'].unique():
-            daily_df = df[df['Date'] == date]
-            daily_sales = daily_df['Sales'].sum()
-            daily_inventory = daily_df['Inventory'].mean()
-            daily_turnover = daily_sales / daily_inventory if daily_inventory > 0 else None
-            turnover_data.append({'date': date.isoformat(), 'turnover_ratio': daily_turnover})
+    series = turnover_time_series(df, ["daily"] + list(granularities or []), rolling_windows or [])
+    turnover_data = turnover_records(series.pop("daily"), with_rows_only=True)
 
     # Overall turnover for slow-moving/obsolete check
     turnover = total_sales / avg_inventory if avg_inventory is not None and avg_inventory > 0 else None
 
     # 2. Stockout Analysis
-    stockout_count = (df['Inventory'] == 0).sum()
+    stockout_count = int((df['Inventory'] == 0).sum())
     total_records = len(df)
     stockout_rate = stockout_count / total_records if total_records > 0 else None
 
@@ -72,7 +147,7 @@ def calculate_metrics(store_id: str, product_id: str, db_data: list):
 
     # 4. Carrying Cost Analysis (assuming Inventory represents value or unit cost is 1)
     # Using a typical carrying cost rate of 25% annually
-    carrying_cost_rate = 0.25
+    carrying_cost_rate = METRICS_CARRYING_COST_RATE
     carrying_cost = avg_inventory * carrying_cost_rate if avg_inventory is not None else None
 
     # 5. Slow-Moving & Obsolete Stock Identification
@@ -85,7 +160,7 @@ def calculate_metrics(store_id: str, product_id: str, db_data: list):
     elif total_sales == 0 and total_records > 0: # No sales over the period
         is_obsolete = True
 
-    return {
+    metrics = {
         "turnover": turnover_data,
         "days_of_supply": days_of_supply,
         "stockout_count": stockout_count,
@@ -94,7 +169,100 @@ def calculate_metrics(store_id: str, product_id: str, db_data: list):
         "is_slow_moving": is_slow_moving,
         "is_obsolete": is_obsolete
     }
+    if series:
+        metrics["turnover_series"] = {key: turnover_records(frame) for key, frame in series.items()}
+    return metrics
 
 def check_data_status(db_data: list):
     """Check if data is loaded and return record count."""
-    return {"is_loaded": len(db_data) > 0, "record_count": len(db_data)}
\ No newline at end of file
+    return {"is_loaded": len(db_data) > 0, "record_count": len(db_data)}
+
+def load_bulk_metrics_data(pairs: List[Tuple[str, str]] = None, filters: dict = None) -> pd.DataFrame:
+    """
+    Fetches the rows needed by calculate_bulk_metrics in a single query: the rows of the given
+    (StoreId, ProductID) pairs, or of all pairs matching equality filters when pairs is None.
+    Columns are in the compact dtypes of services/schema.py.
+    """
+    if pairs is not None:
+        if not pairs:
+            return pd.DataFrame(columns=BULK_METRICS_FIELDS)
+        # One $in per key is a superset of the pairs; calculate_bulk_metrics keeps only the pairs asked for
+        query = {
+            "StoreId": {"$in": sorted({store_id for store_id, _ in pairs})},
+            "ProductID": {"$in": sorted({product_id for _, product_id in pairs})},
+        }
+    else:
+        query = dict(filters or {})
+    return apply_schema(get_columnar_data(RetailData, "retail_data", query, fields=BULK_METRICS_FIELDS))
+
+def _none_if_nan(value):
+    return None if value is None or value != value else value
+
+def calculate_bulk_metrics(df: pd.DataFrame, pairs: List[Tuple[str, str]] = None) -> Iterator[dict]:
+    """
+    Computes the calculate_metrics output for many store/product pairs in one grouped pass.
+    `df` holds rows of BULK_METRICS_FIELDS. The aggregates are computed eagerly; the returned
+    iterator then yields one result per pair (in the order of `pairs`, or sorted by StoreId and
+    ProductID for every pair in `df`), so results can be streamed as they are serialized.
+    """
+    df = df.dropna(subset=PAIR_KEYS).sort_values(by=PAIR_KEYS + ['Date'], kind='stable')
+    if df.empty:
+        return iter([{"store_id": store_id, "product_id": product_id, **EMPTY_METRICS} for store_id, product_id in pairs or []])
+
+    grouped = df.groupby(PAIR_KEYS, sort=False, observed=True)
+    summary = grouped.agg(
+        avg_sales=('Sales', 'mean'),
+        total_sales=('Sales', 'sum'),
+        avg_inventory=('Inventory', 'mean'),
+        total_records=('Sales', 'size'),
+    )
+    # The last row's inventory is the current inventory, even when it is missing
+    summary['current_inventory'] = df.drop_duplicates(subset=PAIR_KEYS, keep='last').set_index(PAIR_KEYS)['Inventory']
+    summary['stockout_count'] = (df['Inventory'] == 0).groupby([df['StoreId'], df['ProductID']], sort=False, observed=True).sum()
+
+    positive_inventory = summary['avg_inventory'] > 0
+    summary['turnover'] = (summary['total_sales'] / summary['avg_inventory']).where(positive_inventory)
+    summary['stockout_rate'] = summary['stockout_count'] / summary['total_records']
+    summary['days_of_supply'] = (summary['current_inventory'] / summary['avg_sales']).where(summary['avg_sales'] > 0)
+    summary['carrying_cost'] = summary['avg_inventory'] * METRICS_CARRYING_COST_RATE
+    summary['is_slow_moving'] = (summary['turnover'] < 1) & (summary['total_sales'] > 0)
+    summary['is_obsolete'] = (summary['total_sales'] == 0) & (summary['total_records'] > 0)
+
+    # Daily turnover series of every pair, as consecutive slices of flat arrays
+    daily = df.groupby(PAIR_KEYS + ['Date'], sort=False, observed=True).agg(sales=('Sales', 'sum'), inventory=('Inventory', 'mean'))
+    daily_ratio = (daily['sales'] / daily['inventory']).where(daily['inventory'] > 0)
+    daily_dates = daily.index.get_level_values('Date')
+    daily_ratio = daily_ratio.astype(object).where(daily_ratio.notna(), None).tolist()
+    # Rows are sorted by pair, so each pair's days are contiguous
+    days_per_pair = daily.groupby(level=PAIR_KEYS, sort=False, observed=True).size()
+    ends = np.cumsum(days_per_pair.to_numpy())
+    daily_slices = dict(zip(days_per_pair.index, zip(ends - days_per_pair.to_numpy(), ends)))
+
+    records = summary.to_dict('index')
+    if pairs is None:
+        pairs = sorted(records)
+
+    def iter_results():
+        for pair in pairs:
+            store_id, product_id = pair
+            record = records.get((store_id, product_id))
+            if record is None:
+                yield {"store_id": store_id, "product_id": product_id, **EMPTY_METRICS}
+                continue
+            start, end = daily_slices[(store_id, product_id)]
+            yield {
+                "store_id": store_id,
+                "product_id": product_id,
+                "turnover": [
+                    {"date": date.isoformat(), "turnover_ratio": ratio}
+                    for date, ratio in zip(daily_dates[start:end], daily_ratio[start:end])
+                ],
+                "days_of_supply": _none_if_nan(record['days_of_supply']),
+                "stockout_count": int(record['stockout_count']),
+                "stockout_rate": _none_if_nan(record['stockout_rate']),
+                "carrying_cost": _none_if_nan(record['carrying_cost']),
+                "is_slow_moving": bool(record['is_slow_moving']),
+                "is_obsolete": bool(record['is_obsolete']),
+            }
+
+    return iter_results()
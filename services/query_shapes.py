@@ -0,0 +1,110 @@
+import os
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from datetime import datetime
+from database import explain_query, plan_stages, CLASSES_COLLECTION, EPISODES_COLLECTION, ROLLUP_COLLECTION
+from services.calculations import STOCKOUT_RECORDS_QUERY, _stockout_counts_pipeline, _stockout_match
+
+# Sample values; the planner picks indexes by the shape of a filter, not its values
+_ID = "sample"
+_DATE = datetime(2000, 1, 1)
+
+# The filters the services and routers issue against MongoDB. Hot shapes back endpoints that are
+# polled or called per item and must be index-backed; the others are allowed to scan, usually
+# because the rollup collection answers them. "index" names the index a shape is expected to use,
+# where a different choice would mean the plan changed.
+QUERY_SHAPES = [
+    {"name": "product", "collection": "retail_data", "hot": True,
+     "used_by": "calculations with product_id, RetailDataset per product",
+     "query": {"ProductID": _ID}},
+    {"name": "store_product", "collection": "retail_data", "hot": True,
+     "used_by": "POST /metrics/all-metrics",
+     "query": {"StoreId": _ID, "ProductID": _ID}},
+    {"name": "store_product_pairs", "collection": "retail_data", "hot": True,
+     "used_by": "POST /metrics/all-metrics/bulk with pairs",
+     "query": {"StoreId": {"$in": [_ID]}, "ProductID": {"$in": [_ID]}}},
+    {"name": "natural_key", "collection": "retail_data", "hot": True,
+     "used_by": "merge ingestion upserts",
+     "query": {"Date": _DATE, "StoreId": _ID, "ProductID": _ID}},
+    {"name": "stockout_records", "collection": "retail_data", "hot": True,
+     "used_by": "GET /inventory/stockouts/all",
+     "query": STOCKOUT_RECORDS_QUERY, "index": "Inventory_1"},
+    {"name": "stockout_events", "collection": "retail_data", "hot": False,
+     "used_by": "stockout heatmap aggregation",
+     "query": _stockout_match({})},
+    {"name": "product_stockout_events", "collection": "retail_data", "hot": True,
+     "used_by": "stockout heatmap aggregation with product_id",
+     "query": _stockout_match({"ProductID": _ID})},
+    {"name": "product_sales", "collection": "retail_data", "hot": False,
+     "used_by": "stockout rate aggregation with product_id",
+     "query": _stockout_counts_pipeline({"ProductID": _ID})[0]["$match"]},
+    {"name": "category", "collection": "retail_data", "hot": False,
+     "used_by": "/inventory endpoints with category",
+     "query": {"Category": _ID}},
+    {"name": "abc_class", "collection": "retail_data", "hot": False,
+     "used_by": "/inventory endpoints with abc_class",
+     "query": {"abc_class": _ID}},
+    {"name": "store_dates", "collection": "retail_data", "hot": True,
+     "used_by": "/inventory endpoints with store_id and a date range",
+     "query": {"StoreId": _ID, "Date": {"$gte": _DATE, "$lt": _DATE}}},
+    {"name": "region_dates", "collection": "retail_data", "hot": True,
+     "used_by": "/inventory endpoints with region and a date range",
+     "query": {"Region": _ID, "Date": {"$gte": _DATE, "$lt": _DATE}}},
+    {"name": "product_dates", "collection": "retail_data", "hot": True,
+     "used_by": "/inventory endpoints with product_id and a date range",
+     "query": {"ProductID": _ID, "Date": {"$gte": _DATE, "$lt": _DATE}}},
+    {"name": "dates", "collection": "retail_data", "hot": True,
+     "used_by": "/inventory endpoints with a date range",
+     "query": {"Date": {"$gte": _DATE, "$lt": _DATE}}},
+    {"name": "rollup_refresh", "collection": "retail_data", "hot": True,
+     "used_by": "refresh_rollup after merge ingestion",
+     "query": {"ProductID": {"$in": [_ID]}, "Date": {"$gte": _DATE, "$lt": _DATE}}},
+    {"name": "class_writeback", "collection": "retail_data", "hot": True,
+     "used_by": "ABC/XYZ class writeback",
+     "query": {"ProductID": _ID, "$or": [{"abc_class": {"$ne": "A"}}, {"xyz_class": {"$ne": "X"}}]}},
+    {"name": "rollup_product", "collection": ROLLUP_COLLECTION, "hot": True,
+     "used_by": "metrics answered from the rollup with product_id",
+     "query": {"ProductID": _ID}},
+    {"name": "rollup_category", "collection": ROLLUP_COLLECTION, "hot": True,
+     "used_by": "turnover answered from the rollup with category",
+     "query": {"Category": _ID}},
+    {"name": "class_members", "collection": CLASSES_COLLECTION, "hot": True,
+     "used_by": "metrics answered from the rollup with abc_class",
+     "query": {"abc_class": _ID}},
+    {"name": "rollup_products", "collection": ROLLUP_COLLECTION, "hot": True,
+     "used_by": "metrics answered from the rollup with abc_class, for the products of the class",
+     "query": {"ProductID": {"$in": [_ID]}}},
+    {"name": "rollup_store", "collection": ROLLUP_COLLECTION, "hot": False,
+     "used_by": "metrics answered from the rollup with store_id",
+     "query": {"StoreId": _ID}},
+    {"name": "episodes_product", "collection": EPISODES_COLLECTION, "hot": True,
+     "used_by": "stockout durations and heatmap with product_id",
+     "query": {"ProductID": _ID}},
+]
+
+
+def check_query_shapes(shapes: list = None) -> list:
+    """
+    Runs explain() for each query shape and reports the plan stages and indexes used.
+    A shape is flagged when its winning plan contains a collection scan, or does not use the
+    index the shape expects.
+    """
+    if shapes is None:
+        shapes = QUERY_SHAPES
+
+    results = []
+    for shape in shapes:
+        stages = plan_stages(explain_query(shape["query"], shape["collection"]))
+        indexes = sorted({index for _, index in stages if index})
+        results.append({
+            "name": shape["name"],
+            "collection": shape["collection"],
+            "hot": shape["hot"],
+            "used_by": shape["used_by"],
+            "stages": [stage for stage, _ in stages],
+            "indexes": indexes,
+            "expected_index": shape.get("index"),
+            "unexpected_plan": "index" in shape and shape["index"] not in indexes,
+            "collection_scan": any(stage == "COLLSCAN" for stage, _ in stages),
+        })
+    return results
@@ -0,0 +1,191 @@
+import pandas as pd
+import os
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from datetime import datetime
+from typing import Iterable
+from pymongo import DeleteMany, ReplaceOne
+from database import get_db, is_derived_current, mark_derived_current, CLASSES_COLLECTION, ROLLUP_COLLECTION
+
+# Rollup documents hold per (ProductID, StoreId, month, Category) sums, counts, minima and
+# maxima of retail_data, from which every inventory metric can be derived without touching raw
+# rows. Category is part of the key so that filters on it select exactly the rows they would
+# select in retail_data. ABC classes are not: an abc_class filter is joined from the
+# product_classes collection, so writing classes back does not invalidate the rollup.
+ROLLUP_FIELDS = [
+    "ProductID", "StoreId", "month", "Category",
+    "rows", "sales_sum", "sales_rows", "stockout_rows", "cogs_sum",
+    "inventory_value_sum", "inventory_value_count", "min_date", "max_date", "last_inventory",
+]
+# retail_data fields a query answered from the rollup may filter on; other conditions (e.g. on
+# Region or Date) cut across the documents
+ROLLUP_FILTER_FIELDS = {"ProductID", "StoreId", "Category", "abc_class"}
+
+
+def _number(field: str) -> dict:
+    """Expression for a numeric field that yields null for missing, NaN and non-numeric values."""
+    return {"$cond": [
+        {"$and": [{"$isNumber": field}, {"$gte": [field, float("-inf")]}]},
+        field,
+        None,
+    ]}
+
+
+def _rollup_pipeline(match: dict) -> list:
+    """
+    Groups the retail_data rows matching `match` into rollup documents.
+    A missing Inventory counts as 0, as in preprocess_inventory_data; rows without a valid
+    Date, ProductID or StoreId are left out.
+    """
+    inventory = {"$ifNull": [_number("$Inventory"), 0]}
+    sales = _number("$Sales")
+    return [
+        {"$match": match},
+        {"$addFields": {"_date": {"$convert": {"input": "$Date", "to": "date", "onError": None, "onNull": None}}}},
+        {"$match": {"_date": {"$ne": None}, "ProductID": {"$type": "string"}, "StoreId": {"$type": "string"}}},
+        {"$sort": {"_date": 1}},
+        {"$group": {
+            "_id": {
+                "ProductID": "$ProductID",
+                "StoreId": "$StoreId",
+                "month": {"$dateToString": {"format": "%Y-%m", "date": "$_date"}},
+                "Category": "$Category",
+            },
+            "rows": {"$sum": 1},
+            "sales_sum": {"$sum": sales},
+            "sales_rows": {"$sum": {"$cond": [{"$gt": [sales, 0]}, 1, 0]}},
+            "stockout_rows": {"$sum": {"$cond": [{"$and": [{"$gt": [sales, 0]}, {"$lte": [inventory, 0]}]}, 1, 0]}},
+            "cogs_sum": {"$sum": {"$multiply": [sales, _number("$Price")]}},
+            "inventory_value_sum": {"$sum": {"$multiply": [inventory, _number("$cost")]}},
+            "inventory_value_count": {"$sum": {"$cond": [{"$ne": [_number("$cost"), None]}, 1, 0]}},
+            "min_date": {"$min": "$_date"},
+            "max_date": {"$max": "$_date"},
+            "last_inventory": {"$last": inventory},
+        }},
+        {"$addFields": {
+            "ProductID": "$_id.ProductID",
+            "StoreId": "$_id.StoreId",
+            "month": "$_id.month",
+            "Category": "$_id.Category",
+        }},
+    ]
+
+
+def _mark_current():
+    """Records the retail_data version the rollup now reflects."""
+    mark_derived_current(ROLLUP_COLLECTION)
+
+
+def is_rollup_current() -> bool:
+    """
+    Returns True if the rollup was last built or refreshed at the current retail_data version.
+    """
+    return is_derived_current(ROLLUP_COLLECTION)
+
+
+def rebuild_rollup():
+    """
+    Rebuilds the whole rollup collection from retail_data server-side.
+    $out swaps the new collection in atomically, so readers never see a partial rollup.
+    """
+    pipeline = _rollup_pipeline({}) + [{"$out": ROLLUP_COLLECTION}]
+    list(get_db().retail_data.aggregate(pipeline, allowDiskUse=True))
+    _mark_current()
+    print(f"Rebuilt {ROLLUP_COLLECTION} from retail_data.")
+
+
+def _month_start(date: datetime) -> datetime:
+    return datetime(date.year, date.month, 1)
+
+
+def _next_month_start(date: datetime) -> datetime:
+    return datetime(date.year + date.month // 12, date.month % 12 + 1, 1)
+
+
+def refresh_rollup(product_ids: Iterable[str], start: datetime, end: datetime):
+    """
+    Recomputes the rollup documents of the given products for every month from start to end.
+    Only the raw rows of those products and months are read, so the cost follows the size of
+    the ingested data rather than the size of the history. Documents of those products and
+    months that no longer have rows (e.g. after a Category change) are removed.
+    """
+    product_ids = list(product_ids)
+    if not product_ids:
+        return
+    match = {
+        "ProductID": {"$in": product_ids},
+        "Date": {"$gte": _month_start(start), "$lt": _next_month_start(end)},
+    }
+    documents = list(get_db().retail_data.aggregate(_rollup_pipeline(match), allowDiskUse=True))
+    months = {"$gte": _month_start(start).strftime("%Y-%m"), "$lte": end.strftime("%Y-%m")}
+    operations = [ReplaceOne({"_id": doc["_id"]}, doc, upsert=True) for doc in documents]
+    operations.append(DeleteMany({
+        "ProductID": {"$in": product_ids},
+        "month": months,
+        "_id": {"$nin": [doc["_id"] for doc in documents]},
+    }))
+    get_db()[ROLLUP_COLLECTION].bulk_write(operations, ordered=True)
+    _mark_current()
+    print(f"Refreshed {len(documents)} {ROLLUP_COLLECTION} documents.")
+
+
+def _class_members(abc_class: str) -> pd.DataFrame:
+    """
+    Returns the keys of the product_classes documents of an ABC class: ProductID, and StoreId
+    when products are classified per store.
+    """
+    keys = [doc["_id"] for doc in get_db()[CLASSES_COLLECTION].find({"abc_class": abc_class}, {"_id": 1})]
+    return pd.DataFrame(keys) if keys else pd.DataFrame(columns=["ProductID"])
+
+
+def load_rollup(query: dict = None) -> pd.DataFrame:
+    """
+    Returns the rollup documents matching a query on ProductID, StoreId, month, Category or abc_class.
+    An abc_class condition selects the products (or product/store pairs) of that class in
+    product_classes.
+    """
+    query = dict(query or {})
+    members = None
+    if "abc_class" in query:
+        members = _class_members(query.pop("abc_class"))
+        if members.empty:
+            return pd.DataFrame(columns=ROLLUP_FIELDS)
+        if "ProductID" not in query:
+            query["ProductID"] = {"$in": members["ProductID"].unique().tolist()}
+    projection = {field: 1 for field in ROLLUP_FIELDS}
+    projection["_id"] = 0
+    documents = list(get_db()[ROLLUP_COLLECTION].find(query, projection))
+    if not documents:
+        return pd.DataFrame(columns=ROLLUP_FIELDS)
+    df = pd.DataFrame(documents, columns=ROLLUP_FIELDS)
+    if members is not None:
+        keys = list(members.columns)
+        df = df[pd.MultiIndex.from_frame(df[keys]).isin(pd.MultiIndex.from_frame(members))].reset_index(drop=True)
+    df['min_date'] = pd.to_datetime(df['min_date'])
+    df['max_date'] = pd.to_datetime(df['max_date'])
+    return df
+
+
+def product_aggregates(rollup: pd.DataFrame) -> pd.DataFrame:
+    """
+    Combines rollup documents into one row per product, indexed by ProductID, with
+    last_inventory, first_date, last_date, total_sales, total_cogs, mean_inventory_value,
+    sales_rows and stockout_rows. last_inventory, the current inventory, is the sum of each
+    store's latest inventory, as in calculate_product_metrics.
+    """
+    # A store's documents never share a max_date, so its latest one holds its latest inventory
+    latest = rollup.sort_values(by='max_date', kind='stable').groupby(['ProductID', 'StoreId']).tail(1)
+
+    grouped = rollup.groupby('ProductID').agg(
+        first_date=('min_date', 'min'),
+        last_date=('max_date', 'max'),
+        total_sales=('sales_sum', 'sum'),
+        total_cogs=('cogs_sum', 'sum'),
+        inventory_value_sum=('inventory_value_sum', 'sum'),
+        inventory_value_count=('inventory_value_count', 'sum'),
+        sales_rows=('sales_rows', 'sum'),
+        stockout_rows=('stockout_rows', 'sum'),
+    )
+    grouped['last_inventory'] = latest.groupby('ProductID')['last_inventory'].sum()
+    grouped['mean_inventory_value'] = (grouped['inventory_value_sum'] / grouped['inventory_value_count']).where(grouped['inventory_value_count'] > 0)
+    return grouped.drop(columns=['inventory_value_sum', 'inventory_value_count'])
@@ -0,0 +1,71 @@
+import numpy as np
+import pandas as pd
+import os
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from datetime import datetime
+from typing import Type
+from database import _column_types
+from models import RetailData
+
+# Compact in-memory dtypes for analytics frames, derived from the field types of a Pydantic model:
+#   str       category (codes plus one copy of each distinct string; categories are sorted,
+#             so sorting by the column orders rows as sorting the strings does)
+#   int       int32 when every value fits, else int64; columns with missing values stay float64
+#   float     float64 (monetary math keeps full precision)
+#   datetime  datetime64[ns]
+# Calculations group on categorical columns with observed=True, so categories absent from a
+# filtered frame do not produce empty groups.
+
+INT32_MIN, INT32_MAX = np.iinfo(np.int32).min, np.iinfo(np.int32).max
+
+
+def _integer_dtype(values: pd.Series):
+    if values.isna().any():
+        return np.float64
+    if pd.api.types.is_float_dtype(values) and not (np.isfinite(values) & (values == np.floor(values))).all():
+        return np.float64
+    if values.empty or (values.min() >= INT32_MIN and values.max() <= INT32_MAX):
+        return np.int32
+    return np.int64
+
+
+def frame_dtypes(df: pd.DataFrame, model: Type = RetailData) -> dict:
+    """Returns the compact dtype of each column of df that is a field of the model."""
+    column_types = _column_types(model)
+    dtypes = {}
+    for column in df.columns:
+        if column not in column_types:
+            continue
+        field_type = column_types[column][0]
+        values = df[column]
+        if field_type is str:
+            dtypes[column] = "category"
+        elif field_type is int and pd.api.types.is_numeric_dtype(values):
+            dtypes[column] = _integer_dtype(values)
+        elif field_type is float and pd.api.types.is_numeric_dtype(values):
+            dtypes[column] = np.float64
+        elif field_type is datetime and not pd.api.types.is_datetime64_any_dtype(values):
+            dtypes[column] = "datetime64[ns]"
+    return dtypes
+
+
+def apply_schema(df: pd.DataFrame, model: Type = RetailData) -> pd.DataFrame:
+    """
+    Returns df with the model's fields in their compact dtypes (see frame_dtypes). Columns that
+    already have them are not copied, and columns that are not fields are passed through.
+    Expects validated values, e.g. from get_columnar_data.
+    """
+    dtypes = {
+        column: dtype for column, dtype in frame_dtypes(df, model).items()
+        if not _has_dtype(df[column], dtype)
+    }
+    if not dtypes:
+        return df
+    return df.astype(dtypes, copy=False)
+
+
+def _has_dtype(values: pd.Series, dtype) -> bool:
+    if dtype == "category":
+        return isinstance(values.dtype, pd.CategoricalDtype)
+    return values.dtype == np.dtype(dtype)
@@ -0,0 +1,69 @@
+import json
+import math
+import os
+import sys
+from datetime import date, datetime
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import numpy as np
+import pandas as pd
+from fastapi.responses import JSONResponse
+from telemetry import stage
+
+try:
+    import orjson
+except ImportError:
+    orjson = None # Falls back to the slower json module
+
+# JSON encoding for analytics results straight from pandas/NumPy: NumPy scalars and arrays are
+# encoded as numbers and lists, NaN and +-inf as null, and datetimes and dates (including
+# pandas Timestamps) as ISO strings, without a jsonable_encoder pass over the result first.
+
+
+def _default(value):
+    # Types orjson does not encode natively
+    if value is pd.NaT:
+        return None
+    if isinstance(value, pd.Timestamp):
+        return value.isoformat()
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def _to_builtin(value):
+    """Converts a result to types the json module encodes, for when orjson is not installed."""
+    if isinstance(value, dict):
+        return {str(key) if not isinstance(key, str) else key: _to_builtin(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_to_builtin(item) for item in value]
+    if isinstance(value, np.ndarray):
+        return [_to_builtin(item) for item in value.tolist()]
+    if isinstance(value, np.generic):
+        value = value.item()
+    if isinstance(value, float):
+        return value if math.isfinite(value) else None
+    if value is pd.NaT:
+        return None
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return value
+
+
+def dumps(content) -> bytes:
+    """Encodes a result as compact JSON bytes."""
+    if orjson is not None:
+        return orjson.dumps(content, default=_default, option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS)
+    return json.dumps(_to_builtin(content), separators=(",", ":"), allow_nan=False).encode()
+
+
+class FastJSONResponse(JSONResponse):
+    """
+    JSONResponse encoded with dumps. Return it from an endpoint to skip FastAPI's
+    jsonable_encoder pass, which is much slower on large results.
+    """
+
+    def render(self, content) -> bytes:
+        with stage("serialization"):
+            return dumps(content)
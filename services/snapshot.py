@@ -0,0 +1,210 @@
+import numpy as np
+import pandas as pd
+import json
+import os
+import shutil
+import sys
+import tempfile
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from datetime import datetime
+from typing import List, Optional
+from config import settings
+from database import _validate_columns, get_collection_version, get_columnar_data
+from models import RetailData
+from services.data_preprocessing import preprocess_inventory_data
+from services.filters import is_range, matches
+from services.schema import apply_schema
+
+# A snapshot is a directory with one .npy file per column of the preprocessed rows of a
+# collection, tagged with the collection version it was exported at. Numeric and date columns
+# are memory-mapped as they are, so loading them copies nothing and processes reading the same
+# snapshot share its pages through the OS page cache. String columns are stored as category
+# codes and loaded as categoricals over them, the dtype services/schema.py gives them. Rows a
+# column fails validation for are recorded per column, so a projection drops the same rows
+# get_columnar_data would.
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _snapshot_root(collection_name: str) -> str:
+    directory = settings.snapshot_dir
+    if not os.path.isabs(directory):
+        directory = os.path.join(PROJECT_ROOT, directory)
+    return os.path.join(directory, collection_name)
+
+
+def _write_json_atomic(path: str, data):
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w") as f:
+            json.dump(data, f)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+
+def _validated_columns(raw: pd.DataFrame) -> tuple:
+    """Validates each column on its own; returns the converted columns and the invalid rows per column."""
+    columns = {}
+    invalid = {}
+    for field in raw.columns:
+        validated = _validate_columns({field: raw[field]}, RetailData)
+        rejected = ~raw.index.isin(validated.index)
+        columns[field] = validated[field].reindex(raw.index)
+        if rejected.any():
+            invalid[field] = rejected
+    return pd.DataFrame(columns, index=raw.index), invalid
+
+
+def export_snapshot(collection_name: str = "retail_data", fields: List[str] = None) -> dict:
+    """
+    Writes a snapshot of the collection (all RetailData fields by default) and makes it the
+    current one. It is tagged with the collection version read before the export, so writes
+    made during the export leave it stale rather than wrong. Returns the snapshot metadata.
+    """
+    if fields is None:
+        fields = list(RetailData.model_fields)
+    version = get_collection_version(collection_name)
+    raw = get_columnar_data(RetailData, collection_name, fields=fields, validate=False)
+    df, invalid = _validated_columns(raw)
+    df = apply_schema(preprocess_inventory_data(df))
+    positions = raw.index.get_indexer(df.index)
+
+    root = _snapshot_root(collection_name)
+    os.makedirs(root, exist_ok=True)
+    tmp_dir = tempfile.mkdtemp(dir=root, prefix=".tmp-")
+    try:
+        columns = {}
+        for i, field in enumerate(fields):
+            values = df[field]
+            column = {"file": f"{i:03d}.npy"}
+            if pd.api.types.is_datetime64_any_dtype(values):
+                column["kind"] = "datetime"
+                array = values.to_numpy(dtype="datetime64[ns]")
+            elif pd.api.types.is_numeric_dtype(values):
+                column["kind"] = "numeric"
+                array = values.to_numpy()
+            else:
+                categorical = pd.Categorical(values)
+                column["kind"] = "category"
+                column["categories"] = categorical.categories.tolist()
+                array = categorical.codes
+            np.save(os.path.join(tmp_dir, column["file"]), array)
+            if field in invalid:
+                column["invalid_file"] = f"{i:03d}.invalid.npy"
+                np.save(os.path.join(tmp_dir, column["invalid_file"]), invalid[field][positions])
+            columns[field] = column
+
+        meta = {
+            "collection": collection_name,
+            "version": version,
+            "rows": int(len(df)),
+            "columns": columns,
+            "created_at": datetime.now().isoformat(),
+        }
+        with open(os.path.join(tmp_dir, "meta.json"), "w") as f:
+            json.dump(meta, f)
+
+        name = f"v{version:06d}-{datetime.now().strftime('%Y%m%d%H%M%S%f')}"
+        os.replace(tmp_dir, os.path.join(root, name))
+    except BaseException:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        raise
+
+    previous = _current_name(collection_name)
+    _write_json_atomic(os.path.join(root, "current.json"), {"name": name})
+    # The previous snapshot is kept for readers that resolved it just before the switch
+    for entry in os.listdir(root):
+        if entry.startswith("v") and entry not in (name, previous):
+            shutil.rmtree(os.path.join(root, entry), ignore_errors=True)
+
+    print(f"Exported {meta['rows']} rows of {collection_name} at version {version} to {os.path.join(root, name)}.")
+    return {**meta, "name": name}
+
+
+def _current_name(collection_name: str) -> Optional[str]:
+    try:
+        with open(os.path.join(_snapshot_root(collection_name), "current.json")) as f:
+            return json.load(f)["name"]
+    except FileNotFoundError:
+        return None
+
+
+def snapshot_info(collection_name: str = "retail_data") -> Optional[dict]:
+    """Returns the metadata of the current snapshot, or None if none was exported."""
+    name = _current_name(collection_name)
+    if name is None:
+        return None
+    with open(os.path.join(_snapshot_root(collection_name), name, "meta.json")) as f:
+        return {**json.load(f), "name": name}
+
+
+def is_snapshot_current(collection_name: str = "retail_data") -> bool:
+    """Returns True if the current snapshot was exported at the collection's current version."""
+    meta = snapshot_info(collection_name)
+    return meta is not None and meta["version"] == get_collection_version(collection_name)
+
+
+def _answers(column: dict, condition) -> bool:
+    """Returns True if a snapshot column can evaluate a query condition on its own."""
+    if column["kind"] == "category":
+        return isinstance(condition, str)
+    if column["kind"] == "datetime":
+        return is_range(condition) and all(isinstance(bound, datetime) for bound in condition.values())
+    return False
+
+
+def load_snapshot(query: dict = None, fields: List[str] = None, collection_name: str = "retail_data", meta: dict = None) -> Optional[pd.DataFrame]:
+    """
+    Returns the preprocessed rows of the current snapshot that match a query of equality
+    conditions on string fields and ranges on dates, restricted to `fields`, or None when the
+    snapshot cannot answer: there is none, it lacks a field, or the query has other conditions
+    (values of other fields may have been changed by preprocessing). When no rows are filtered out, numeric and date columns are
+    read-only memory maps of the snapshot files.
+    """
+    if meta is None:
+        meta = snapshot_info(collection_name)
+    if meta is None:
+        return None
+    query = query or {}
+    if fields is None:
+        fields = list(meta["columns"])
+    if any(field not in meta["columns"] for field in list(fields) + list(query)):
+        return None
+    if not all(_answers(meta["columns"][field], value) for field, value in query.items()):
+        return None
+
+    directory = os.path.join(_snapshot_root(collection_name), meta["name"])
+
+    def mapped(file: str) -> np.ndarray:
+        return np.load(os.path.join(directory, file), mmap_mode="r")
+
+    rows = None
+    columns = list(dict.fromkeys(list(fields) + list(query)))
+    for field in columns:
+        if "invalid_file" in meta["columns"][field]:
+            valid = ~mapped(meta["columns"][field]["invalid_file"])
+            rows = valid if rows is None else rows & valid
+    for field, value in query.items():
+        column = meta["columns"][field]
+        if column["kind"] == "datetime":
+            match = matches(mapped(column["file"]), {operator: np.datetime64(bound, "ns") for operator, bound in value.items()})
+        else:
+            # Compare codes rather than strings
+            code = column["categories"].index(value) if value in column["categories"] else -2
+            match = mapped(column["file"]) == code
+        rows = match if rows is None else rows & match
+    positions = None if rows is None else np.flatnonzero(rows)
+
+    data = {}
+    for field in fields:
+        column = meta["columns"][field]
+        values = mapped(column["file"])
+        if positions is not None:
+            values = values[positions]
+        if column["kind"] == "category":
+            # Code -1 is missing
+            values = pd.Categorical.from_codes(values, categories=column["categories"])
+        data[field] = values
+    return pd.DataFrame(data, columns=fields, copy=False)
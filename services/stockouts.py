@@ -0,0 +1,191 @@
+import numpy as np
+import pandas as pd
+import os
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from typing import Iterable
+from pymongo import DeleteMany, InsertOne
+from database import get_columnar_data, get_db, is_derived_current, mark_derived_current, EPISODES_COLLECTION
+from models import RetailData
+from services.data_preprocessing import preprocess_inventory_data, preprocess_stockouts_data
+from services.schema import apply_schema
+
+# Row fields needed to detect episodes and estimate their lost sales
+EPISODE_FIELDS = ["Date", "StoreId", "ProductID", "Inventory", "Sales", "Demand"]
+EPISODE_COLUMNS = ["StoreId", "ProductID", "start", "end", "duration", "rows", "sales", "lost_sales"]
+# retail_data fields a query answered from the episodes collection may filter on
+EPISODE_FILTER_FIELDS = {"StoreId", "ProductID"}
+# Products whose rows are loaded at once when the episodes collection is rebuilt
+EPISODE_PRODUCT_BATCH = 500
+
+
+def _empty_episodes() -> pd.DataFrame:
+    return pd.DataFrame({
+        "StoreId": pd.Series(dtype=object),
+        "ProductID": pd.Series(dtype=object),
+        "start": pd.Series(dtype="datetime64[ns]"),
+        "end": pd.Series(dtype="datetime64[ns]"),
+        "duration": pd.Series(dtype="int64"),
+        "rows": pd.Series(dtype="int64"),
+        "sales": pd.Series(dtype=float),
+        "lost_sales": pd.Series(dtype=float),
+    })
+
+
+def detect_stockout_episodes(df: pd.DataFrame, max_gap_days: int = 1) -> pd.DataFrame:
+    """
+    Finds stockout episodes: runs of consecutive days on which a store had no inventory of a
+    product (Inventory <= 0; preprocessing turns a missing Inventory into 0).
+    Rows are sorted by (StoreId, ProductID, Date) and the runs are found with NumPy run-length
+    encoding, so the cost is one sort plus a few linear passes. A run ends at the next in-stock
+    row, at the next store/product, or when the next row is more than max_gap_days later.
+
+    Returns one row per episode with StoreId, ProductID, start, end, duration (calendar days from
+    start to end inclusive), rows, sales (units sold during the episode) and lost_sales: the
+    shortfall of sales against expected demand, which is the Demand forecast of the day when
+    present and otherwise the average daily sales of the store/product on in-stock days.
+    """
+    df = df.dropna(subset=["StoreId", "ProductID", "Date"])
+    if df.empty:
+        return _empty_episodes()
+    df = df.sort_values(["StoreId", "ProductID", "Date"], kind="stable")
+
+    inventory = df["Inventory"].fillna(0).to_numpy(dtype=float)
+    sales = df["Sales"].fillna(0).to_numpy(dtype=float)
+    dates = df["Date"].to_numpy(dtype="datetime64[ns]")
+    days = dates.astype("datetime64[D]")
+    # Integer code per store/product; equal codes are adjacent after the sort
+    pairs = df.groupby(["StoreId", "ProductID"], sort=False, observed=True).ngroup().to_numpy()
+
+    out = inventory <= 0
+    if not out.any():
+        return _empty_episodes()
+
+    # A stockout row continues the previous row's episode when that row is a stockout of the
+    # same store/product no more than max_gap_days earlier
+    continues = np.zeros(len(out), dtype=bool)
+    continues[1:] = (
+        out[:-1]
+        & (pairs[1:] == pairs[:-1])
+        & (days[1:] - days[:-1] <= np.timedelta64(max_gap_days, "D"))
+    )
+    starts = out & ~continues
+
+    # Rows of an episode are contiguous, so each episode is (first row, row count)
+    stockout_rows = np.flatnonzero(out)
+    episode_ids = np.cumsum(starts)[stockout_rows] - 1
+    first = np.flatnonzero(starts)
+    counts = np.bincount(episode_ids)
+    last = first + counts - 1
+
+    expected = df["Demand"] if "Demand" in df.columns else pd.Series(np.nan, index=df.index)
+    instock_sales = df["Sales"].where(inventory > 0).groupby(pairs).transform("mean")
+    expected = pd.to_numeric(expected, errors="coerce").fillna(instock_sales).fillna(0).to_numpy(dtype=float)
+    shortfall = np.clip(expected - sales, 0, None)
+
+    return pd.DataFrame({
+        "StoreId": df["StoreId"].take(first).to_numpy(dtype=object),
+        "ProductID": df["ProductID"].take(first).to_numpy(dtype=object),
+        "start": dates[first],
+        "end": dates[last],
+        "duration": (days[last] - days[first]).astype("int64") + 1,
+        "rows": counts.astype("int64"),
+        "sales": np.bincount(episode_ids, weights=sales[stockout_rows]),
+        "lost_sales": np.bincount(episode_ids, weights=shortfall[stockout_rows]),
+    })
+
+
+def summarize_episodes(episodes: pd.DataFrame) -> dict:
+    """
+    Returns the number of episodes, their average and longest duration in days and the total
+    estimated lost sales.
+    """
+    if episodes.empty:
+        return {"episode_count": 0, "average_duration": 0, "max_duration": 0, "lost_sales": 0.0}
+    return {
+        "episode_count": int(len(episodes)),
+        "average_duration": float(episodes["duration"].mean()),
+        "max_duration": int(episodes["duration"].max()),
+        "lost_sales": float(episodes["lost_sales"].sum()),
+    }
+
+
+def episode_heatmap(episodes: pd.DataFrame) -> pd.DataFrame:
+    """
+    Counts episodes and their stockout days per ProductID and month, attributing each episode
+    to the month it starts in.
+    """
+    if episodes.empty:
+        return pd.DataFrame(columns=["ProductID", "month", "episode_count", "stockout_days"])
+    months = episodes["start"].dt.to_period("M").astype(str)
+    return (
+        episodes.assign(month=months)
+        .groupby(["ProductID", "month"])
+        .agg(episode_count=("duration", "size"), stockout_days=("duration", "sum"))
+        .reset_index()
+    )
+
+
+def episode_records(episodes: pd.DataFrame) -> list:
+    """Returns episodes as JSON-friendly dicts with ISO dates."""
+    records = episodes.assign(
+        start=episodes["start"].dt.strftime("%Y-%m-%d"),
+        end=episodes["end"].dt.strftime("%Y-%m-%d"),
+    )
+    return records.to_dict("records")
+
+
+def is_episodes_current() -> bool:
+    """
+    Returns True if the episodes collection was last built or refreshed at the current
+    retail_data version.
+    """
+    return is_derived_current(EPISODES_COLLECTION)
+
+
+def _load_rows(product_ids: list) -> pd.DataFrame:
+    df = get_columnar_data(RetailData, "retail_data", {"ProductID": {"$in": product_ids}}, fields=EPISODE_FIELDS)
+    return apply_schema(preprocess_inventory_data(df))
+
+
+def refresh_stockout_episodes(product_ids: Iterable[str] = None):
+    """
+    Recomputes the stored episodes of the given products from their retail_data rows, or of all
+    products when product_ids is None. An episode can span any stretch of history, so all rows
+    of a product are read; products are processed EPISODE_PRODUCT_BATCH at a time.
+    """
+    collection = get_db()[EPISODES_COLLECTION]
+    rebuild = product_ids is None
+    if rebuild:
+        product_ids = get_db().retail_data.distinct("ProductID")
+    product_ids = sorted(product_id for product_id in product_ids if product_id is not None)
+
+    num_episodes = 0
+    for i in range(0, len(product_ids), EPISODE_PRODUCT_BATCH):
+        batch = product_ids[i:i + EPISODE_PRODUCT_BATCH]
+        episodes = detect_stockout_episodes(_load_rows(batch))
+        operations = [DeleteMany({"ProductID": {"$in": batch}})]
+        operations += [InsertOne(record) for record in episodes.to_dict("records")]
+        collection.bulk_write(operations, ordered=True)
+        num_episodes += len(episodes)
+
+    if rebuild:
+        # Products that no longer have rows
+        collection.delete_many({"ProductID": {"$nin": product_ids}})
+    mark_derived_current(EPISODES_COLLECTION)
+    print(f"Stored {num_episodes} stockout episodes of {len(product_ids)} products.")
+
+
+def load_stockout_episodes(query: dict = None) -> pd.DataFrame:
+    """
+    Returns the stored episodes matching a query on StoreId or ProductID.
+    """
+    projection = {field: 1 for field in EPISODE_COLUMNS}
+    projection["_id"] = 0
+    documents = list(get_db()[EPISODES_COLLECTION].find(query or {}, projection))
+    if not documents:
+        return _empty_episodes()
+    episodes = preprocess_stockouts_data(pd.DataFrame(documents, columns=EPISODE_COLUMNS))
+    episodes["start"] = pd.to_datetime(episodes["start"])
+    episodes["end"] = pd.to_datetime(episodes["end"])
+    return episodes.sort_values(["StoreId", "ProductID", "start"], kind="stable").reset_index(drop=True)
@@ -0,0 +1,71 @@
+import csv
+import io
+import itertools
+from typing import Iterable, Iterator, List, Optional
+from pydantic import BaseModel
+from telemetry import stage
+from services.serialization import dumps
+
+# Output formats that are streamed row by row instead of serialized as one JSON document
+STREAM_MEDIA_TYPES = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv",
+}
+OUTPUT_FORMATS = ("json",) + tuple(STREAM_MEDIA_TYPES)
+
+
+def resolve_stream_format(output_format: Optional[str] = None, accept: Optional[str] = None) -> Optional[str]:
+    """
+    Picks the streaming format from an explicit output format, falling back to the Accept header.
+    Returns "ndjson" or "csv", or None for a regular JSON response.
+    Raises ValueError for an unknown output format.
+    """
+    if output_format:
+        if output_format not in OUTPUT_FORMATS:
+            raise ValueError(f"Invalid format: {output_format}. Allowed formats are: {', '.join(OUTPUT_FORMATS)}")
+        return output_format if output_format in STREAM_MEDIA_TYPES else None
+    if accept:
+        if "application/x-ndjson" in accept or "application/ndjson" in accept:
+            return "ndjson"
+        if "text/csv" in accept:
+            return "csv"
+    return None
+
+
+def iter_ndjson(batches: Iterable[List[BaseModel]]) -> Iterator[bytes]:
+    """Encodes batches of models as newline-delimited JSON, one chunk per batch."""
+    for batch in batches:
+        with stage("serialization"):
+            chunk = "".join(item.model_dump_json() + "\n" for item in batch).encode()
+        yield chunk
+
+
+def iter_ndjson_dicts(results: Iterable[dict], batch_size: int) -> Iterator[bytes]:
+    """Encodes dicts (which may hold NumPy values, NaN and datetimes) as newline-delimited JSON, batch_size dicts per chunk."""
+    results = iter(results)
+    while True:
+        batch = list(itertools.islice(results, batch_size))
+        if not batch:
+            break
+        with stage("serialization"):
+            chunk = b"".join(dumps(result) + b"\n" for result in batch)
+        yield chunk
+
+
+def iter_csv(batches: Iterable[List[BaseModel]], columns: List[str]) -> Iterator[bytes]:
+    """
+    Encodes batches of models as CSV with the given columns, one chunk per batch after the header.
+    Fields outside `columns` are left out.
+    """
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=columns, extrasaction='ignore')
+    writer.writeheader()
+    yield buffer.getvalue().encode()
+
+    for batch in batches:
+        with stage("serialization"):
+            buffer.seek(0)
+            buffer.truncate()
+            writer.writerows(item.model_dump(mode="json") for item in batch)
+            chunk = buffer.getvalue().encode()
+        yield chunk
@@ -0,0 +1,313 @@
+import contextvars
+import functools
+import inspect
+import threading
+import time
+from bisect import bisect_left
+from typing import Dict, Tuple
+from fastapi.routing import APIRoute
+from config import settings
+
+# In-process request telemetry: per-stage timers and row/byte counters, aggregated into
+# histograms per endpoint and exposed in the Prometheus text format by routers/internal.py.
+#
+# Stages (exclusive time: a stage nested in another is not counted in the outer one):
+#   fetch          reading rows from MongoDB (cursor, aggregation or count) or from a snapshot
+#   validation     checking fetched rows against the Pydantic model
+#   frame_build    building DataFrames from the fetched documents
+#   preprocess     preprocess_inventory_data
+#   compute        the rest of the endpoint, i.e. the metric math of the analytics routes
+#   serialization  encoding the response: from the endpoint's return to the response start,
+#                  plus the encoding of each chunk of a streamed response
+#
+# Recording costs a few perf_counter calls and one uncontended lock per stage, so it stays on
+# by default; set TELEMETRY_ENABLED=false to turn it off.
+
+COUNTERS = ("rows_fetched", "rows_rejected", "bytes_out")
+# Upper bounds of the latency histogram buckets in seconds (an implicit +Inf bucket follows)
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+# Endpoint label of work done outside a request, e.g. by scripts and reporting jobs
+NO_ENDPOINT = "none"
+# Requests to these path prefixes (the scrape itself) are not recorded
+EXCLUDED_PREFIXES = ("/internal/",)
+
+_lock = threading.Lock()
+_request_seconds: Dict[str, "Histogram"] = {}
+_stage_seconds: Dict[Tuple[str, str], "Histogram"] = {}
+_counters: Dict[Tuple[str, str], int] = {}
+
+_current_request = contextvars.ContextVar("telemetry_request", default=None)
+_current_stage = contextvars.ContextVar("telemetry_stage", default=None)
+
+
+class Histogram:
+    """Counts of observations per latency bucket, with their sum."""
+
+    __slots__ = ("counts", "sum", "count")
+
+    def __init__(self):
+        self.counts = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(LATENCY_BUCKETS, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self) -> list:
+        total, result = 0, []
+        for count in self.counts:
+            total += count
+            result.append(total)
+        return result
+
+
+class _RequestStats:
+    """Stage times and counters of one request, recorded per endpoint when it completes."""
+
+    __slots__ = ("start", "stages", "counters", "endpoint_done", "lock")
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.stages = {}
+        self.counters = {}
+        self.endpoint_done = None
+        self.lock = threading.Lock()
+
+    def add(self, table: dict, name: str, value):
+        with self.lock:
+            table[name] = table.get(name, 0) + value
+
+
+def _histogram(table: dict, key) -> Histogram:
+    # Callers hold _lock
+    histogram = table.get(key)
+    if histogram is None:
+        histogram = table[key] = Histogram()
+    return histogram
+
+
+def _observe_stage(endpoint: str, name: str, seconds: float):
+    with _lock:
+        _histogram(_stage_seconds, (endpoint, name)).observe(seconds)
+
+
+def _add_counter(endpoint: str, name: str, value: int):
+    with _lock:
+        _counters[(endpoint, name)] = _counters.get((endpoint, name), 0) + value
+
+
+class stage:
+    """
+    Times a block as one stage of the current request:
+
+        with stage("fetch"):
+            ...
+
+    Outside a request the time is recorded under the endpoint label "none".
+    """
+
+    __slots__ = ("name", "start", "child", "token")
+
+    def __init__(self, name: str):
+        self.name = name
+        self.token = None
+
+    def __enter__(self):
+        if settings.telemetry_enabled:
+            self.child = 0.0
+            self.token = _current_stage.set(self)
+            self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.token is None:
+            return False
+        elapsed = time.perf_counter() - self.start
+        _current_stage.reset(self.token)
+        self.token = None
+        parent = _current_stage.get()
+        if parent is not None:
+            parent.child += elapsed
+        seconds = max(elapsed - self.child, 0.0)
+        request = _current_request.get()
+        if request is None:
+            _observe_stage(NO_ENDPOINT, self.name, seconds)
+        else:
+            request.add(request.stages, self.name, seconds)
+        return False
+
+
+def timed(name: str):
+    """Decorator recording every call of a function as the given stage."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with stage(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def count(name: str, value: int):
+    """Adds value to a counter of the current request (rows_fetched, rows_rejected, bytes_out)."""
+    if not value or not settings.telemetry_enabled:
+        return
+    request = _current_request.get()
+    if request is None:
+        _add_counter(NO_ENDPOINT, name, value)
+    else:
+        request.add(request.counters, name, value)
+
+
+def _endpoint_label(scope: dict) -> str:
+    """The method and path template of the route that served the request, e.g. "GET /inventory/metrics"."""
+    route = scope.get("route")
+    template = getattr(route, "path", None)
+    if template is None:
+        return f"{scope.get('method', '')} unmatched"
+    # Routes of an included router may only know their path below the router's prefix
+    path = scope["path"]
+    prefix = ""
+    for i, char in enumerate(path):
+        if char == "/" and route.path_regex.match(path[i:]):
+            prefix = path[:i]
+            break
+    return f"{scope.get('method', '')} {prefix}{template}"
+
+
+def _record_request(endpoint: str, request: _RequestStats):
+    seconds = time.perf_counter() - request.start
+    with _lock:
+        _histogram(_request_seconds, endpoint).observe(seconds)
+        for name, value in request.stages.items():
+            _histogram(_stage_seconds, (endpoint, name)).observe(value)
+        for name, value in request.counters.items():
+            _counters[(endpoint, name)] = _counters.get((endpoint, name), 0) + value
+
+
+class TelemetryMiddleware:
+    """
+    ASGI middleware measuring each HTTP request from its start to the last byte of the response,
+    counting the response bytes and recording the request's stages under its route.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not settings.telemetry_enabled or scope["path"].startswith(EXCLUDED_PREFIXES):
+            await self.app(scope, receive, send)
+            return
+
+        request = _RequestStats()
+        token = _current_request.set(request)
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start" and request.endpoint_done is not None:
+                request.add(request.stages, "serialization", time.perf_counter() - request.endpoint_done)
+            elif message["type"] == "http.response.body":
+                request.add(request.counters, "bytes_out", len(message.get("body", b"")))
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _current_request.reset(token)
+            _record_request(_endpoint_label(scope), request)
+
+
+class TimedRoute(APIRoute):
+    """
+    Route class that records the endpoint function as the "compute" stage and marks when it
+    returns, so the time FastAPI then spends encoding the result counts as "serialization".
+    """
+
+    def __init__(self, path: str, endpoint, **kwargs):
+        if inspect.iscoroutinefunction(endpoint):
+            @functools.wraps(endpoint)
+            async def timed_endpoint(*args, **kw):
+                with stage("compute"):
+                    result = await endpoint(*args, **kw)
+                _mark_endpoint_done()
+                return result
+        else:
+            @functools.wraps(endpoint)
+            def timed_endpoint(*args, **kw):
+                with stage("compute"):
+                    result = endpoint(*args, **kw)
+                _mark_endpoint_done()
+                return result
+        super().__init__(path, timed_endpoint, **kwargs)
+
+
+def _mark_endpoint_done():
+    request = _current_request.get()
+    if request is not None:
+        request.endpoint_done = time.perf_counter()
+
+
+def snapshot() -> dict:
+    """Returns a copy of the recorded histograms and counters."""
+    def histogram_dict(histogram: Histogram) -> dict:
+        return {
+            "buckets": dict(zip([str(bound) for bound in LATENCY_BUCKETS] + ["+Inf"], histogram.cumulative())),
+            "sum": histogram.sum,
+            "count": histogram.count,
+        }
+
+    with _lock:
+        return {
+            "requests": {endpoint: histogram_dict(h) for endpoint, h in _request_seconds.items()},
+            "stages": {f"{endpoint}|{name}": histogram_dict(h) for (endpoint, name), h in _stage_seconds.items()},
+            "counters": {f"{endpoint}|{name}": value for (endpoint, name), value in _counters.items()},
+        }
+
+
+def reset():
+    """Discards everything recorded so far."""
+    with _lock:
+        _request_seconds.clear()
+        _stage_seconds.clear()
+        _counters.clear()
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _histogram_lines(name: str, labels: str, histogram: Histogram) -> list:
+    lines = []
+    for bound, total in zip([str(bound) for bound in LATENCY_BUCKETS] + ["+Inf"], histogram.cumulative()):
+        lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {total}')
+    lines.append(f"{name}_sum{{{labels}}} {histogram.sum:.9g}")
+    lines.append(f"{name}_count{{{labels}}} {histogram.count}")
+    return lines
+
+
+def render_prometheus() -> str:
+    """Renders the recorded metrics in the Prometheus text exposition format."""
+    lines = [
+        "# HELP inventory_request_duration_seconds Time from the start of a request to the end of its response.",
+        "# TYPE inventory_request_duration_seconds histogram",
+    ]
+    with _lock:
+        for endpoint, histogram in sorted(_request_seconds.items()):
+            lines += _histogram_lines("inventory_request_duration_seconds", f'endpoint="{_escape(endpoint)}"', histogram)
+
+        lines += [
+            "# HELP inventory_stage_duration_seconds Time per request spent in each stage.",
+            "# TYPE inventory_stage_duration_seconds histogram",
+        ]
+        for (endpoint, name), histogram in sorted(_stage_seconds.items()):
+            labels = f'endpoint="{_escape(endpoint)}",stage="{name}"'
+            lines += _histogram_lines("inventory_stage_duration_seconds", labels, histogram)
+
+        for name in COUNTERS:
+            lines.append(f"# TYPE inventory_{name}_total counter")
+            lines += [
+                f'inventory_{name}_total{{endpoint="{_escape(endpoint)}"}} {value}'
+                for (endpoint, counter), value in sorted(_counters.items()) if counter == name
+            ]
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,109 @@
+from datetime import datetime, timedelta
+import pandas as pd
+import pytest
+import database
+from config import settings
+from models import InventoryFilter
+from services import calculations
+from services.dataset import dataset_cache
+from services.rollup import rebuild_rollup
+
+mongomock = pytest.importorskip("mongomock")
+import mongomock.aggregate
+
+START = datetime(2024, 1, 1)
+DAYS = 120
+FILTERS = [None, InventoryFilter(store_id="S1"), InventoryFilter(category="Toys")]
+
+
+def _rows():
+    """
+    Two products in three stores, with stockouts and a missing Inventory. S0 and S1 end on the same
+    day and S2 ten days earlier.
+    """
+    rows = []
+    for product in range(2):
+        for store in range(3):
+            for day in range(DAYS - 10 * (store // 2)):
+                inventory = (product * 7 + store * 3 + day * 5) % 23
+                rows.append({
+                    "Date": START + timedelta(days=day), "StoreId": f"S{store}", "ProductID": f"P{product}",
+                    "Category": "Toys" if product == 0 else "Food",
+                    "Inventory": None if day == 3 else inventory, "Sales": (product + store + day) % 6,
+                    "Price": 10.0 + product, "cost": 8.0 + product,
+                })
+    # Newest rows first, so Mongo's natural order is not the date order
+    return rows[::-1]
+
+
+@pytest.fixture
+def retail_data(monkeypatch):
+    """
+    retail_data with an up-to-date rollup. mongomock lacks the $convert and $toDate operators
+    the pipelines use on Date, so they pass datetimes through and turn anything else into null.
+    """
+    handle = mongomock.aggregate._Parser._handle_type_convertion_operator
+
+    def handle_dates(self, operator, values):
+        if operator == "$toDate" or (operator == "$convert" and values.get("to") == "date"):
+            try:
+                value = self.parse(values["input"] if operator == "$convert" else values)
+            except KeyError:
+                value = None
+            return value if isinstance(value, datetime) else None
+        return handle(self, operator, values)
+
+    monkeypatch.setattr(mongomock.aggregate._Parser, "_handle_type_convertion_operator", handle_dates)
+    monkeypatch.setattr(mongomock.aggregate, "type_convertion_operators", mongomock.aggregate.type_convertion_operators + ["$toDate"])
+    monkeypatch.setattr(settings, "use_snapshot", False)
+
+    database.use_client(mongomock.MongoClient())
+    database.get_db().retail_data.insert_many(_rows())
+    database.bump_collection_version("retail_data")
+    rebuild_rollup()
+    dataset_cache.clear()
+    yield database.get_db().retail_data
+    dataset_cache.clear()
+    database.close_client()
+
+
+@pytest.mark.parametrize("filters", FILTERS)
+def test_product_metrics_match_across_paths(retail_data, filters):
+    from_rollup = calculations.get_product_metrics(filters=filters)
+    from_rows = calculations.get_product_metrics(filters=filters, use_rollup=False)
+
+    columns = ["last_inventory", "first_date", "last_date", "total_sales", "sales_rows", "days_of_supply", "carrying_cost"]
+    from_rollup, from_rows = (metrics[columns].set_axis(metrics.index.astype(str)).sort_index() for metrics in (from_rollup, from_rows))
+    pd.testing.assert_frame_equal(from_rollup, from_rows, check_dtype=False)
+
+
+def test_current_inventory_sums_the_latest_inventory_of_each_store(retail_data):
+    df = pd.DataFrame(_rows())
+    df["Inventory"] = df["Inventory"].fillna(0)
+    latest = df.sort_values("Date").groupby(["ProductID", "StoreId"])["Inventory"].last()
+    expected = latest.groupby(level="ProductID").sum()
+
+    for use_rollup in (True, False):
+        metrics = calculations.get_product_metrics(use_rollup=use_rollup)
+        assert metrics["last_inventory"].set_axis(metrics.index.astype(str)).sort_index().tolist() == expected.tolist()
+
+
+@pytest.mark.parametrize("filters", FILTERS)
+def test_stockout_rate_matches_across_paths(retail_data, filters):
+    results = [
+        calculations.calculate_stockout_rate(filters=filters, compact=True),
+        calculations.calculate_stockout_rate(filters=filters, compact=True, use_rollup=False),
+        calculations.calculate_stockout_rate(filters=filters, compact=True, use_rollup=False, use_aggregation=False),
+    ]
+
+    assert results[0]["stockout_frequency"] > 0
+    assert results[0] == results[1] == results[2]
+
+
+@pytest.mark.parametrize("filters", FILTERS)
+@pytest.mark.parametrize("period", calculations.ROLLUP_PERIODS)
+def test_turnover_matches_across_paths(retail_data, filters, period):
+    from_rollup = calculations.calculate_turnover(period=period, filters=filters, compact=True)
+    from_rows = calculations.calculate_turnover(period=period, filters=filters, compact=True, use_rollup=False)
+
+    assert from_rollup["turnover_ratio"] == pytest.approx(from_rows["turnover_ratio"])
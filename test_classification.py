@@ -0,0 +1,81 @@
+from datetime import datetime, timedelta
+import pandas as pd
+import pytest
+import database
+from config import settings
+from services import classification, ingestion
+from services.rollup import load_rollup
+
+mongomock = pytest.importorskip("mongomock")
+
+# 60%, 80%, 90%, 96% and 100% of cumulative sales value: classes A, A, B, C and C
+SALES = {"P0": 60, "P1": 20, "P2": 10, "P3": 6, "P4": 4}
+
+
+def _rows():
+    start = datetime(2024, 1, 1)
+    return [
+        {"Date": start + timedelta(days=day), "StoreId": "S0", "ProductID": product, "Category": "Toys",
+         "Inventory": 20, "Sales": sales, "Price": 10.0, "cost": 8.0}
+        for product, sales in SALES.items() for day in range(90)
+    ]
+
+
+@pytest.fixture
+def rollup_builds(monkeypatch):
+    """
+    Counts rollup builds. mongomock cannot run the rollup pipeline ($convert), so the
+    documents classification reads are built with pandas.
+    """
+    builds = []
+
+    def rebuild_rollup():
+        builds.append(database.get_collection_version("retail_data"))
+        df = pd.DataFrame(list(database.get_db().retail_data.find()))
+        df["month"] = df["Date"].dt.strftime("%Y-%m")
+        df["cogs_sum"] = df["Sales"] * df["Price"]
+        rollup = df.groupby(["ProductID", "StoreId", "month", "Category"], as_index=False).agg(
+            sales_sum=("Sales", "sum"), cogs_sum=("cogs_sum", "sum"))
+        collection = database.get_db()[database.ROLLUP_COLLECTION]
+        collection.delete_many({})
+        collection.insert_many(rollup.to_dict("records"))
+        database.mark_derived_current(database.ROLLUP_COLLECTION)
+
+    # pymongo passes ReplaceOne's sort to bulk writes, which mongomock does not accept
+    add_replace = mongomock.collection.BulkOperationBuilder.add_replace
+    monkeypatch.setattr(mongomock.collection.BulkOperationBuilder, "add_replace",
+                        lambda self, *args, sort=None, **kwargs: add_replace(self, *args, **kwargs))
+
+    database.use_client(mongomock.MongoClient())
+    monkeypatch.setattr(ingestion, "rebuild_rollup", rebuild_rollup)
+    monkeypatch.setattr(classification, "rebuild_rollup", rebuild_rollup)
+    monkeypatch.setattr(ingestion, "refresh_stockout_episodes", lambda *args: None)
+    yield builds
+    database.close_client()
+
+
+def test_ingest_builds_the_rollup_once(rollup_builds):
+    ingestion.ingest_records(_rows(), "retail_data")
+    version = database.get_collection_version("retail_data")
+
+    assert len(rollup_builds) == 1
+    assert database.get_db().retail_data.distinct("abc_class", {"ProductID": "P0"}) == ["A"]
+
+    # Reloading the same data writes the stored classes with the rows and leaves them as they are
+    ingestion.ingest_records(_rows(), "retail_data")
+
+    assert len(rollup_builds) == 2
+    assert database.get_collection_version("retail_data") == version + 1
+    assert database.is_derived_current(database.ROLLUP_COLLECTION)
+    assert database.get_db().retail_data.count_documents({"abc_class": None}) == 0
+
+
+@pytest.mark.parametrize("by_store", [False, True])
+def test_rollup_abc_class_filter_joins_product_classes(rollup_builds, monkeypatch, by_store):
+    monkeypatch.setattr(settings, "classification_by_store", by_store)
+    ingestion.ingest_records(_rows(), "retail_data")
+
+    assert set(load_rollup({"abc_class": "A"})["ProductID"]) == {"P0", "P1"}
+    assert set(load_rollup({"abc_class": "A", "ProductID": "P1"})["ProductID"]) == {"P1"}
+    assert load_rollup({"abc_class": "A", "ProductID": "P2"}).empty
+    assert load_rollup({"abc_class": "Z"}).empty
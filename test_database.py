@@ -0,0 +1,41 @@
+from datetime import datetime
+import pytest
+import database
+from models import RetailData
+
+mongomock = pytest.importorskip("mongomock")
+
+
+@pytest.fixture
+def retail_data():
+    database.use_client(mongomock.MongoClient())
+    yield database.get_db().retail_data
+    database.close_client()
+
+
+def test_columnar_validation_drops_the_rows_the_model_rejects(retail_data):
+    base = {"Date": datetime(2024, 1, 1), "StoreId": "S0", "ProductID": "P0"}
+    retail_data.insert_many([
+        {**base, "Inventory": 5, "abc_class": "A"},
+        {**base, "Inventory": None, "abc_class": None},
+        {**base, "Inventory": 2.5},
+        {**base, "Inventory": "x"},
+        {**base, "abc_class": 3},
+        {**base, "Price": "abc"},
+        {**base, "StoreId": None},
+    ])
+
+    rows = database.get_validated_data(RetailData)
+    df = database.get_columnar_data(RetailData)
+
+    assert len(rows) == len(df) == 2
+    assert df["Inventory"].isna().sum() == 1
+
+
+@pytest.mark.parametrize("mode", ["replace", "merge"])
+def test_insert_data_bumps_the_version_once(retail_data, mode):
+    version = database.get_collection_version("retail_data")
+
+    database.insert_data([{"Date": datetime(2024, 1, 1), "StoreId": "S0", "ProductID": "P0", "Inventory": 5}], "retail_data", mode)
+
+    assert database.get_collection_version("retail_data") == version + 1
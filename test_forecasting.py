@@ -0,0 +1,72 @@
+import json
+from datetime import datetime, timedelta
+import pytest
+from fastapi.testclient import TestClient
+import database
+import main
+from config import settings
+from services import forecasting
+
+mongomock = pytest.importorskip("mongomock")
+
+
+def _rows(products, stores, start, days):
+    return [
+        {"Date": start + timedelta(days=day), "StoreId": f"S{store}", "ProductID": f"P{product}",
+         "Inventory": 50, "Sales": (product + store + day) % 7, "Price": 10.0}
+        for product in range(products) for store in range(stores) for day in range(days)
+    ]
+
+
+@pytest.fixture
+def retail_data(tmp_path, monkeypatch):
+    database.use_client(mongomock.MongoClient())
+    monkeypatch.setattr(settings, "forecast_model_dir", str(tmp_path))
+    monkeypatch.setattr(settings, "forecast_workers", 1)
+    forecasting._models_cache.update(version=None, models=None, meta=None)
+    yield database.get_db().retail_data
+    database.close_client()
+
+
+@pytest.mark.parametrize("by_store", [False, True])
+def test_update_forecasts_incrementally(retail_data, by_store):
+    start = datetime(2024, 1, 1)
+    retail_data.insert_many(_rows(3, 2, start, 60))
+    forecasting.train_forecasts(by_store=by_store)
+
+    # Later days only, so every series is updated and none is refitted
+    retail_data.insert_many(_rows(3, 2, start + timedelta(days=60), 5))
+    meta = forecasting.update_forecasts(["P0", "P1", "P2"], since=start + timedelta(days=60))
+
+    models, _ = forecasting.load_models()
+    assert meta["fitted_series"] == 0
+    assert meta["updated_series"] == (6 if by_store else 3)
+    assert list(models.index.names) == forecasting.series_keys(by_store)
+    assert (models["last_date"] == start + timedelta(days=64)).all()
+
+
+def test_update_forecasts_without_changes(retail_data):
+    retail_data.insert_many(_rows(2, 1, datetime(2024, 1, 1), 30))
+    forecasting.train_forecasts(by_store=False)
+
+    meta = forecasting.update_forecasts(["P0", "P1"])
+
+    models, _ = forecasting.load_models()
+    assert meta["num_series"] == 2
+    assert list(models.index.names) == ["ProductID"]
+
+
+@pytest.mark.parametrize("by_store", [False, True])
+def test_get_forecasts_filters(retail_data, by_store):
+    retail_data.insert_many(_rows(2, 2, datetime(2024, 1, 1), 30))
+    forecasting.train_forecasts(by_store=by_store)
+    client = TestClient(main.app)
+
+    response = client.get("/forecast", params={"product_id": "P1", "store_id": "S1"})
+    if by_store:
+        assert response.status_code == 200
+        assert [(line["ProductID"], line["StoreId"]) for line in map(json.loads, response.text.splitlines())] == [("P1", "S1")]
+    else:
+        assert response.status_code == 400
+    assert client.get("/forecast", params={"product_id": "P9"}).status_code == 404
+    assert client.get("/forecast", params={"product_id": "P1"}).status_code == 200
@@ -0,0 +1,49 @@
+import io
+from datetime import datetime
+import pytest
+import database
+from services.ingestion import ingest_csv
+
+mongomock = pytest.importorskip("mongomock")
+
+HEADER = "Date,StoreId,ProductID,Inventory,Sales\n"
+
+
+@pytest.fixture
+def retail_data():
+    database.use_client(mongomock.MongoClient())
+    collection = database.get_db().retail_data
+    collection.insert_many([
+        {"Date": datetime(2024, 1, 1), "StoreId": "S0", "ProductID": "OLD", "Inventory": 5, "Sales": 1},
+        {"Date": datetime(2024, 1, 2), "StoreId": "S0", "ProductID": "OLD", "Inventory": 4, "Sales": 1},
+    ])
+    yield collection
+    database.close_client()
+
+
+def _csv(rows: list) -> io.BytesIO:
+    return io.BytesIO((HEADER + "".join(rows)).encode())
+
+
+def test_replace_keeps_data_when_a_later_chunk_fails(retail_data):
+    rows = [f"2024-02-{day:02d},S1,NEW,10,2\n" for day in range(1, 7)]
+    rows[4] = '"2024-02-05,S1,NEW,10,2\n' # Unclosed quote, in the third chunk
+    version = database.get_collection_version("retail_data")
+
+    with pytest.raises(Exception):
+        ingest_csv(_csv(rows), "retail_data", chunk_rows=2)
+
+    assert sorted(doc["ProductID"] for doc in retail_data.find()) == ["OLD", "OLD"]
+    assert database.get_collection_version("retail_data") == version
+    assert all("staging" not in name for name in database.get_db().list_collection_names())
+
+
+def test_replace_swaps_in_every_chunk(retail_data):
+    rows = [f"2024-02-{day:02d},S1,NEW,10,2\n" for day in range(1, 6)]
+
+    stats = ingest_csv(_csv(rows), "retail_data", chunk_rows=2)
+
+    assert stats["rows"] == 5
+    assert sorted(doc["ProductID"] for doc in retail_data.find()) == ["NEW"] * 5
+    assert "retail_data_key" in retail_data.index_information()
+    assert all("staging" not in name for name in database.get_db().list_collection_names())